@@ -23,6 +23,51 @@ def to_list(value):
     return loads(value)
 
 
+def to_number(value):
+    """
+    An int or float from a number or numeric string; integral floats
+    become ints so labels read 15 rather than 15.0.
+    """
+    if isinstance(value, bool):
+        raise ValueError("{val} is not a number.".format(val=value))
+    number = float(value)
+    if number != number or number in (float('inf'), float('-inf')):
+        raise ValueError("{val} is not a finite number.".format(val=value))
+    return int(number) if number.is_integer() else number
+
+
+def to_number_list(value, name, *args, maximum=None):
+    """
+    A JSON list of non-negative numbers, at most ``maximum`` when given.
+    """
+    try:
+        values = loads(value)
+        if not isinstance(values, list):
+            raise ValueError
+        numbers = [to_number(item) for item in values]
+    except (ValueError, TypeError):
+        raise ValueError(
+            "{param} must be a list of numbers. "
+            "You gave the value: {val}".format(param=name, val=value)
+        )
+    for number in numbers:
+        if number < 0:
+            raise ValueError(
+                "{param} values must not be negative. "
+                "You gave the value: {val}".format(param=name, val=value)
+            )
+        if maximum is not None and number > maximum:
+            raise ValueError(
+                "{param} values must be at most {maximum}. "
+                "You gave the value: {val}".format(param=name, maximum=maximum, val=value)
+            )
+    return numbers
+
+
+def to_percentile_list(value, name, *args):
+    return to_number_list(value, name, maximum=100)
+
+
 def to_bool(value):
     return loads(value) is True
 
@@ -1,8 +1,10 @@
 # security/__init__.py
+import click
 from flask import Blueprint
 from flask_restful import Api
 
 from app import app_instance, admin, db
+from app.extensions import health
 from app.server import build_routes
 from .tasks import register_tasks
 from .views import (
@@ -29,6 +31,12 @@ with app_instance.app_context():
     # Creates any models that have been imported
     db.create_all()
 
+    # Adds columns and indexes declared since the tables were created
+    from .storage import ensure_columns, ensure_indexes, check_report_query_plans, partition_monthly
+    ensure_columns()
+    ensure_indexes()
+    health.add_check(check_report_query_plans)
+
     # Report Views: All
     admin.add_view(SLAReportView(SlaReportModel, db.session, name='SLA Reports', category="SLA Admin"))
     admin.add_view(SLASummaryReportView(SummarySLAReportModel, db.session, name='Summary Reports', category="SLA Admin"))
@@ -45,6 +53,17 @@ with app_instance.app_context():
     admin.add_view(EventDataView(EventTableModel, db.session, name='Raw Event Data', category="SLA Admin"))
 
 
+@app_instance.cli.command('partition-report-tables')
+@click.option('--drop-foreign-keys', is_flag=True,
+              help='Drop the foreign keys referencing the tables, such as c_event.call_id.')
+def partition_report_tables(drop_foreign_keys):
+    """
+    Move c_call and c_event to monthly range partitions (PostgreSQL 11+).
+    """
+    for model in (CallTableModel, EventTableModel):
+        partition_monthly(model, drop_foreign_keys=drop_foreign_keys)
+
+
 app_instance.register_blueprint(sla_report_bp)
 
 # Inject module routes
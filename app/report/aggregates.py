@@ -0,0 +1,464 @@
+# report/aggregates.py
+import math
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as np
+
+from .kernels import WAIT_THRESHOLDS, MIN_LOST_SECONDS, sketch_kernel
+
+HEADERS = [
+    'I/C Presented',
+    'I/C Live Answered',
+    'I/C Lost',
+    'Voice Mails',
+    'Answered Incoming Duration',
+    'Answered Wait Duration',
+    'Lost Wait Duration',
+    'Calls Ans Within 15',
+    'Calls Ans Within 30',
+    'Calls Ans Within 45',
+    'Calls Ans Within 60',
+    'Calls Ans Within 999',
+    'Call Ans + 999',
+    'Longest Waiting Answered'
+]
+
+MICROSECONDS = 1000000
+
+# Positions of the HEADERS that hold durations
+DURATION_FIELDS = (4, 5, 6, 13)
+
+_WITHIN_15, _WITHIN_30, _WITHIN_45, _WITHIN_60, _WITHIN_999 = [
+    threshold * MICROSECONDS for threshold in WAIT_THRESHOLDS
+]
+_MIN_LOST = MIN_LOST_SECONDS * MICROSECONDS
+
+
+# One-second wait bins from 0 to 999 seconds plus an overflow bin
+HISTOGRAM_SECONDS = WAIT_THRESHOLDS[-1]
+OVERFLOW_BIN = HISTOGRAM_SECONDS + 1
+HISTOGRAM_BINS = OVERFLOW_BIN + 1
+
+
+def to_microseconds(delta):
+    return (delta.days * 86400 + delta.seconds) * MICROSECONDS + delta.microseconds
+
+
+def wait_bin(duration):
+    """
+    Histogram bin of a duration in microseconds: bin n holds waits in
+    (n - 1, n] seconds, so counting bins 0..n gives the calls that waited
+    at most n seconds.
+    """
+    seconds = -(-duration // MICROSECONDS)
+    if seconds <= 0:
+        return 0
+    return seconds if seconds <= HISTOGRAM_SECONDS else OVERFLOW_BIN
+
+
+class WaitHistogram(object):
+    """
+    Sparse fixed-resolution histogram of wait times. Histograms merge by
+    addition and every metric is computed in O(bins).
+    """
+    __slots__ = ('counts',)
+
+    def __init__(self, counts=None):
+        self.counts = counts if counts is not None else {}
+
+    def add(self, duration, count=1):
+        position = wait_bin(duration)
+        self.counts[position] = self.counts.get(position, 0) + count
+
+    def merge(self, other):
+        for position, count in other.counts.items():
+            self.counts[position] = self.counts.get(position, 0) + count
+        return self
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def within(self, seconds):
+        """
+        Calls that waited at most ``seconds`` seconds.
+        """
+        return sum(
+            count for position, count in self.counts.items()
+            if position <= seconds and position != OVERFLOW_BIN
+        )
+
+    def fraction_within(self, seconds):
+        """
+        Share of the calls that waited at most ``seconds`` seconds, or
+        None when the histogram is empty.
+        """
+        total = self.total
+        return self.within(seconds) / total if total else None
+
+    def percentile(self, percent):
+        """
+        Nearest-rank percentile as a timedelta at one second resolution,
+        or None when it falls in the overflow bin or the histogram is empty.
+        """
+        total = self.total
+        if not total:
+            return None
+        rank = max(1, -(-total * percent // 100))
+        seen = 0
+        for position in sorted(self.counts):
+            seen += self.counts[position]
+            if seen >= rank:
+                return timedelta(seconds=position) if position != OVERFLOW_BIN else None
+        return None
+
+    def to_dict(self):
+        return {str(position): count for position, count in self.counts.items() if count}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls({int(position): int(count) for position, count in (data or {}).items()})
+
+    @classmethod
+    def from_dense(cls, bins):
+        return cls({position: int(count) for position, count in enumerate(bins) if count})
+
+    @classmethod
+    def from_durations(cls, durations):
+        """
+        Histogram of an int64 array of durations in microseconds, binned
+        like wait_bin in one pass.
+        """
+        bins = np.clip(-(-durations // MICROSECONDS), 0, OVERFLOW_BIN)
+        return cls.from_dense(np.bincount(bins, minlength=HISTOGRAM_BINS).tolist())
+
+    def __eq__(self, other):
+        return isinstance(other, WaitHistogram) and self.to_dict() == other.to_dict()
+
+
+# Quantile sketches answer within 1% of the true duration and keep at
+# most this many buckets, a few KB per sketch once serialized
+SKETCH_ACCURACY = 0.01
+SKETCH_MAX_BINS = 512
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+SKETCH_LOG_GAMMA = math.log(SKETCH_GAMMA)
+
+
+def sketch_key(duration):
+    """
+    Log-spaced bucket of a positive duration in microseconds.
+    """
+    return int(math.ceil(math.log(duration / MICROSECONDS) / SKETCH_LOG_GAMMA))
+
+
+class DurationSketch(object):
+    """
+    Mergeable quantile sketch of durations with log-spaced buckets, so
+    every quantile is accurate to SKETCH_ACCURACY of its value. When the
+    buckets exceed SKETCH_MAX_BINS the shortest ones are collapsed, which
+    only costs accuracy at the low end.
+    """
+    __slots__ = ('zero', 'bins')
+
+    def __init__(self, zero=0, bins=None):
+        self.zero = zero
+        self.bins = bins if bins is not None else {}
+
+    def add(self, duration, count=1):
+        # Zero and negative durations share one bucket
+        if duration <= 0:
+            self.zero += count
+            return
+        key = sketch_key(duration)
+        self.bins[key] = self.bins.get(key, 0) + count
+        if len(self.bins) > SKETCH_MAX_BINS:
+            self._collapse()
+
+    def merge(self, other):
+        self.zero += other.zero
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        if len(self.bins) > SKETCH_MAX_BINS:
+            self._collapse()
+        return self
+
+    @classmethod
+    def from_buckets(cls, zero, keys, counts):
+        sketch = cls(zero=int(zero), bins=dict(zip(keys, counts)))
+        if len(sketch.bins) > SKETCH_MAX_BINS:
+            sketch._collapse()
+        return sketch
+
+    @classmethod
+    def from_durations(cls, durations):
+        """
+        Sketch of an int64 array of durations in microseconds, bucketed
+        by the sketch kernel in one pass.
+        """
+        zero_counts, _, keys, counts = sketch_kernel(
+            durations, np.zeros(len(durations), dtype=np.int64), 1, SKETCH_LOG_GAMMA,
+            unit=MICROSECONDS
+        )
+        return cls.from_buckets(zero_counts[0], keys.tolist(), counts.tolist())
+
+    def _collapse(self):
+        keys = sorted(self.bins)
+        excess = len(keys) - SKETCH_MAX_BINS
+        for key in keys[:excess]:
+            self.bins[keys[excess]] += self.bins.pop(key)
+
+    @property
+    def total(self):
+        return self.zero + sum(self.bins.values())
+
+    def quantile(self, percent):
+        """
+        Nearest-rank percentile as a timedelta, or None for an empty sketch.
+        """
+        total = self.total
+        if not total:
+            return None
+        rank = max(1, -(-total * percent // 100))
+        seen = self.zero
+        if seen >= rank:
+            return timedelta(0)
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen >= rank:
+                return timedelta(seconds=2 * SKETCH_GAMMA ** key / (SKETCH_GAMMA + 1))
+        return None
+
+    def to_dict(self):
+        return {
+            'zero': self.zero,
+            'bins': {str(key): count for key, count in self.bins.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(
+            zero=int(data.get('zero', 0)),
+            bins={int(key): int(count) for key, count in data.get('bins', {}).items()}
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, DurationSketch) and self.to_dict() == other.to_dict()
+
+
+def _distribution(name):
+    """
+    A wait histogram or quantile sketch of SlaRow, brought up to date
+    with the durations add_call buffered before it is read or replaced.
+    """
+    private = '_' + name
+
+    def get(row):
+        row._bin_pending()
+        return getattr(row, private)
+
+    def set(row, value):
+        row._bin_pending()
+        setattr(row, private, value)
+
+    return property(get, set)
+
+
+class SlaRow(object):
+    """
+    SLA counters for one DID. Durations are integer microseconds and rows
+    merge associatively, so partial rows from slices, chunks or stored
+    reports can be combined in any order.
+
+    add_call only buffers the durations its histograms and sketches need;
+    they are binned in one vectorized pass when first read or merged.
+    Rows summed from the SLA cube have no distributions, and neither has
+    any row they are merged into.
+    """
+    FIELDS = (
+        'presented', 'live_answered', 'lost', 'voice_mails',
+        'answered_duration', 'answered_wait', 'lost_wait',
+        'within_15', 'within_30', 'within_45', 'within_60', 'within_999',
+        'over_999', 'longest_wait'
+    )
+    SKETCHES = ('answered_wait_sketch', 'lost_wait_sketch', 'talk_sketch')
+    DISTRIBUTIONS = ('answered_waits', 'lost_waits') + SKETCHES
+    __slots__ = FIELDS + tuple('_' + name for name in DISTRIBUTIONS) + (
+        '_pending_answered_waits', '_pending_talking_times', '_pending_lost_waits',
+        'has_distributions'
+    )
+
+    answered_waits = _distribution('answered_waits')
+    lost_waits = _distribution('lost_waits')
+    answered_wait_sketch = _distribution('answered_wait_sketch')
+    lost_wait_sketch = _distribution('lost_wait_sketch')
+    talk_sketch = _distribution('talk_sketch')
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+        self.has_distributions = True
+        self._pending_answered_waits = []
+        self._pending_talking_times = []
+        self._pending_lost_waits = []
+        self._answered_waits = WaitHistogram()
+        self._lost_waits = WaitHistogram()
+        for sketch in self.SKETCHES:
+            setattr(self, '_' + sketch, DurationSketch())
+
+    def add_call(self, length, talking_time, hold_time, voicemail_time):
+        """
+        Classify one call from its length and its talking, hold and voice
+        mail time, all in microseconds.
+        """
+        # A live-answered call has > 0 seconds of agent talking time
+        if talking_time > 0:
+            wait_duration = length - talking_time - hold_time
+            self.presented += 1
+            self.live_answered += 1
+            self.answered_duration += talking_time
+            self.answered_wait += wait_duration
+
+            # Qualify calls by duration
+            if wait_duration <= _WITHIN_15:
+                self.within_15 += 1
+            elif wait_duration <= _WITHIN_30:
+                self.within_30 += 1
+            elif wait_duration <= _WITHIN_45:
+                self.within_45 += 1
+            elif wait_duration <= _WITHIN_60:
+                self.within_60 += 1
+            elif wait_duration <= _WITHIN_999:
+                self.within_999 += 1
+            else:
+                self.over_999 += 1
+
+            if wait_duration > self.longest_wait:
+                self.longest_wait = wait_duration
+            self._pending_answered_waits.append(wait_duration)
+            self._pending_talking_times.append(talking_time)
+
+        # A voice mail is not live answered and last longer than 20 seconds
+        elif voicemail_time > _MIN_LOST:
+            self.presented += 1
+            self.voice_mails += 1
+            self.lost_wait += length
+            self._pending_lost_waits.append(length)
+
+        # An abandoned call is not live answered and last longer than 20 seconds
+        elif length > _MIN_LOST:
+            self.presented += 1
+            self.lost += 1
+            self.lost_wait += length
+            self._pending_lost_waits.append(length)
+
+    def _bin_pending(self):
+        if self._pending_answered_waits:
+            waits = np.asarray(self._pending_answered_waits, dtype=np.int64)
+            talking_times = np.asarray(self._pending_talking_times, dtype=np.int64)
+            self._pending_answered_waits = []
+            self._pending_talking_times = []
+            self._answered_waits.merge(WaitHistogram.from_durations(waits))
+            self._answered_wait_sketch.merge(DurationSketch.from_durations(waits))
+            self._talk_sketch.merge(DurationSketch.from_durations(talking_times))
+        if self._pending_lost_waits:
+            waits = np.asarray(self._pending_lost_waits, dtype=np.int64)
+            self._pending_lost_waits = []
+            self._lost_waits.merge(WaitHistogram.from_durations(waits))
+            self._lost_wait_sketch.merge(DurationSketch.from_durations(waits))
+
+    def merge(self, other):
+        """
+        Add another row into this one and return this row.
+        """
+        for field in self.FIELDS[:-1]:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        if other.longest_wait > self.longest_wait:
+            self.longest_wait = other.longest_wait
+        self.has_distributions = self.has_distributions and other.has_distributions
+        self.answered_waits.merge(other.answered_waits)
+        self.lost_waits.merge(other.lost_waits)
+        for sketch in self.SKETCHES:
+            getattr(self, sketch).merge(getattr(other, sketch))
+        return self
+
+    def values(self):
+        return [getattr(self, field) for field in self.FIELDS]
+
+    @classmethod
+    def from_values(cls, values, unit=MICROSECONDS):
+        """
+        Build a row from values in HEADERS order, where durations are
+        integers in ``unit`` ticks per second.
+        """
+        row = cls()
+        scale = MICROSECONDS // unit
+        for position, (field, value) in enumerate(zip(cls.FIELDS, values)):
+            value = int(value)
+            setattr(row, field, value * scale if position in DURATION_FIELDS else value)
+        return row
+
+    def to_dict(self):
+        """
+        The row as stored in the report JSON: HEADERS to counts and
+        timedeltas.
+        """
+        row = OrderedDict()
+        for position, (header, value) in enumerate(zip(HEADERS, self.values())):
+            row[header] = timedelta(microseconds=value) if position in DURATION_FIELDS else value
+        return row
+
+    @classmethod
+    def from_dict(cls, data):
+        row = cls()
+        for position, (field, header) in enumerate(zip(cls.FIELDS, HEADERS)):
+            value = data.get(header, 0)
+            if position in DURATION_FIELDS and isinstance(value, timedelta):
+                value = to_microseconds(value)
+            setattr(row, field, int(value))
+        return row
+
+    def histograms_to_dict(self):
+        """
+        The wait histograms as stored next to the report JSON.
+        """
+        return {
+            'answered': self.answered_waits.to_dict(),
+            'lost': self.lost_waits.to_dict(),
+        }
+
+    def histograms_from_dict(self, data):
+        self.answered_waits = WaitHistogram.from_dict(data.get('answered'))
+        self.lost_waits = WaitHistogram.from_dict(data.get('lost'))
+        return self
+
+    def sketches_to_dict(self):
+        """
+        The quantile sketches as stored next to the report JSON.
+        """
+        return {
+            'answered_wait': self.answered_wait_sketch.to_dict(),
+            'lost_wait': self.lost_wait_sketch.to_dict(),
+            'talk': self.talk_sketch.to_dict(),
+        }
+
+    def sketches_from_dict(self, data):
+        self.answered_wait_sketch = DurationSketch.from_dict(data.get('answered_wait'))
+        self.lost_wait_sketch = DurationSketch.from_dict(data.get('lost_wait'))
+        self.talk_sketch = DurationSketch.from_dict(data.get('talk'))
+        return self
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, SlaRow)
+            and self.values() == other.values()
+            and self.answered_waits == other.answered_waits
+            and self.lost_waits == other.lost_waits
+            and all(getattr(self, sketch) == getattr(other, sketch) for sketch in self.SKETCHES)
+        )
+
+    def __repr__(self):
+        return "<SlaRow presented={presented} answered={answered}>".format(
+            presented=self.presented, answered=self.live_answered
+        )
@@ -0,0 +1,42 @@
+# report/aggregates_benchmark.py
+"""
+Per-call cost of SlaRow.add_call against the OrderedDict rows it
+replaced, including binning the buffered distributions. Timings depend
+on the machine, so this is run by hand rather than by the unit tests:
+
+    python -m app.report.aggregates_benchmark
+"""
+import timeit
+from collections import OrderedDict
+from datetime import timedelta
+
+from .aggregates import MICROSECONDS, SlaRow
+from .aggregates_test import DEFAULT_ROW, random_calls, tally_call
+
+
+def benchmark(count=20000, repeat=5):
+    calls = random_calls(count)
+    legacy_calls = [[timedelta(seconds=seconds) for seconds in call] for call in calls]
+    row_calls = [[seconds * MICROSECONDS for seconds in call] for call in calls]
+
+    def legacy():
+        row = OrderedDict(DEFAULT_ROW)
+        for call in legacy_calls:
+            tally_call(row, *call)
+
+    def sla_row():
+        row = SlaRow()
+        for call in row_calls:
+            row.add_call(*call)
+        # Reading a distribution bins the buffered durations
+        return row.answered_waits
+
+    legacy_cost = min(timeit.repeat(legacy, number=1, repeat=repeat))
+    row_cost = min(timeit.repeat(sla_row, number=1, repeat=repeat))
+    return legacy_cost, row_cost
+
+
+if __name__ == '__main__':
+    legacy_cost, row_cost = benchmark()
+    print("OrderedDict rows: {legacy:.3f}s, SlaRow with distributions: {row:.3f}s "
+          "({ratio:.2f}x)".format(legacy=legacy_cost, row=row_cost, ratio=legacy_cost / row_cost))
@@ -0,0 +1,133 @@
+# report/aggregates_test.py
+import random
+import unittest
+from collections import OrderedDict
+from datetime import timedelta
+
+from .aggregates import HEADERS, MICROSECONDS, DurationSketch, SlaRow, WaitHistogram
+
+# The report row before SlaRow: an OrderedDict seeded from DEFAULT_ROW
+DEFAULT_ROW = OrderedDict(
+    (header, timedelta(0) if position in (4, 5, 6, 13) else 0)
+    for position, header in enumerate(HEADERS)
+)
+
+
+def tally_call(row, call_length, talking_time, hold_time, voicemail_time):
+    """
+    The per-call update of the OrderedDict rows, kept as the reference
+    SlaRow.add_call must agree with.
+    """
+    wait_duration = call_length - talking_time - hold_time
+    if talking_time > timedelta(0):
+        row['I/C Presented'] += 1
+        row['I/C Live Answered'] += 1
+        row['Answered Incoming Duration'] += talking_time
+        row['Answered Wait Duration'] += wait_duration
+        if wait_duration <= timedelta(seconds=15):
+            row['Calls Ans Within 15'] += 1
+        elif wait_duration <= timedelta(seconds=30):
+            row['Calls Ans Within 30'] += 1
+        elif wait_duration <= timedelta(seconds=45):
+            row['Calls Ans Within 45'] += 1
+        elif wait_duration <= timedelta(seconds=60):
+            row['Calls Ans Within 60'] += 1
+        elif wait_duration <= timedelta(seconds=999):
+            row['Calls Ans Within 999'] += 1
+        else:
+            row['Call Ans + 999'] += 1
+        if wait_duration > row['Longest Waiting Answered']:
+            row['Longest Waiting Answered'] = wait_duration
+    elif voicemail_time > timedelta(seconds=20):
+        row['I/C Presented'] += 1
+        row['Voice Mails'] += 1
+        row['Lost Wait Duration'] += call_length
+    elif call_length > timedelta(seconds=20):
+        row['I/C Presented'] += 1
+        row['I/C Lost'] += 1
+        row['Lost Wait Duration'] += call_length
+
+
+def random_calls(count, seed=1):
+    """
+    (length, talking, hold, voice mail) in whole seconds.
+    """
+    rnd = random.Random(seed)
+    calls = []
+    for _ in range(count):
+        length = rnd.randint(0, 1200)
+        calls.append((
+            length,
+            rnd.choice([0, rnd.randint(0, length + 1)]),
+            rnd.choice([0, rnd.randint(0, 60)]),
+            rnd.choice([0, rnd.randint(0, 40)]),
+        ))
+    return calls
+
+
+def sla_row(calls):
+    row = SlaRow()
+    for call in calls:
+        row.add_call(*[seconds * MICROSECONDS for seconds in call])
+    return row
+
+
+class SlaRowTest(unittest.TestCase):
+
+    def test_matches_ordereddict_rows(self):
+        calls = random_calls(3000)
+        expected = OrderedDict(DEFAULT_ROW)
+        for call in calls:
+            tally_call(expected, *[timedelta(seconds=seconds) for seconds in call])
+        self.assertEqual(sla_row(calls).to_dict(), expected)
+
+    def test_merge_is_associative(self):
+        calls = random_calls(900, seed=2)
+        whole = sla_row(calls)
+        chunks = [sla_row(calls[position:position + 100]) for position in range(0, 900, 100)]
+
+        left = SlaRow()
+        for chunk in chunks:
+            left.merge(chunk)
+        right = SlaRow()
+        for chunk in reversed(chunks):
+            right.merge(chunk)
+        pairs = [sla_row(calls[:450]), sla_row(calls[450:])]
+
+        self.assertEqual(left, whole)
+        self.assertEqual(right, whole)
+        self.assertEqual(pairs[0].merge(pairs[1]), whole)
+
+    def test_dict_round_trip(self):
+        row = sla_row(random_calls(500, seed=3))
+        restored = SlaRow.from_dict(row.to_dict())
+        restored.histograms_from_dict(row.histograms_to_dict())
+        restored.sketches_from_dict(row.sketches_to_dict())
+        self.assertEqual(restored, row)
+
+    def test_buffered_distributions_match_per_call_binning(self):
+        calls = random_calls(2000, seed=4)
+        row = sla_row(calls)
+        answered_waits, lost_waits = WaitHistogram(), WaitHistogram()
+        sketches = [DurationSketch() for _ in SlaRow.SKETCHES]
+        for length, talking_time, hold_time, voicemail_time in calls:
+            if talking_time > 0:
+                wait_duration = (length - talking_time - hold_time) * MICROSECONDS
+                answered_waits.add(wait_duration)
+                sketches[0].add(wait_duration)
+                sketches[2].add(talking_time * MICROSECONDS)
+            elif voicemail_time > 20 or length > 20:
+                lost_waits.add(length * MICROSECONDS)
+                sketches[1].add(length * MICROSECONDS)
+
+        self.assertEqual(row.answered_waits, answered_waits)
+        self.assertEqual(row.lost_waits, lost_waits)
+        self.assertEqual([getattr(row, sketch) for sketch in SlaRow.SKETCHES], sketches)
+
+        # Calls added after the first read are binned on the next one
+        row.add_call(30 * MICROSECONDS, 10 * MICROSECONDS, 0, 0)
+        answered_waits.add(20 * MICROSECONDS)
+        self.assertEqual(row.answered_waits, answered_waits)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+# report/archive.py
+import logging
+import os
+from datetime import date, datetime
+import pandas as pd
+from flask import current_app
+from sqlalchemy import BigInteger, Boolean, DateTime, Integer
+from sqlalchemy.sql import and_, exists, func, select
+
+from app.extensions import db
+from .models import ArchivedMonthModel, CallSummaryModel, CallTableModel, EventTableModel
+from .parquet import pa, pq
+
+
+logger = logging.getLogger("app")
+
+
+def month_bounds(month):
+    start = datetime(month.year, month.month, 1)
+    end = datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+    return start, end
+
+
+def _arrow_schema(table):
+    """
+    Parquet schema for a table, so every chunk is written with the same
+    types whatever values it happens to hold.
+    """
+    fields = []
+    for column in table.columns:
+        if isinstance(column.type, (Integer, BigInteger)):
+            arrow_type = pa.int64()
+        elif isinstance(column.type, DateTime):
+            arrow_type = pa.timestamp('us')
+        elif isinstance(column.type, Boolean):
+            arrow_type = pa.bool_()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def _write_parquet(query, table, path):
+    """
+    Stream the query into a Parquet file chunk by chunk and return the
+    number of rows written. The file only appears once it is complete.
+    """
+    if os.path.exists(path):
+        raise FileExistsError("Archive file {path} already exists.".format(path=path))
+
+    schema = _arrow_schema(table)
+    names = [column.name for column in table.columns]
+    chunk_size = current_app.config.get('LOADER_CHUNK_SIZE', 5000)
+    partial_path = path + '.partial'
+
+    written = 0
+    writer = pq.ParquetWriter(
+        partial_path, schema,
+        compression=current_app.config.get('ARCHIVE_COMPRESSION', 'snappy')
+    )
+    results = db.session.connection().execution_options(
+        stream_results=True
+    ).execute(query)
+    try:
+        chunk = results.fetchmany(chunk_size)
+        while chunk:
+            frame = pd.DataFrame.from_records([tuple(row) for row in chunk], columns=names)
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+            written += len(chunk)
+            chunk = results.fetchmany(chunk_size)
+    finally:
+        results.close()
+        writer.close()
+
+    os.replace(partial_path, path)
+    return written
+
+
+def unsummarized_calls(month):
+    """
+    Number of inbound calls that started in the month without a call
+    summary. Reports read archived calls from their summaries only, so
+    these would be lost from them once archived.
+    """
+    month_start, month_end = month_bounds(month)
+    calls = CallTableModel.__table__
+    summaries = CallSummaryModel.__table__
+    return db.session.execute(
+        select([func.count()]).select_from(calls).where(and_(
+            calls.c.start_time >= month_start,
+            calls.c.start_time < month_end,
+            calls.c.call_direction == 1,
+            ~exists().where(summaries.c.call_id == calls.c.call_id)
+        ))
+    ).scalar()
+
+
+def archive_month(month, directory):
+    """
+    Move the calls that started in the month, and their events, to new
+    Parquet files in the directory and delete them from the hot tables.
+    A month archived before gets a further part; earlier files are never
+    replaced. The part is recorded before any row is deleted, and the
+    written files are removed again if the move fails. Call summaries and
+    the SLA cube are kept, and a month with inbound calls missing their
+    summaries is refused. Callers commit the session.
+    """
+    if pq is None:
+        raise RuntimeError("pyarrow is required to archive call data.")
+
+    month = date(month.year, month.month, 1)
+    missing = unsummarized_calls(month)
+    if missing:
+        raise RuntimeError(
+            "{count} inbound calls for {month:%Y-%m} have no call summary, "
+            "not archiving.".format(count=missing, month=month)
+        )
+    month_start, month_end = month_bounds(month)
+    calls = CallTableModel.__table__
+    events = EventTableModel.__table__
+    in_month = and_(calls.c.start_time >= month_start, calls.c.start_time < month_end)
+    month_calls = select([calls.c.call_id]).where(in_month)
+
+    part = max([archived.part for archived in ArchivedMonthModel.find(month)] or [0]) + 1
+    os.makedirs(directory, exist_ok=True)
+    calls_path = os.path.join(directory, "c_call_{month:%Y_%m}_part{part}.parquet".format(
+        month=month, part=part
+    ))
+    events_path = os.path.join(directory, "c_event_{month:%Y_%m}_part{part}.parquet".format(
+        month=month, part=part
+    ))
+
+    logger.info("Started: Archiving calls for {month:%Y-%m} as part {part}".format(
+        month=month, part=part
+    ))
+    written = []
+    try:
+        calls_archived = _write_parquet(
+            select([calls]).where(in_month).order_by(calls.c.call_id), calls, calls_path
+        )
+        written.append(calls_path)
+        events_archived = _write_parquet(
+            select([events]).where(events.c.call_id.in_(month_calls)).order_by(events.c.event_id),
+            events, events_path
+        )
+        written.append(events_path)
+
+        ArchivedMonthModel.create(
+            month=month,
+            part=part,
+            calls_path=calls_path,
+            events_path=events_path,
+            calls_archived=calls_archived,
+            events_archived=events_archived,
+            archived_on=datetime.utcnow()
+        )
+        events_deleted = db.session.execute(
+            events.delete().where(events.c.call_id.in_(month_calls))
+        ).rowcount
+        calls_deleted = db.session.execute(calls.delete().where(in_month)).rowcount
+        if (calls_deleted, events_deleted) != (calls_archived, events_archived):
+            raise RuntimeError(
+                "Archived {calls} calls and {events} events for {month:%Y-%m} but would "
+                "delete {calls_deleted} and {events_deleted}.".format(
+                    calls=calls_archived, events=events_archived, month=month,
+                    calls_deleted=calls_deleted, events_deleted=events_deleted
+                )
+            )
+    except Exception:
+        for path in written:
+            os.remove(path)
+        raise
+
+    logger.info(
+        "Completed: Archived {calls} calls and {events} events for {month:%Y-%m}".format(
+            calls=calls_archived, events=events_archived, month=month
+        )
+    )
+    return calls_archived
+
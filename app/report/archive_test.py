@@ -0,0 +1,45 @@
+# report/archive_test.py
+import datetime
+import os
+import unittest
+
+from app.extensions import db
+from .archive import archive_month, unsummarized_calls
+from .models import ArchivedMonthModel, CallSummaryModel, CallTableModel
+from .parquet import pq
+from .testing import ReportTestCase, seed_calls, load_day
+
+DAY = datetime.date(2018, 7, 2)
+
+
+@unittest.skipIf(pq is None, "pyarrow is not installed")
+class ArchiveMonthTest(ReportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        seed_calls(DAY, 50)
+        db.session.commit()
+        load_day(DAY)
+
+    def test_calls_without_summaries_are_not_archived(self):
+        summary = CallSummaryModel.query.first()
+        db.session.delete(summary)
+        db.session.commit()
+        self.assertEqual(unsummarized_calls(DAY), 1)
+
+        with self.assertRaises(RuntimeError):
+            archive_month(DAY, self.directory)
+        db.session.rollback()
+        self.assertEqual(CallTableModel.query.count(), 50)
+        self.assertEqual(ArchivedMonthModel.query.count(), 0)
+        self.assertFalse([name for name in os.listdir(self.directory) if name.endswith('.parquet')])
+
+    def test_summarized_month_is_archived(self):
+        self.assertEqual(unsummarized_calls(DAY), 0)
+        self.assertEqual(archive_month(DAY, self.directory), 50)
+        db.session.commit()
+        self.assertEqual(CallTableModel.query.count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,70 +1,224 @@
 # report/services/sla_report.py
 import logging
-from collections import OrderedDict, Counter
-from datetime import timedelta
-from sqlalchemy.sql import and_
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+import numpy as np
+from flask import current_app
+from sqlalchemy import Integer, create_engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql import and_, or_, case, cast, exists, extract, func, select, text
 
-from .models import TablesLoadedModel, CallTableModel, SlaReportModel
+from app.extensions import db
+from .aggregates import (
+    HEADERS, MICROSECONDS, HISTOGRAM_BINS, SKETCH_LOG_GAMMA,
+    SlaRow, WaitHistogram, DurationSketch, to_microseconds
+)
+from .archive import month_bounds
+from .kernels import sla_kernel, histogram_kernel, sketch_kernel, classify_calls
+from .models import (
+    TablesLoadedModel, CallTableModel, EventTableModel, SlaReportModel, SlaCubeModel,
+    CallSummaryModel, SummarySLAReportModel, ArchivedMonthModel
+)
 
 
 logger = logging.getLogger("app")
 
-HEADERS = [
-    'I/C Presented',
-    'I/C Live Answered',
-    'I/C Lost',
-    'Voice Mails',
-    'Answered Incoming Duration',
-    'Answered Wait Duration',
-    'Lost Wait Duration',
-    'Calls Ans Within 15',
-    'Calls Ans Within 30',
-    'Calls Ans Within 45',
-    'Calls Ans Within 60',
-    'Calls Ans Within 999',
-    'Call Ans + 999',
-    'Longest Waiting Answered'
-]
-
-DEFAULT_ROW_VALS = [
-    0,  # 'I/C Presented'
-    0,  # 'I/C Live Answered'
-    0,  # 'I/C Abandoned'
-    0,  # 'Voice Mails'
-    timedelta(0),  # Answered Incoming Duration
-    timedelta(0),  # Answered Wait Duration
-    timedelta(0),  # Lost Wait Duration
-    0,  # 'Calls Ans Within 15'
-    0,  # 'Calls Ans Within 30'
-    0,  # 'Calls Ans Within 45'
-    0,  # 'Calls Ans Within 60'
-    0,  # 'Calls Ans Within 999'
-    0,  # 'Call Ans + 999'
-    timedelta(0)  # 'Longest Waiting Answered'
-]
-
-DEFAULT_ROW = OrderedDict(zip(HEADERS, DEFAULT_ROW_VALS))
-
-
-def build_sla_data(start_time, end_time):
-    logger.info(
-        "Started: Building SLA report data {start} to {end}".format(
-            start=start_time, end=end_time
+
+def elapsed_seconds(start_col, end_col, dialect_name):
+    """
+    SQL expression for the whole seconds between two datetime columns.
+    Mirrors the ``length`` hybrid property of the call and event models,
+    which drops the microseconds of the difference.
+    """
+    if dialect_name == 'postgresql':
+        return cast(func.floor(extract('epoch', end_col - start_col)), Integer)
+    if dialect_name == 'mysql':
+        return func.timestampdiff(text('SECOND'), start_col, end_col)
+    if dialect_name == 'sqlite':
+        # julianday is only precise to a few microseconds, so round to
+        # milliseconds before truncating to seconds
+        return cast(
+            func.round((func.julianday(end_col) - func.julianday(start_col)) * 86400000),
+            Integer
+        ) / 1000
+    raise ValueError(
+        "Dialect {dialect} is not supported by the SQL report engine.".format(
+            dialect=dialect_name
         )
     )
-    # Check that the data has been loaded for the report date
-    if not TablesLoadedModel.interval_is_loaded(start_time, end_time):
-        logger.warning("Data not loaded for report interval.\n"
-                       "Attempting to load data.")
-        # TODO: implement this
 
+
+def did_condition(column, dids):
+    """
+    Match the dialed party numbers of the given report row names. Calls
+    without a dialed party number are reported under 'None'.
+    """
+    numbers = [did for did in dids if did != 'None']
+    condition = column.in_(numbers)
+    if 'None' in dids:
+        condition = or_(condition, column.is_(None))
+    return condition
+
+
+def call_totals_query(start_time, end_time, dialect_name, started_before=None, dids=None):
+    """
+    One row per inbound call in the interval with the call length and the
+    talking, hold and voice mail time summed from its events, in seconds.
+    Without an end_time calls are only selected by their start time, and
+    with dids only the calls of those report rows are selected.
+    """
+    calls = CallTableModel.__table__
+    events = EventTableModel.__table__
+    event_length = elapsed_seconds(events.c.start_time, events.c.end_time, dialect_name)
+
+    def event_total(*event_types):
+        return func.coalesce(
+            func.sum(case([(events.c.event_type.in_(event_types), event_length)], else_=0)), 0
+        )
+
+    conditions = [calls.c.start_time >= start_time, calls.c.call_direction == 1]
+    if end_time is not None:
+        conditions.append(calls.c.end_time <= end_time)
+    if started_before is not None:
+        conditions.append(calls.c.start_time < started_before)
+    if dids is not None:
+        conditions.append(did_condition(calls.c.dialed_party_number, dids))
+
+    return select([
+        calls.c.call_id,
+        calls.c.dialed_party_number,
+        calls.c.start_time,
+        calls.c.end_time,
+        elapsed_seconds(calls.c.start_time, calls.c.end_time, dialect_name).label('length'),
+        event_total(4).label('talking_time'),
+        event_total(5, 6, 7).label('hold_time'),
+        event_total(10).label('voicemail_time'),
+    ]).select_from(
+        calls.outerjoin(events, events.c.call_id == calls.c.call_id)
+    ).where(and_(*conditions)).group_by(
+        calls.c.call_id,
+        calls.c.dialed_party_number,
+        calls.c.start_time,
+        calls.c.end_time
+    )
+
+
+def call_summary_query(start_time, end_time, started_before=None, dids=None):
+    """
+    Same rows as call_totals_query, read from the per-call summaries
+    written at load time instead of the call and event tables.
+    """
+    summaries = CallSummaryModel.__table__
+
+    conditions = [summaries.c.start_time >= start_time]
+    if end_time is not None:
+        conditions.append(summaries.c.end_time <= end_time)
+    if started_before is not None:
+        conditions.append(summaries.c.start_time < started_before)
+    if dids is not None:
+        conditions.append(did_condition(summaries.c.dialed_party_number, dids))
+
+    return select([
+        summaries.c.call_id,
+        summaries.c.dialed_party_number,
+        summaries.c.start_time,
+        summaries.c.end_time,
+        summaries.c.length,
+        summaries.c.talking_time,
+        summaries.c.hold_time,
+        summaries.c.voicemail_time,
+    ]).where(and_(*conditions))
+
+
+def build_call_summaries(date):
+    """
+    Rewrite the per-call summaries of every inbound call that started on
+    the date. Summaries of archived calls are kept. Callers commit the
+    session.
+    """
+    day_start = datetime.combine(date, time())
+    day_end = day_start + timedelta(days=1)
+    logger.info("Started: Building call summaries for {date}".format(date=date))
+
+    totals = call_totals_query(
+        day_start, None, db.engine.dialect.name, started_before=day_end
+    ).alias('call_totals')
+
+    if ArchivedMonthModel.is_archived(date):
+        # The archived calls of the day are no longer in the raw tables,
+        # so only the summaries of the calls still there are replaced
+        calls = CallTableModel.__table__
+        CallSummaryModel.query.filter(
+            CallSummaryModel.call_id.in_(
+                select([calls.c.call_id]).where(
+                    and_(calls.c.start_time >= day_start, calls.c.start_time < day_end)
+                )
+            )
+        ).delete(synchronize_session=False)
+    else:
+        CallSummaryModel.clear(day_start, day_end)
+    db.session.execute(
+        CallSummaryModel.__table__.insert().from_select(
+            [
+                'call_id', 'dialed_party_number', 'start_time', 'end_time', 'length',
+                'talking_time', 'hold_time', 'voicemail_time', 'wait_duration'
+            ],
+            select([
+                totals.c.call_id,
+                totals.c.dialed_party_number,
+                totals.c.start_time,
+                totals.c.end_time,
+                totals.c.length,
+                totals.c.talking_time,
+                totals.c.hold_time,
+                totals.c.voicemail_time,
+                totals.c.length - totals.c.talking_time - totals.c.hold_time,
+            ])
+        )
+    )
+
+    logger.info("Completed: Building call summaries for {date}".format(date=date))
+
+
+def length_microseconds(start_time, end_time):
+    """
+    Same as the ``length`` hybrid property of the call and event models,
+    in microseconds.
+    """
+    delta = end_time - start_time
+    return (delta.days * 86400 + delta.seconds) * MICROSECONDS
+
+
+def add_call(row, call_length, event_dict):
+    """
+    Add one call to the row from its length and its event lengths summed
+    by event type, in microseconds.
+    """
+    row.add_call(
+        call_length,
+        # Event type 4 represents talking time with an agent
+        event_dict.get(4, 0),
+        # Event type 5 = , 6 = , 7 =
+        event_dict.get(5, 0) + event_dict.get(6, 0) + event_dict.get(7, 0),
+        # Event type 10 represents a switch to voice mail
+        event_dict.get(10, 0)
+    )
+
+
+def _orm_sla_rows(start_time, end_time, dids=None):
     inbound_calls = CallTableModel.query.filter(
         and_(
             CallTableModel.start_time >= start_time,
             CallTableModel.end_time <= end_time,
             CallTableModel.call_direction == 1
         )
-    ).all()
+    )
+    if dids is not None:
+        inbound_calls = inbound_calls.filter(
+            did_condition(CallTableModel.dialed_party_number, dids)
+        )
+    inbound_calls = inbound_calls.all()
 
     # Collate data for interval
     sla_data = {}
@@ -72,127 +226,690 @@ def build_sla_data(start_time, end_time):
 
         # Index on dialed party number
         row_name = str(call.dialed_party_number)
-        row = sla_data.get(row_name, DEFAULT_ROW)
+        row = sla_data.get(row_name)
+        if row is None:
+            row = sla_data[row_name] = SlaRow()
 
         event_dict = {}
         # Caching events by type makes report comparisons easier
         for ev in call.events:
-            event_dict[ev.event_type] = event_dict.get(ev.event_type, timedelta(seconds=0)) + ev.length
+            event_dict[ev.event_type] = event_dict.get(ev.event_type, 0) + to_microseconds(ev.length)
 
-        # Event type 4 represents talking time with an agent
-        talking_time = event_dict.get(4, timedelta(0))
+        add_call(row, to_microseconds(call.length), event_dict)
 
-        # Event type 10 represents a switch to voice mail
-        voicemail_time = event_dict.get(10, timedelta(0))
+    return with_archive(start_time, end_time, dids, sla_data)
 
-        # Event type 5 = , 6 = , 7 =
-        hold_time = sum(
-            [event_dict.get(event_type, timedelta(0)) for event_type in (5, 6, 7)],
-            timedelta(0)
-        )
-        wait_duration = call.length - talking_time - hold_time
-
-        # A live-answered call has > 0 seconds of agent talking time
-        if talking_time > timedelta(0):
-            row['I/C Presented'] += 1
-            row['I/C Live Answered'] += 1
-            row['Answered Incoming Duration'] += talking_time
-            row['Answered Wait Duration'] += wait_duration
-
-            # Qualify calls by duration
-            if wait_duration <= timedelta(seconds=15):
-                row['Calls Ans Within 15'] += 1
-            elif wait_duration <= timedelta(seconds=30):
-                row['Calls Ans Within 30'] += 1
-            elif wait_duration <= timedelta(seconds=45):
-                row['Calls Ans Within 45'] += 1
-            elif wait_duration <= timedelta(seconds=60):
-                row['Calls Ans Within 60'] += 1
-            elif wait_duration <= timedelta(seconds=999):
-                row['Calls Ans Within 999'] += 1
+
+def _stream_sla_rows(start_time, end_time, dids=None):
+    """
+    Walk the calls and their events in start time order, a fixed number
+    of rows at a time, folding each call into the running aggregate as
+    soon as all of its events have been read. Memory use only depends on
+    the chunk size and the number of DIDs, not on the interval length.
+    """
+    calls = CallTableModel.__table__
+    events = EventTableModel.__table__
+    conditions = [
+        calls.c.start_time >= start_time,
+        calls.c.end_time <= end_time,
+        calls.c.call_direction == 1
+    ]
+    if dids is not None:
+        conditions.append(did_condition(calls.c.dialed_party_number, dids))
+    query = select([
+        calls.c.call_id,
+        calls.c.dialed_party_number,
+        calls.c.start_time,
+        calls.c.end_time,
+        events.c.event_type,
+        events.c.start_time,
+        events.c.end_time,
+    ]).select_from(
+        calls.outerjoin(events, events.c.call_id == calls.c.call_id)
+    ).where(and_(*conditions)).order_by(calls.c.start_time, calls.c.call_id)
+
+    chunk_size = current_app.config.get('SLA_STREAM_CHUNK_SIZE', 5000)
+
+    # Server side cursor where the driver supports one
+    results = db.session.connection().execution_options(
+        stream_results=True
+    ).execute(query)
+
+    sla_data = {}
+    current_call = None
+    call_length = event_dict = row = None
+    try:
+        chunk = results.fetchmany(chunk_size)
+        while chunk:
+            for call_id, did, call_start, call_end, event_type, event_start, event_end in chunk:
+                if call_id != current_call:
+                    if current_call is not None:
+                        add_call(row, call_length, event_dict)
+
+                    row_name = str(did)
+                    row = sla_data.get(row_name)
+                    if row is None:
+                        row = sla_data[row_name] = SlaRow()
+                    current_call = call_id
+                    call_length = length_microseconds(call_start, call_end)
+                    event_dict = {}
+
+                # Calls without events come back with a NULL event
+                if event_type is not None:
+                    event_dict[event_type] = event_dict.get(
+                        event_type, 0
+                    ) + length_microseconds(event_start, event_end)
+
+            chunk = results.fetchmany(chunk_size)
+    finally:
+        results.close()
+
+    if current_call is not None:
+        add_call(row, call_length, event_dict)
+    return with_archive(start_time, end_time, dids, sla_data)
+
+
+def _sql_sla_rows(start_time, end_time, dids=None):
+    """
+    Aggregate the interval in the database: events are summed per call,
+    then the calls are classified and bucketed per dialed party number.
+    """
+    totals = call_totals_query(
+        start_time, end_time, db.engine.dialect.name, dids=dids
+    ).alias('call_totals')
+
+    wait_duration = totals.c.length - totals.c.talking_time - totals.c.hold_time
+    answered = totals.c.talking_time > 0
+    voicemail = and_(~answered, totals.c.voicemail_time > 20)
+    lost = and_(~answered, totals.c.voicemail_time <= 20, totals.c.length > 20)
+
+    def count_if(*conditions):
+        return func.coalesce(func.sum(case([(and_(*conditions), 1)], else_=0)), 0)
+
+    def sum_if(condition, value):
+        return func.coalesce(func.sum(case([(condition, value)], else_=0)), 0)
+
+    query = select([
+        totals.c.dialed_party_number,
+        count_if(or_(answered, voicemail, lost)),
+        count_if(answered),
+        count_if(lost),
+        count_if(voicemail),
+        sum_if(answered, totals.c.talking_time),
+        sum_if(answered, wait_duration),
+        sum_if(or_(voicemail, lost), totals.c.length),
+        count_if(answered, wait_duration <= 15),
+        count_if(answered, wait_duration > 15, wait_duration <= 30),
+        count_if(answered, wait_duration > 30, wait_duration <= 45),
+        count_if(answered, wait_duration > 45, wait_duration <= 60),
+        count_if(answered, wait_duration > 60, wait_duration <= 999),
+        count_if(answered, wait_duration > 999),
+        func.coalesce(func.max(case([(answered, wait_duration)], else_=0)), 0),
+    ]).group_by(totals.c.dialed_party_number)
+
+    sla_rows = {
+        str(did): SlaRow.from_values(values, unit=1)
+        for did, *values in db.session.execute(query)
+    }
+
+    # Wait histograms and quantile sketches: durations are whole seconds,
+    # so one grouped count per DID and distinct duration feeds them exactly
+    for duration, condition, attributes in (
+        (wait_duration, answered, ('answered_waits', 'answered_wait_sketch')),
+        (totals.c.length, or_(voicemail, lost), ('lost_waits', 'lost_wait_sketch')),
+        (totals.c.talking_time, answered, ('talk_sketch',)),
+    ):
+        distribution_query = select([
+            totals.c.dialed_party_number, duration, func.count()
+        ]).where(condition).group_by(totals.c.dialed_party_number, duration)
+        for did, seconds, count in db.session.execute(distribution_query):
+            row = sla_rows[str(did)]
+            for attribute in attributes:
+                getattr(row, attribute).add(int(seconds) * MICROSECONDS, int(count))
+
+    return with_archive(start_time, end_time, dids, sla_rows)
+
+
+def rows_from_call_totals(calls):
+    """
+    Classify rows of call_totals_query or call_summary_query with the
+    vectorized kernels and return an SlaRow, wait histograms included,
+    per DID.
+    """
+    _, dids, _, _, length, talking_time, hold_time, voicemail_time = zip(*calls)
+    row_names, codes = np.unique([str(did) for did in dids], return_inverse=True)
+    length, talking_time, hold_time, voicemail_time = [
+        np.asarray(column, dtype=np.int64)
+        for column in (length, talking_time, hold_time, voicemail_time)
+    ]
+    columns = (length, talking_time, hold_time, voicemail_time, codes, len(row_names))
+    aggregated = sla_kernel(*columns)
+    answered_waits, lost_waits = histogram_kernel(*columns, n_bins=HISTOGRAM_BINS)
+
+    rows = []
+    for position in range(len(row_names)):
+        row = SlaRow.from_values(aggregated[position].tolist(), unit=1)
+        row.answered_waits = WaitHistogram.from_dense(answered_waits[position].tolist())
+        row.lost_waits = WaitHistogram.from_dense(lost_waits[position].tolist())
+        rows.append(row)
+
+    wait_duration, answered, voicemail, lost = classify_calls(
+        length, talking_time, hold_time, voicemail_time
+    )
+    for attribute, durations, mask in (
+        ('answered_wait_sketch', wait_duration, answered),
+        ('lost_wait_sketch', length, voicemail | lost),
+        ('talk_sketch', talking_time, answered),
+    ):
+        zero_counts, groups, keys, counts = sketch_kernel(
+            durations[mask], codes[mask], len(row_names), SKETCH_LOG_GAMMA
+        )
+        buckets = [([], []) for _ in rows]
+        for group, key, count in zip(groups.tolist(), keys.tolist(), counts.tolist()):
+            buckets[group][0].append(key)
+            buckets[group][1].append(count)
+        for row, zero, (row_keys, row_counts) in zip(rows, zero_counts.tolist(), buckets):
+            setattr(row, attribute, DurationSketch.from_buckets(zero, row_keys, row_counts))
+
+    return dict(zip(row_names.tolist(), rows))
+
+
+def _numpy_sla_rows(start_time, end_time, dids=None):
+    """
+    Fetch the per-call totals as columns and classify them in one
+    vectorized pass of the SLA kernel.
+    """
+    calls = db.session.execute(
+        call_totals_query(start_time, end_time, db.engine.dialect.name, dids=dids)
+    ).fetchall()
+    sla_rows = rows_from_call_totals(calls) if calls else {}
+    return with_archive(start_time, end_time, dids, sla_rows)
+
+
+def _rollup_sla_rows(start_time, end_time, dids=None):
+    """
+    Classify the per-call summaries written at load time, one narrow row
+    per call without touching the event table.
+    """
+    if not summaries_cover(start_time, end_time):
+        logger.warning(
+            "Call summaries do not cover {start} to {end}.\n"
+            "Falling back to the NumPy engine.".format(
+                start=start_time, end=end_time
+            )
+        )
+        return _numpy_sla_rows(start_time, end_time, dids)
+
+    calls = db.session.execute(call_summary_query(start_time, end_time, dids=dids)).fetchall()
+    if not calls:
+        return {}
+
+    return rows_from_call_totals(calls)
+
+
+def _cube_sla_rows(start_time, end_time, dids=None):
+    """
+    Sum the pre-aggregated cube buckets covering the interval, or fall
+    back to the SQL engine when they would not give the same rows.
+    """
+    if not cube_answers(start_time, end_time, dids):
+        logger.warning(
+            "SLA cube does not answer {start} to {end}.\n"
+            "Falling back to the SQL engine.".format(
+                start=start_time, end=end_time
+            )
+        )
+        return _sql_sla_rows(start_time, end_time, dids)
+
+    conditions = [
+        SlaCubeModel.bucket_start >= start_time,
+        SlaCubeModel.bucket_start < end_time
+    ]
+    if dids is not None:
+        conditions.append(did_condition(SlaCubeModel.dialed_party_number, dids))
+    counters = SlaCubeModel.counter_columns()
+    query = select(
+        [SlaCubeModel.dialed_party_number]
+        + [func.coalesce(func.sum(column), 0) for column in counters[:-1]]
+        + [func.coalesce(func.max(counters[-1]), 0)]
+    ).where(and_(*conditions)).group_by(SlaCubeModel.dialed_party_number)
+
+    # The cube only keeps counters, not wait distributions
+    sla_rows = {}
+    for did, *values in db.session.execute(query):
+        row = sla_rows[str(did)] = SlaRow.from_values(values, unit=1)
+        row.has_distributions = False
+    return sla_rows
+
+
+def cube_covers(start_time, end_time):
+    """
+    True if the interval is bucket aligned and the cube has been built for
+    every day it touches.
+    """
+    if not (SlaCubeModel.is_aligned(start_time) and SlaCubeModel.is_aligned(end_time)):
+        return False
+    return TablesLoadedModel.days_have(start_time, end_time, 'cube_loaded')
+
+
+def cube_answers(start_time, end_time, dids=None):
+    """
+    True if the cube gives the same rows as the raw engines. Buckets hold
+    calls by start time while the raw engines only count calls that also
+    end by end_time, so no call started in the interval may end after it.
+    """
+    if not cube_covers(start_time, end_time):
+        return False
+
+    summaries = CallSummaryModel.__table__
+    conditions = [
+        summaries.c.start_time >= start_time,
+        summaries.c.start_time < end_time,
+        summaries.c.end_time > end_time
+    ]
+    if dids is not None:
+        conditions.append(did_condition(summaries.c.dialed_party_number, dids))
+    return not db.session.query(exists().where(and_(*conditions))).scalar()
+
+
+def summaries_cover(start_time, end_time):
+    """
+    True if the call summaries have been built for every day the interval
+    touches.
+    """
+    return TablesLoadedModel.days_have(start_time, end_time, 'summary_loaded')
+
+
+def build_sla_cube(date):
+    """
+    Rebuild the cube buckets for every call that started on the date from
+    its call summaries, which must be built first. Callers commit the
+    session.
+    """
+    day_start = datetime.combine(date, time())
+    day_end = day_start + timedelta(days=1)
+    logger.info("Started: Building SLA cube for {date}".format(date=date))
+
+    calls = db.session.execute(
+        call_summary_query(day_start, None, started_before=day_end)
+    ).fetchall()
+
+    SlaCubeModel.clear(day_start, day_end)
+    if calls:
+        _, dids, start_times, _, length, talking_time, hold_time, voicemail_time = zip(*calls)
+        row_names, did_codes = np.unique([str(did) for did in dids], return_inverse=True)
+        # Calls without a dialed party number keep a NULL DID in the cube
+        numbers = {str(did): did for did in dids}
+
+        buckets_per_day = int(timedelta(days=1) / SlaCubeModel.BUCKET)
+        bucket_codes = np.array([
+            (start - day_start) // SlaCubeModel.BUCKET for start in start_times
+        ], dtype=np.int64)
+        aggregated = sla_kernel(
+            length, talking_time, hold_time, voicemail_time,
+            did_codes * buckets_per_day + bucket_codes,
+            len(row_names) * buckets_per_day
+        )
+
+        names = [column.name for column in SlaCubeModel.counter_columns()]
+        cube_rows = []
+        for code in np.flatnonzero(aggregated[:, 0]):
+            did_code, bucket = divmod(int(code), buckets_per_day)
+            cube_row = dict(zip(names, aggregated[code].tolist()))
+            cube_row['dialed_party_number'] = numbers[row_names[did_code]]
+            cube_row['bucket_start'] = day_start + bucket * SlaCubeModel.BUCKET
+            cube_rows.append(cube_row)
+
+        if cube_rows:
+            db.session.execute(SlaCubeModel.__table__.insert(), cube_rows)
+
+    logger.info("Completed: Building SLA cube for {date}".format(date=date))
+
+
+# Engines opened by parallel build workers, one per database per process
+_worker_engines = {}
+
+
+def _build_slice(database_url, start_time, end_time, slice_start, slice_end,
+                 summarized=False, dids=None):
+    """
+    Aggregate the calls that started in [slice_start, slice_end) and ended
+    by end_time, from the call summaries when they cover the interval.
+    Runs in a pool worker with its own connection.
+    """
+    engine = _worker_engines.get(str(database_url))
+    if engine is None:
+        engine = _worker_engines[str(database_url)] = create_engine(database_url, poolclass=NullPool)
+
+    if summarized:
+        query = call_summary_query(
+            slice_start, end_time, started_before=slice_end, dids=dids
+        )
+    else:
+        query = call_totals_query(
+            slice_start, end_time, engine.dialect.name, started_before=slice_end, dids=dids
+        )
+    with engine.connect() as connection:
+        calls = connection.execute(query).fetchall()
+    if not calls:
+        return {}
+
+    return rows_from_call_totals(calls)
+
+
+def merge_rows(partials):
+    """
+    Combine the per-DID rows of several partial results.
+    """
+    merged = {}
+    for partial in partials:
+        for row_name, row in partial.items():
+            if row_name in merged:
+                merged[row_name].merge(row)
             else:
-                row['Call Ans + 999'] += 1
-
-            # Update longest answered call
-            if wait_duration > row['Longest Waiting Answered']:
-                row['Longest Waiting Answered'] = wait_duration
-
-        # A voice mail is not live answered and last longer than 20 seconds
-        elif voicemail_time > timedelta(seconds=20):
-            row['I/C Presented'] += 1
-            row['Voice Mails'] += 1
-            row['Lost Wait Duration'] += call.length
-
-        # An abandoned call is not live answered and last longer than 20 seconds
-        elif call.length > timedelta(seconds=20):
-            row['I/C Presented'] += 1
-            row['I/C Lost'] += 1
-            row['Lost Wait Duration'] += call.length
-
-        sla_data[row_name] = row
-
-    # Remove empty rows
-    for row_name in [
-        row_name
-        for row_name in sla_data.keys()
-        if sla_data[row_name]['I/C Presented'] == 0
-    ]:
-        sla_data.pop(row_name)
+                merged[row_name] = row
+    return merged
+
+
+def archived_call_totals(start_time, end_time, dids=None):
+    """
+    Rows shaped like call_totals_query for the archived calls in the
+    interval, read from the call summaries kept for archived months.
+    Calls still in the hot tables are left to the raw engines.
+    """
+    months = set(archived.month for archived in ArchivedMonthModel.overlapping(start_time, end_time))
+    if not months:
+        return []
+
+    summaries = CallSummaryModel.__table__
+    calls = CallTableModel.__table__
+    in_months = []
+    for month in sorted(months):
+        month_start, month_end = month_bounds(month)
+        in_months.append(and_(
+            summaries.c.start_time >= month_start, summaries.c.start_time < month_end
+        ))
+    hot = exists().where(calls.c.call_id == summaries.c.call_id)
+
+    query = call_summary_query(start_time, end_time, dids=dids).where(
+        and_(or_(*in_months), ~hot)
+    )
+    return db.session.execute(query).fetchall()
+
+
+def with_archive(start_time, end_time, dids, sla_rows):
+    """
+    Add the calls of archived months in the interval to rows built from
+    the raw tables, which no longer hold them.
+    """
+    calls = archived_call_totals(start_time, end_time, dids)
+    if not calls:
+        return sla_rows
+    return merge_rows([sla_rows, rows_from_call_totals(calls)])
+
+
+def time_slices(start_time, end_time, count):
+    """
+    Split [start_time, end_time) into count consecutive slices. The last
+    slice is left open ended so calls starting exactly at end_time are
+    not lost.
+    """
+    step = (end_time - start_time) / count
+    bounds = [start_time + step * position for position in range(count)]
+    return list(zip(bounds, bounds[1:] + [None]))
+
+
+# Pools the 'parallel' engine can run its slices in. Celery's prefork
+# workers are daemonic and may not start child processes, so reports
+# built on the workers need threads.
+SLA_EXECUTORS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor,
+}
+
+
+def _parallel_sla_rows(start_time, end_time, dids=None):
+    """
+    Split the interval into time slices and aggregate them in a thread or
+    process pool, each worker with its own database connection, then
+    merge the partial rows.
+    """
+    executor_name = current_app.config.get('SLA_PARALLEL_EXECUTOR', 'thread')
+    executor_class = SLA_EXECUTORS.get(executor_name)
+    if executor_class is None:
+        raise ValueError(
+            "Unknown SLA parallel executor: {executor}. Choose one of: {executors}".format(
+                executor=executor_name, executors=", ".join(sorted(SLA_EXECUTORS))
+            )
+        )
+
+    workers = current_app.config.get('SLA_PARALLEL_WORKERS') or os.cpu_count() or 1
+    # More slices than workers evens out busy and quiet hours
+    slices = time_slices(
+        start_time, end_time,
+        workers * current_app.config.get('SLA_PARALLEL_SLICES_PER_WORKER', 4)
+    )
+    database_url = db.engine.url
+    summarized = summaries_cover(start_time, end_time)
+
+    with executor_class(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                _build_slice, database_url, start_time, end_time,
+                slice_start, slice_end, summarized, dids
+            )
+            for slice_start, slice_end in slices
+        ]
+        partials = [future.result() for future in futures]
+
+    # Call summaries outlive the archived raw data, the raw tables do not
+    if summarized:
+        return merge_rows(partials)
+    return with_archive(start_time, end_time, dids, merge_rows(partials))
+
+
+SLA_ENGINES = {
+    'orm': _orm_sla_rows,
+    'sql': _sql_sla_rows,
+    'numpy': _numpy_sla_rows,
+    'rollup': _rollup_sla_rows,
+    'stream': _stream_sla_rows,
+    'cube': _cube_sla_rows,
+    'parallel': _parallel_sla_rows,
+}
+
+
+def rows_to_data(sla_rows):
+    """
+    Report JSON for the rows, leaving out DIDs without presented calls.
+    """
+    return {
+        row_name: row.to_dict()
+        for row_name, row in sla_rows.items()
+        if row.presented > 0
+    }
+
+
+def rows_to_histograms(sla_rows, all_rows=False):
+    """
+    Wait histograms stored with the report, for the same DIDs as the data
+    except those whose rows have no distributions.
+    """
+    return {
+        row_name: row.histograms_to_dict()
+        for row_name, row in sla_rows.items()
+        if (all_rows or row.presented > 0) and row.has_distributions
+    }
+
+
+def rows_to_sketches(sla_rows, all_rows=False):
+    """
+    Quantile sketches stored with the report, for the same DIDs as the data
+    except those whose rows have no distributions.
+    """
+    return {
+        row_name: row.sketches_to_dict()
+        for row_name, row in sla_rows.items()
+        if (all_rows or row.presented > 0) and row.has_distributions
+    }
+
+
+def distributions_missing(data, histograms):
+    """
+    True if some row of the report data has no stored distributions.
+    """
+    return bool(set(data or {}) - set(histograms or {}))
+
+
+def build_sla_data(start_time, end_time, engine='orm', dids=None):
+    return rows_to_data(build_sla_rows(start_time, end_time, engine=engine, dids=dids))
+
+
+def build_sla_rows(start_time, end_time, engine='orm', dids=None):
+    """
+    SlaRows per DID for the interval, restricted to the given report row
+    names when dids is set.
+    """
+    logger.info(
+        "Started: Building SLA report data {start} to {end}".format(
+            start=start_time, end=end_time
+        )
+    )
+    # Check that the data has been loaded for the report date
+    coverage = TablesLoadedModel.coverage(start_time, end_time)
+    if coverage.partial or coverage.missing:
+        logger.warning(
+            "Data not loaded for report interval: {partial} partially loaded "
+            "and {missing} missing days.\n"
+            "Attempting to load data.".format(
+                partial=len(coverage.partial), missing=len(coverage.missing)
+            )
+        )
+        # TODO: implement this
+
+    sla_engine = SLA_ENGINES.get(engine)
+    if sla_engine is None:
+        logger.error(
+            "Error: Unknown SLA report engine: {engine}.\n"
+            "Choose one of: {engines}".format(
+                engine=engine, engines=", ".join(sorted(SLA_ENGINES))
+            )
+        )
+        return {}
+
+    sla_rows = sla_engine(start_time, end_time, dids)
 
     logger.info(
         "Completed: Building SLA report data {start} to {end}".format(
             start=start_time, end=end_time
         )
     )
-    return sla_data
+    return sla_rows
+
+
+def summary_reports(start_time, end_time, interval, distributions=False):
+    """
+    The sub-intervals of a summary and the stored report of each one that
+    has it, fetched with a single range query, their histograms and
+    sketches only with distributions:
+    ([(sub_start, sub_end), ...], {(sub_start, sub_end): report})
+    """
+    bounds = []
+    sub_start = start_time
+    while sub_start < end_time:
+        bounds.append((sub_start, sub_start + interval))
+        sub_start += interval
+    if not bounds:
+        return bounds, {}
+
+    # Reports of other lengths inside the range are ignored by the lookup
+    reports = {}
+    for report in SlaReportModel.in_range(start_time, bounds[-1][1], distributions):
+        reports.setdefault((report.start_time, report.end_time), report)
+    return bounds, reports
+
+
+def covering_reports(start_time, end_time):
+    """
+    Finished reports that follow each other from start_time, taking the
+    longest one at each step, and whether they reach end_time. Reports
+    overlapping one already taken are left out so no call counts twice.
+    Only the taken reports have their histograms and sketches read.
+    """
+    longest = {}
+    for report in SlaReportModel.in_range(start_time, end_time):
+        if report.completed_on is None:
+            continue
+        taken = longest.get(report.start_time)
+        if taken is None or report.end_time > taken.end_time:
+            longest[report.start_time] = report
 
+    reports = []
+    cursor = start_time
+    while cursor < end_time and cursor in longest:
+        reports.append(longest[cursor])
+        cursor = longest[cursor].end_time
+    return SlaReportModel.load_distributions(reports), cursor >= end_time
 
-def build_summary_sla_data(start_time, end_time, interval):
+
+def build_summary_sla_data(start_time, end_time, interval, dids=None):
+    """
+    Pivot the stored reports of every sub-interval into one table per DID,
+    fetching them with a single range query.
+    """
     logger.info(
         "Started: Building SLA summary report data {start} to {end}".format(
             start=start_time, end=end_time
         )
     )
 
-    if not SlaReportModel.interval_is_loaded(start_time, end_time, interval):
+    bounds, reports = summary_reports(start_time, end_time, interval)
+    if not bounds:
+        return {}
+
+    if not (
+        all(sub_interval in reports for sub_interval in bounds)
+        or cube_covers(start_time, end_time)
+    ):
         logger.warning("Data not loaded for report interval.\n"
                        "Attempting to load data.")
         # TODO: implement this
         return "Error: SLA reports are not loaded for the interval."
 
     summary_sla_data = {}
-    while start_time < end_time:
-        end_dt = start_time + interval
-        report = SlaReportModel.get(start_time, end_dt)
-        if not report:
+    for sub_start, sub_end in bounds:
+        report = reports.get((sub_start, sub_end))
+        if not (report and report.completed_on) and cube_answers(sub_start, sub_end, dids):
+            # Answer the sub-interval from the cube instead of raw data
+            report_data = rows_to_data(_cube_sla_rows(sub_start, sub_end, dids))
+        elif not report:
             logger.warning("Report not created for report interval.\n"
                            "Attempting to load data.")
-            SlaReportModel.create(start_time=start_time, end_time=end_dt)
+            SlaReportModel.create(start_time=sub_start, end_time=sub_end)
             SlaReportModel.session.commit()
             # TODO: implement this
             return "Error: a SLA report could not be located for {start} to {end}.".format(
-                start=start_time, end=end_dt
+                start=sub_start, end=sub_end
             )
-
-        if not report.data:
+        elif report.completed_on is None:
             logger.warning(
                 "Error: a SLA report with finished data could not "
                 "be located for {start} to {end}.".format(
-                    start=start_time, end=end_dt
+                    start=sub_start, end=sub_end
                 )
             )
             # TODO: implement this
             return "Error: data is not loaded for report"
+        else:
+            # Empty reports are finished reports without rows
+            report_data = report.data or {}
 
         dt_row_name = "{date} {start} to {end}".format(
-            date=start_time.date(), start=start_time.time(), end=end_dt.time()
+            date=sub_start.date(), start=sub_start.time(), end=sub_end.time()
         )
-        for row_name in report.data.keys():
-            summary = summary_sla_data.get(row_name, {})
-            summary[dt_row_name] = report.data[row_name]
-            summary_sla_data[row_name] = summary
-
-        start_time = end_dt
+        for row_name, row in report_data.items():
+            if dids is None or row_name in dids:
+                summary_sla_data.setdefault(row_name, {})[dt_row_name] = row
 
     logger.info(
         "Completed: Building SLA report data {start} to {end}".format(
@@ -200,3 +917,109 @@ def build_summary_sla_data(start_time, end_time, interval):
         )
     )
     return summary_sla_data
+
+
+def merge_distributions(reports, dids=None):
+    """
+    Add up the stored per-DID wait histograms and quantile sketches of
+    several reports, returning SlaRows that only carry distributions.
+    """
+    merged = {}
+    for report in reports:
+        histograms = report.histograms or {}
+        sketches = report.sketches or {}
+        for row_name in set(histograms) | set(sketches):
+            if dids is not None and row_name not in dids:
+                continue
+            row = SlaRow().histograms_from_dict(
+                histograms.get(row_name, {})
+            ).sketches_from_dict(
+                sketches.get(row_name, {})
+            )
+            if row_name in merged:
+                merged[row_name].merge(row)
+            else:
+                merged[row_name] = row
+    return merged
+
+
+def build_summary_distributions(start_time, end_time, interval, dids=None):
+    """
+    Wait histograms and quantile sketches for a summary, merged from the
+    stored report of each sub-interval without touching raw call data.
+    Returns (histograms, sketches, partial); partial is True when some
+    sub-interval has no stored report or report rows without
+    distributions, as when the cube answered it.
+    """
+    bounds, reports = summary_reports(start_time, end_time, interval, distributions=True)
+    selected = [
+        reports[sub_interval] for sub_interval in bounds
+        if sub_interval in reports and reports[sub_interval].completed_on is not None
+    ]
+    merged = merge_distributions(selected, dids)
+    return (
+        rows_to_histograms(merged, all_rows=True),
+        rows_to_sketches(merged, all_rows=True),
+        len(selected) < len(bounds)
+        or any(report.distributions_partial for report in selected)
+    )
+
+
+def replace_rows(stored, fresh, dids):
+    """
+    Stored report JSON with the rows of the given DIDs replaced by the
+    freshly built ones. DIDs without fresh rows are dropped.
+    """
+    merged = {
+        row_name: row for row_name, row in (stored or {}).items()
+        if row_name not in dids
+    }
+    merged.update(fresh)
+    return merged
+
+
+def calls_by_day(call_ids):
+    """
+    The report row names of the given calls grouped by call start day.
+    """
+    calls = CallTableModel.__table__
+    call_ids = list(call_ids)
+    changed = {}
+    # Stay well below the bound parameter limits of the databases
+    for position in range(0, len(call_ids), 500):
+        query = select([
+            calls.c.dialed_party_number, calls.c.start_time
+        ]).where(calls.c.call_id.in_(call_ids[position:position + 500]))
+        for did, start in db.session.execute(query):
+            changed.setdefault(start.date(), set()).add(str(did))
+    return changed
+
+
+def mark_reports_dirty(call_ids):
+    """
+    Flag the finished reports and summaries that overlap the start days
+    of the given calls as dirty for the DIDs of those calls.
+    Callers commit the session.
+    """
+    return mark_days_dirty(calls_by_day(call_ids))
+
+
+def mark_days_dirty(changed):
+    """
+    Flag the finished reports and summaries overlapping each day as dirty
+    for its DIDs: {date: set of row names}. Callers commit the session.
+    """
+    marked = 0
+    for date, dids in changed.items():
+        day_start = datetime.combine(date, time())
+        day_end = day_start + timedelta(days=1)
+        marked += SlaReportModel.mark_dirty(day_start, day_end, dids)
+        marked += SummarySLAReportModel.mark_dirty(day_start, day_end, dids)
+
+    if marked:
+        logger.info(
+            "Marked {count} reports dirty for late data on {dates}".format(
+                count=marked, dates=", ".join(str(date) for date in sorted(changed))
+            )
+        )
+    return marked
@@ -0,0 +1,180 @@
+# report/cache.py
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from flask import current_app
+
+
+logger = logging.getLogger("app")
+
+
+def _json_default(value):
+    # numpy scalars from frames, datetimes from validators
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def frame_to_json(frame):
+    return frame.to_dict(orient='split')
+
+
+def frame_from_json(data):
+    return pd.DataFrame(data['data'], index=data['index'], columns=data['columns'])
+
+
+class ResponseCache(object):
+    """
+    Two tier cache of built responses: a per process LRU in front of a
+    directory of JSON entries shared by every worker on the host.
+    Entries are stored with a validator and only returned while the
+    caller's current validator still matches it. Files older than
+    RESPONSE_CACHE_TTL are ignored, and the oldest are pruned once the
+    directory holds more than RESPONSE_CACHE_FILES.
+    """
+
+    def __init__(self, name, dump=frame_to_json, load=frame_from_json):
+        self.name = name
+        self.dump = dump
+        self.load = load
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_entries(self):
+        return current_app.config.get('RESPONSE_CACHE_SIZE', 128)
+
+    @property
+    def max_files(self):
+        return current_app.config.get('RESPONSE_CACHE_FILES', 1024)
+
+    @property
+    def ttl(self):
+        return current_app.config.get('RESPONSE_CACHE_TTL', 3600)
+
+    @property
+    def directory(self):
+        directory = current_app.config.get('RESPONSE_CACHE_DIRECTORY')
+        if directory:
+            return os.path.join(directory, self.name)
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.json')
+
+    @staticmethod
+    def _token(validator):
+        # Validators are compared in their JSON form, as read from disk
+        return json.dumps(validator, default=_json_default)
+
+    def get(self, key, validator):
+        """
+        The cached value for the key, or None if there is none or it was
+        stored under another validator.
+        """
+        token = self._token(validator)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.directory:
+            entry = self._read(key)
+            if entry is not None:
+                self._remember(key, entry)
+
+        if entry is None or entry[0] != token:
+            return None
+        return entry[1]
+
+    def set(self, key, validator, value):
+        entry = (self._token(validator), value)
+        self._remember(key, entry)
+        if self.directory:
+            self._write(key, entry)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                return None
+            with open(path, 'r') as cache_file:
+                stored = json.load(cache_file)
+            # Guard against digest collisions
+            if stored['key'] != repr(key):
+                return None
+            return stored['validator'], self.load(stored['value'])
+        except FileNotFoundError:
+            return None
+        except Exception as err:
+            logger.warning("Unreadable {name} cache entry: {err}".format(name=self.name, err=err))
+            return None
+
+    def _write(self, key, entry):
+        # Written to a temporary file and renamed, so readers in other
+        # workers never see a partial entry
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            handle, partial_path = tempfile.mkstemp(dir=self.directory, suffix='.partial')
+            with os.fdopen(handle, 'w') as cache_file:
+                json.dump({
+                    'key': repr(key),
+                    'validator': entry[0],
+                    'value': self.dump(entry[1]),
+                }, cache_file, default=_json_default)
+            os.replace(partial_path, self._path(key))
+            self._prune()
+        except OSError as err:
+            logger.warning("Could not write {name} cache entry: {err}".format(name=self.name, err=err))
+
+    def _prune(self):
+        """
+        Remove expired entries, then the oldest ones over max_files.
+        Partial files are only removed once expired, as another worker
+        may still be writing them.
+        """
+        expired_before = time.time() - self.ttl
+        entries = []
+        for file_name in os.listdir(self.directory):
+            path = os.path.join(self.directory, file_name)
+            try:
+                modified = os.path.getmtime(path)
+            except FileNotFoundError:
+                continue
+            if file_name.endswith('.json'):
+                entries.append((modified, path))
+            elif modified < expired_before:
+                entries.append((0, path))
+        entries.sort()
+
+        excess = len(entries) - self.max_files
+        for position, (modified, path) in enumerate(entries):
+            if position >= excess and modified >= expired_before:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# Formatted SLA report frames by (start_time, end_time, clients)
+sla_report_cache = ResponseCache('sla_report')
@@ -1,11 +1,14 @@
 # report/api.py
-from flask import jsonify
-from flask_restful import Resource, reqparse
+import hashlib
+from flask import current_app, jsonify, request, url_for
+from flask_restful import Resource, abort, reqparse
 from flask_security import current_user
 
-from app.report.tasks import report_task, get_sla_report
-from app.core import to_datetime, to_list, to_bool
-from .models import ClientModel, ClientManager
+from app.report.tasks import (
+    report_task, request_sla_report, get_sla_report, get_sla_wait_metrics, get_sla_quantiles
+)
+from app.core import to_datetime, to_list, to_bool, to_number_list, to_percentile_list
+from .models import ClientDirectory, ClientManager, SlaReportModel
 from .serializers import ClientModelSchema
 
 
@@ -41,6 +44,136 @@ class ReportAPI(Resource):
         )
 
 
+def add_report_arguments(parser):
+    """
+    Arguments shaping an SLA report response.
+    """
+    parser.add_argument(
+        'clients', type=to_list,
+        help='List of clients to be row values.'
+    )
+    parser.add_argument(
+        'wait_thresholds', type=to_number_list,
+        help='List of answer time thresholds in seconds.'
+    )
+    parser.add_argument(
+        'wait_percentiles', type=to_percentile_list,
+        help='List of wait time percentiles.'
+    )
+    parser.add_argument(
+        'quantiles', type=to_percentile_list,
+        help='List of duration percentiles from the quantile sketches.'
+    )
+    return parser
+
+
+def report_response(start_time, end_time, args, status='complete'):
+    report_frame = get_sla_report(
+        start_time=start_time,
+        end_time=end_time,
+        clients=args['clients']
+    )
+    if report_frame is None:
+        # Reopened for a rebuild since the caller saw it finished
+        return job_response(SlaReportModel.get(start_time, end_time))
+    response = dict(status=status, data=report_frame.to_dict(orient='split')['data'])
+    if args['wait_thresholds'] or args['wait_percentiles']:
+        response['wait_metrics'], response['wait_metrics_partial'] = get_sla_wait_metrics(
+            start_time=start_time,
+            end_time=end_time,
+            clients=args['clients'],
+            thresholds=args['wait_thresholds'] or (),
+            percentiles=args['wait_percentiles'] or ()
+        )
+    if args['quantiles']:
+        response['quantiles'], response['quantiles_partial'] = get_sla_quantiles(
+            start_time=start_time,
+            end_time=end_time,
+            clients=args['clients'],
+            percentiles=args['quantiles']
+        )
+    return jsonify(**response)
+
+
+def entity_tag(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def not_modified(etag, last_modified=None):
+    """
+    True if the request's validators show the client already holds the
+    current representation. If-None-Match takes precedence when sent.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified and request.if_modified_since:
+        # HTTP dates only carry whole seconds; report times are naive UTC
+        modified_since = request.if_modified_since.replace(tzinfo=None)
+        return last_modified.replace(microsecond=0) <= modified_since
+    return False
+
+
+def conditional(response, etag, last_modified=None):
+    """
+    Attach validators so browsers and proxies revalidate instead of
+    refetching the whole response.
+    """
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified_response(etag, last_modified=None):
+    return conditional(current_app.response_class(status=304), etag, last_modified)
+
+
+def conditional_report_response(report, args):
+    """
+    The report response, or 304 Not Modified without building it when
+    neither the report, the client names nor the arguments changed.
+    """
+    client_version = ClientDirectory.version()
+    etag = entity_tag(
+        report.id, report.completed_on, client_version, sorted(args.items())
+    )
+    last_modified = max(
+        moment for moment in (report.completed_on, client_version[1]) if moment
+    )
+    if not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+    return conditional(
+        report_response(report.start_time, report.end_time, args, report.status or 'complete'),
+        etag, last_modified
+    )
+
+
+def job_response(report):
+    """
+    202 Accepted for a report still being built, pointing at its status.
+    A failed build answers right away without data until it is retried.
+    """
+    status_url = url_for('sla_report_bp.slareportjobapi', job_id=report.id)
+    if report.status == 'failed':
+        return jsonify(
+            job_id=report.id,
+            status='failed',
+            failed_on=report.last_updated,
+            attempts=report.attempts,
+            data=[]
+        )
+    response = jsonify(
+        job_id=report.id,
+        status='pending',
+        queued_on=report.last_updated,
+        status_url=status_url
+    )
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+
 class SLAReportAPI(Resource):
 
     def __init__(self):
@@ -53,22 +186,35 @@ class SLAReportAPI(Resource):
             'end_time', type=to_datetime,
             help='End time for data interval.'
         )
-        parser.add_argument(
-            'clients', type=to_list,
-            help='List of clients to be row values.'
-        )
-        self.args = parser.parse_args()
+        self.args = add_report_arguments(parser).parse_args()
         super().__init__()
 
+    def get(self):
+        if not (self.args['start_time'] and self.args['end_time']):
+            abort(400, message="Both start_time and end_time are required.")
+        # Missing reports are built by the workers, not in the request
+        report = request_sla_report(self.args['start_time'], self.args['end_time'])
+        if report.completed_on is None:
+            return job_response(report)
+        return conditional_report_response(report, self.args)
+
     def post(self):
-        report_frame = get_sla_report(
-            start_time=self.args['start_time'],
-            end_time=self.args['end_time'],
-            clients=self.args['clients']
-        )
-        return jsonify(
-            data=report_frame.to_dict(orient='split')['data']
-        )
+        return self.get()
+
+
+class SLAReportJobAPI(Resource):
+
+    def __init__(self):
+        self.args = add_report_arguments(reqparse.RequestParser()).parse_args()
+        super().__init__()
+
+    def get(self, job_id):
+        report = SlaReportModel.find(job_id)
+        if report is None:
+            abort(404, message="Report job {job_id} does not exist.".format(job_id=job_id))
+        if report.completed_on is None:
+            return job_response(report)
+        return conditional_report_response(report, self.args)
 
 
 class SLAClientAPI(Resource):
@@ -81,9 +227,14 @@ class SLAClientAPI(Resource):
         super().__init__()
 
     def get(self):
-        all_clients = ClientModel.query.filter(ClientModel.active == self.args['active']).all()
-        return jsonify(
-            data=self.schema.dump(all_clients).data
+        count, last_modified = ClientDirectory.version()
+        etag = entity_tag(count, last_modified, self.args['active'])
+        if not_modified(etag, last_modified):
+            return not_modified_response(etag, last_modified)
+
+        all_clients = ClientDirectory.clients(active=self.args['active'])
+        return conditional(
+            jsonify(data=self.schema.dump(all_clients).data), etag, last_modified
         )
 
     def post(self):
@@ -0,0 +1,85 @@
+# report/cube_test.py
+import datetime
+import unittest
+
+from app.extensions import db
+from .builders import (
+    _cube_sla_rows, _sql_sla_rows, cube_answers, distributions_missing, rows_to_data,
+    rows_to_histograms
+)
+from .models import CallTableModel, SlaCubeModel
+from .testing import ReportTestCase, seed_calls, load_day
+from .utilities.report_helpers import compute_wait_metrics
+
+DAY = datetime.date(2018, 7, 2)
+DAY_START = datetime.datetime(2018, 7, 2)
+
+
+class SlaCubeTest(ReportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        seed_calls(DAY, 400)
+        # Starts in the 06:00 to 12:00 interval and ends after it
+        db.session.add(CallTableModel(
+            call_id=1000,
+            call_direction=1,
+            dialed_party_number='7559',
+            start_time=DAY_START + datetime.timedelta(hours=11, minutes=55),
+            end_time=DAY_START + datetime.timedelta(hours=12, minutes=10)
+        ))
+        db.session.commit()
+        load_day(DAY)
+
+    def assert_same_rows(self, start_time, end_time, dids=None):
+        self.assertEqual(
+            rows_to_data(_cube_sla_rows(start_time, end_time, dids)),
+            rows_to_data(_sql_sla_rows(start_time, end_time, dids))
+        )
+
+    def test_whole_day_matches_raw_engines(self):
+        day_end = DAY_START + datetime.timedelta(days=1)
+        self.assertTrue(cube_answers(DAY_START, day_end))
+        self.assert_same_rows(DAY_START, day_end)
+
+    def test_calls_ending_after_the_interval_fall_back(self):
+        start_time = DAY_START + datetime.timedelta(hours=6)
+        end_time = DAY_START + datetime.timedelta(hours=12)
+        self.assertFalse(cube_answers(start_time, end_time))
+        self.assert_same_rows(start_time, end_time)
+
+    def test_unaligned_interval_falls_back(self):
+        start_time = DAY_START + datetime.timedelta(minutes=5)
+        end_time = DAY_START + datetime.timedelta(days=1)
+        self.assertFalse(cube_answers(start_time, end_time))
+        self.assert_same_rows(start_time, end_time)
+
+    def test_null_dids_are_stored_as_null(self):
+        self.assertEqual(
+            SlaCubeModel.query.filter(SlaCubeModel.dialed_party_number == 'None').count(), 0
+        )
+        self.assertGreater(
+            SlaCubeModel.query.filter(SlaCubeModel.dialed_party_number.is_(None)).count(), 0
+        )
+
+    def test_did_filter_matches_raw_engines(self):
+        day_end = DAY_START + datetime.timedelta(days=1)
+        for dids in (['None'], ['7559', 'None'], ['7561']):
+            self.assert_same_rows(DAY_START, day_end, dids)
+
+    def test_cube_rows_have_no_wait_metrics(self):
+        sla_rows = _cube_sla_rows(DAY_START, DAY_START + datetime.timedelta(days=1))
+        data, histograms = rows_to_data(sla_rows), rows_to_histograms(sla_rows)
+        self.assertEqual(histograms, {})
+        self.assertTrue(distributions_missing(data, histograms))
+
+        metrics = compute_wait_metrics(
+            histograms, thresholds=[15], percentiles=[50], row_names=data
+        )
+        self.assertEqual(set(metrics), set(data) | {'Summary'})
+        for row_metrics in metrics.values():
+            self.assertEqual(set(row_metrics.values()), {None})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+# report/kernels.py
+import numpy as np
+
+# Upper bounds (inclusive) of the answered wait buckets in seconds:
+# 'Calls Ans Within 15' ... 'Calls Ans Within 999', anything longer
+# falls in 'Call Ans + 999'
+WAIT_THRESHOLDS = (15, 30, 45, 60, 999)
+
+# Calls that are not live answered only count when they last longer
+# than this many seconds
+MIN_LOST_SECONDS = 20
+
+# Column positions of the kernel output, in aggregates.HEADERS order
+PRESENTED, LIVE_ANSWERED, LOST, VOICE_MAILS = range(4)
+ANSWERED_DURATION, ANSWERED_WAIT, LOST_WAIT = range(4, 7)
+FIRST_BUCKET = 7
+LONGEST_WAIT = 13
+NUM_COLUMNS = 14
+
+
+def classify_calls(length, talking_time, hold_time, voicemail_time, unit=1):
+    """
+    Wait duration and answered / voice mail / abandoned masks per call.
+    """
+    wait_duration = length - talking_time - hold_time
+
+    # Same precedence as the per-call builder: answered, then voice mail,
+    # then abandoned
+    answered = talking_time > 0
+    voicemail = ~answered & (voicemail_time > MIN_LOST_SECONDS * unit)
+    lost = ~answered & ~voicemail & (length > MIN_LOST_SECONDS * unit)
+    return wait_duration, answered, voicemail, lost
+
+
+def sla_kernel(length, talking_time, hold_time, voicemail_time, codes, n_groups, unit=1):
+    """
+    Classify a batch of calls and aggregate them per group.
+
+    The duration arrays hold one integer per call in ``unit`` ticks per
+    second (1 for seconds, 1000000 for microseconds). ``codes`` maps each
+    call to a group in ``range(n_groups)``, e.g. the inverse returned by
+    ``np.unique`` over the dialed party numbers.
+
+    Returns an int64 array of shape (n_groups, NUM_COLUMNS) with one row
+    per group and the columns of aggregates.HEADERS; durations are in ticks.
+    """
+    length = np.asarray(length, dtype=np.int64)
+    talking_time = np.asarray(talking_time, dtype=np.int64)
+    hold_time = np.asarray(hold_time, dtype=np.int64)
+    voicemail_time = np.asarray(voicemail_time, dtype=np.int64)
+    codes = np.asarray(codes, dtype=np.int64)
+
+    result = np.zeros((n_groups, NUM_COLUMNS), dtype=np.int64)
+    if not len(codes):
+        return result
+
+    wait_duration, answered, voicemail, lost = classify_calls(
+        length, talking_time, hold_time, voicemail_time, unit
+    )
+
+    buckets = np.digitize(
+        wait_duration, np.array(WAIT_THRESHOLDS, dtype=np.int64) * unit, right=True
+    )
+
+    contributions = np.zeros((len(codes), NUM_COLUMNS), dtype=np.int64)
+    contributions[:, PRESENTED] = answered | voicemail | lost
+    contributions[:, LIVE_ANSWERED] = answered
+    contributions[:, LOST] = lost
+    contributions[:, VOICE_MAILS] = voicemail
+    contributions[:, ANSWERED_DURATION] = np.where(answered, talking_time, 0)
+    contributions[:, ANSWERED_WAIT] = np.where(answered, wait_duration, 0)
+    contributions[:, LOST_WAIT] = np.where(voicemail | lost, length, 0)
+    contributions[np.flatnonzero(answered), FIRST_BUCKET + buckets[answered]] = 1
+    # The longest wait starts at zero and only grows with answered calls
+    contributions[:, LONGEST_WAIT] = np.where(answered, np.maximum(wait_duration, 0), 0)
+
+    # Sort once so every group is a contiguous run of rows
+    order = np.argsort(codes, kind='mergesort')
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    groups = sorted_codes[starts]
+    contributions = contributions[order]
+
+    result[groups] = np.add.reduceat(contributions, starts, axis=0)
+    result[groups, LONGEST_WAIT] = np.maximum.reduceat(contributions[:, LONGEST_WAIT], starts)
+    return result
+
+
+def histogram_kernel(length, talking_time, hold_time, voicemail_time, codes, n_groups, n_bins, unit=1):
+    """
+    Dense wait histograms per group with one-second bins: bin n counts
+    waits in (n - 1, n] seconds and the last bin everything longer.
+
+    Returns two int64 arrays of shape (n_groups, n_bins): the wait of
+    answered calls and the length of voice mail and abandoned calls.
+    """
+    length = np.asarray(length, dtype=np.int64)
+    talking_time = np.asarray(talking_time, dtype=np.int64)
+    hold_time = np.asarray(hold_time, dtype=np.int64)
+    voicemail_time = np.asarray(voicemail_time, dtype=np.int64)
+    codes = np.asarray(codes, dtype=np.int64)
+
+    wait_duration, answered, voicemail, lost = classify_calls(
+        length, talking_time, hold_time, voicemail_time, unit
+    )
+
+    def histogram(durations, mask):
+        # Round up to whole seconds, clip into the first and last bins
+        bins = np.clip(-(-durations[mask] // unit), 0, n_bins - 1)
+        return np.bincount(
+            codes[mask] * n_bins + bins, minlength=n_groups * n_bins
+        ).reshape(n_groups, n_bins)
+
+    return histogram(wait_duration, answered), histogram(length, voicemail | lost)
+
+
+def sketch_kernel(durations, codes, n_groups, log_gamma, unit=1):
+    """
+    Log-spaced sketch buckets per group for the given durations.
+
+    Returns the count of zero or negative durations per group, and the
+    group code, bucket key and count of every occupied bucket.
+    """
+    durations = np.asarray(durations, dtype=np.int64)
+    codes = np.asarray(codes, dtype=np.int64)
+
+    positive = durations > 0
+    zero_counts = np.bincount(codes[~positive], minlength=n_groups)
+    if not positive.any():
+        empty = np.zeros(0, dtype=np.int64)
+        return zero_counts, empty, empty, empty
+
+    keys = np.ceil(np.log(durations[positive] / unit) / log_gamma).astype(np.int64)
+    pairs, counts = np.unique(
+        np.stack([codes[positive], keys], axis=1), axis=0, return_counts=True
+    )
+    return zero_counts, pairs[:, 0], pairs[:, 1], counts
@@ -0,0 +1,143 @@
+# report/kernels_test.py
+import datetime
+import random
+import unittest
+
+import numpy as np
+
+from app.extensions import db
+from .aggregates import MICROSECONDS, HISTOGRAM_BINS, SlaRow
+from .builders import _orm_sla_rows, _numpy_sla_rows, rows_from_call_totals
+from .kernels import WAIT_THRESHOLDS, MIN_LOST_SECONDS, sla_kernel, histogram_kernel
+from .models import CallTableModel, EventTableModel
+from .testing import ReportTestCase, seed_calls, TALKING
+
+DAY = datetime.date(2018, 7, 2)
+DAY_START = datetime.datetime(2018, 7, 2)
+
+# Durations on and either side of every classification boundary
+EDGES = sorted(set(
+    edge + offset
+    for edge in (0, MIN_LOST_SECONDS) + WAIT_THRESHOLDS + (HISTOGRAM_BINS,)
+    for offset in (-1, 0, 1)
+))
+
+
+def random_calls(count, seed=1):
+    """
+    Per-call totals in whole seconds shaped like call_totals_query rows,
+    with edge durations and calls without a dialed party number.
+    """
+    rnd = random.Random(seed)
+    calls = []
+    for call_id in range(count):
+        length = rnd.choice(EDGES + [rnd.randint(0, 2000)])
+        talking_time = rnd.choice([0, 0, rnd.randint(0, length + 1)])
+        hold_time = rnd.choice([0, rnd.randint(0, 60)])
+        voicemail_time = rnd.choice([0, rnd.choice(EDGES)])
+        did = rnd.choice(['7559', '7560', None])
+        calls.append((call_id, did, None, None, length, talking_time, hold_time, voicemail_time))
+    return calls
+
+
+def reference_rows(calls):
+    """
+    The rows SlaRow.add_call gives one call at a time, as the ORM engine
+    builds them.
+    """
+    rows = {}
+    for _, did, _, _, length, talking_time, hold_time, voicemail_time in calls:
+        rows.setdefault(str(did), SlaRow()).add_call(
+            length * MICROSECONDS, talking_time * MICROSECONDS,
+            hold_time * MICROSECONDS, voicemail_time * MICROSECONDS
+        )
+    return rows
+
+
+class KernelTest(unittest.TestCase):
+
+    def test_kernels_match_add_call(self):
+        calls = random_calls(2000)
+        self.assertEqual(rows_from_call_totals(calls), reference_rows(calls))
+
+    def test_each_edge_alone(self):
+        for length in EDGES:
+            for talking_time in (0, 1, length):
+                for voicemail_time in (0, MIN_LOST_SECONDS, MIN_LOST_SECONDS + 1):
+                    calls = [(1, None, None, None, length, talking_time, 0, voicemail_time)]
+                    self.assertEqual(
+                        rows_from_call_totals(calls), reference_rows(calls),
+                        (length, talking_time, voicemail_time)
+                    )
+
+    def test_sla_kernel_in_microseconds(self):
+        calls = random_calls(500, seed=2)
+        _, _, _, _, length, talking_time, hold_time, voicemail_time = zip(*calls)
+        codes = np.zeros(len(calls), dtype=np.int64)
+        columns = [
+            np.asarray(column, dtype=np.int64) * MICROSECONDS
+            for column in (length, talking_time, hold_time, voicemail_time)
+        ]
+        aggregated = sla_kernel(*columns, codes=codes, n_groups=1, unit=MICROSECONDS)
+
+        expected = SlaRow()
+        for row in reference_rows(calls).values():
+            expected.merge(row)
+        self.assertEqual(aggregated[0].tolist(), expected.values())
+
+    def test_empty_groups_stay_zero(self):
+        calls = random_calls(50, seed=3)
+        _, _, _, _, length, talking_time, hold_time, voicemail_time = zip(*calls)
+        codes = np.full(len(calls), 2, dtype=np.int64)
+        columns = (length, talking_time, hold_time, voicemail_time, codes, 4)
+
+        aggregated = sla_kernel(*columns)
+        answered, lost = histogram_kernel(*columns, n_bins=HISTOGRAM_BINS)
+        self.assertFalse(aggregated[[0, 1, 3]].any())
+        self.assertFalse(answered[[0, 1, 3]].any() or lost[[0, 1, 3]].any())
+        # Every answered call has a wait and every lost call a length
+        self.assertEqual(int(answered[2].sum()), int(aggregated[2, 1]))
+        self.assertEqual(int(lost[2].sum()), int(aggregated[2, 2] + aggregated[2, 3]))
+
+
+class KernelEngineTest(ReportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        seed_calls(DAY, 300)
+        # Calls on the interval edges: the first two are counted, the
+        # last ends a microsecond too late
+        start_time = DAY_START + datetime.timedelta(hours=6)
+        end_time = DAY_START + datetime.timedelta(hours=12)
+        for call_id, did, call_start, call_end in (
+            (1001, None, start_time, start_time + datetime.timedelta(seconds=75)),
+            (1002, '7559', end_time - datetime.timedelta(seconds=90), end_time),
+            (1003, '7559', end_time - datetime.timedelta(seconds=90),
+             end_time + datetime.timedelta(microseconds=1)),
+        ):
+            db.session.add(CallTableModel(
+                call_id=call_id, call_direction=1, dialed_party_number=did,
+                start_time=call_start, end_time=call_end
+            ))
+            db.session.add(EventTableModel(
+                event_id=call_id * 10, event_type=TALKING, call_id=call_id,
+                start_time=call_start + datetime.timedelta(seconds=30), end_time=call_end
+            ))
+        db.session.commit()
+        self.interval = (start_time, end_time)
+
+    def test_numpy_engine_matches_orm_engine(self):
+        orm_rows = _orm_sla_rows(*self.interval)
+        self.assertIn('None', orm_rows)
+        self.assertEqual(_numpy_sla_rows(*self.interval), orm_rows)
+
+    def test_did_filter_includes_null_dids(self):
+        for dids in (['None'], ['7559'], ['7559', 'None']):
+            self.assertEqual(
+                _numpy_sla_rows(*self.interval, dids=dids),
+                _orm_sla_rows(*self.interval, dids=dids)
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
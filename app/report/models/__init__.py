@@ -3,5 +3,10 @@ from .tables_loaded import TablesLoadedModel
 from .call_table_model import CallTableModel
 from .event_table_model import EventTableModel
 from .client_model import ClientModel
+from .client_directory import ClientDirectory
 from .summary_sla_report_model import SummarySLAReportModel
 from .client_manager import ClientManager, client_user_association
+from .sla_cube_model import SlaCubeModel
+from .call_summary_model import CallSummaryModel
+from .sync_watermark_model import SyncWatermarkModel
+from .archived_month_model import ArchivedMonthModel
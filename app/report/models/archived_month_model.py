@@ -0,0 +1,55 @@
+# report/models.py
+import datetime
+from sqlalchemy.sql import and_
+
+from app.extensions import db
+
+
+class ArchivedMonthModel(db.Model):
+    """
+    One part of a closed month of calls and events moved from the hot
+    tables to Parquet files. Calls are archived by start time and events
+    with the call they belong to. Rows loaded into an archived month
+    later are archived as a further part, never over an earlier one.
+    """
+    __tablename__ = 'archived_month'
+    __repr_attrs__ = ['month', 'part', 'calls_archived', 'events_archived', 'archived_on']
+    __table_args__ = (
+        db.UniqueConstraint('month', 'part', name='uq_archived_month_part'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # First day of the month
+    month = db.Column(db.Date, nullable=False)
+    part = db.Column(db.Integer, nullable=False, default=1)
+    calls_path = db.Column(db.String, nullable=False)
+    events_path = db.Column(db.String, nullable=False)
+    calls_archived = db.Column(db.Integer, default=0)
+    events_archived = db.Column(db.Integer, default=0)
+    archived_on = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    @classmethod
+    def find(cls, month):
+        """
+        The archived parts of the month, in the order they were archived.
+        """
+        return cls.query.filter(cls.month == month).order_by(cls.part).all()
+
+    @classmethod
+    def is_archived(cls, date):
+        return cls.query.filter(
+            cls.month == datetime.date(date.year, date.month, 1)
+        ).first() is not None
+
+    @classmethod
+    def overlapping(cls, start_time, end_time):
+        """
+        Archived parts holding calls that start in [start_time, end_time].
+        """
+        first_month = datetime.date(start_time.year, start_time.month, 1)
+        return cls.query.filter(
+            and_(
+                cls.month >= first_month,
+                cls.month <= end_time.date()
+            )
+        ).order_by(cls.month, cls.part).all()
@@ -0,0 +1,40 @@
+# report/models.py
+from sqlalchemy.sql import and_
+
+from app.extensions import db
+
+
+class CallSummaryModel(db.Model):
+    """
+    One narrow row per inbound call with its event lengths rolled up by
+    type when the day is loaded. Durations are in whole seconds.
+    """
+    __tablename__ = 'c_call_summary'
+    __repr_attrs__ = ['call_id', 'dialed_party_number', 'start_time', 'wait_duration']
+    __table_args__ = (
+        db.Index('ix_c_call_summary_start_time', 'start_time'),
+    )
+
+    call_id = db.Column(db.Integer, primary_key=True)
+    dialed_party_number = db.Column(db.String)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+
+    length = db.Column(db.Integer, default=0)
+    # Event type 4
+    talking_time = db.Column(db.Integer, default=0)
+    # Event types 5, 6 and 7
+    hold_time = db.Column(db.Integer, default=0)
+    # Event type 10
+    voicemail_time = db.Column(db.Integer, default=0)
+    # length - talking_time - hold_time
+    wait_duration = db.Column(db.Integer, default=0)
+
+    @classmethod
+    def clear(cls, start_time, end_time):
+        return cls.query.filter(
+            and_(
+                cls.start_time >= start_time,
+                cls.start_time < end_time
+            )
+        ).delete(synchronize_session=False)
@@ -9,6 +9,12 @@ class CallTableModel(db.Model):
     __tablename__ = 'c_call'
     __repr_attrs__ = ['call_id', 'calling_party_number', 'dialed_party_number',
                       'start_time', 'end_time', 'caller_id']
+    __table_args__ = (
+        # Report builders: inbound calls by start and end time
+        db.Index('ix_c_call_direction_start_end', 'call_direction', 'start_time', 'end_time'),
+        # Loaders: calls by start day
+        db.Index('ix_c_call_start_time', 'start_time'),
+    )
 
     call_id = db.Column(db.Integer, primary_key=True)
     call_direction = db.Column(db.Integer)
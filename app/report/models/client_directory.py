@@ -0,0 +1,94 @@
+#
+import datetime
+import threading
+
+from sqlalchemy import event
+
+from app.extensions import db
+from .client_model import ClientModel
+
+
+class ClientDirectory(object):
+    """
+    Process wide snapshot of the clients, loaded with one query. Writes
+    made by this process invalidate it right away; writes made by other
+    workers are picked up once the snapshot is older than CHECK_AFTER and
+    ClientModel.version() has moved on.
+    """
+
+    CHECK_AFTER = datetime.timedelta(seconds=30)
+
+    _lock = threading.Lock()
+    _snapshot = None
+
+    @classmethod
+    def _load(cls):
+        version = ClientModel.version()
+        columns = [column.name for column in ClientModel.__table__.columns]
+        records = [
+            dict(zip(columns, row)) for row in db.session.query(
+                *[getattr(ClientModel, name) for name in columns]
+            ).order_by(ClientModel.id)
+        ]
+        names = {}
+        for record in records:
+            # The first client with an extension names its row
+            names.setdefault(str(record['ext']), record['name'])
+        return {
+            'version': version,
+            'checked': datetime.datetime.utcnow(),
+            'records': records,
+            'names': names,
+        }
+
+    @classmethod
+    def snapshot(cls):
+        with cls._lock:
+            snapshot = cls._snapshot
+            now = datetime.datetime.utcnow()
+            if snapshot is not None and snapshot['checked'] + cls.CHECK_AFTER < now:
+                if ClientModel.version() == snapshot['version']:
+                    snapshot['checked'] = now
+                else:
+                    snapshot = None
+            if snapshot is None:
+                snapshot = cls._snapshot = cls._load()
+            return snapshot
+
+    @classmethod
+    def version(cls):
+        return cls.snapshot()['version']
+
+    @classmethod
+    def names(cls):
+        """
+        Client name by extension: {'7559': 'Client name', ...}
+        """
+        return cls.snapshot()['names']
+
+    @classmethod
+    def name(cls, row_name, default=None):
+        return cls.names().get(str(row_name), default)
+
+    @classmethod
+    def clients(cls, active=None):
+        """
+        Column values of every client, or of the active or inactive ones.
+        """
+        records = cls.snapshot()['records']
+        if active is None:
+            return list(records)
+        return [record for record in records if bool(record['active']) == active]
+
+    @classmethod
+    def invalidate(cls):
+        with cls._lock:
+            cls._snapshot = None
+
+
+def _invalidate_directory(mapper, connection, target):
+    ClientDirectory.invalidate()
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(ClientModel, _event_name, _invalidate_directory)
@@ -1,4 +1,7 @@
 # client/models.py
+import datetime
+from sqlalchemy.sql import func
+
 from app.extensions import db
 
 
@@ -14,5 +17,18 @@ class ClientModel(db.Model):
 
     notes = db.Column(db.Text)
 
+    last_updated = db.Column(
+        db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow
+    )
+
+    @classmethod
+    def version(cls):
+        """
+        Changes whenever a client is added, edited or removed:
+        (number of clients, latest last_updated).
+        """
+        count, latest = db.session.query(func.count(cls.id), func.max(cls.last_updated)).one()
+        return count, latest
+
     def __str__(self):
         return self.name
@@ -10,6 +10,12 @@ class EventTableModel(db.Model):
     __tablename__ = 'c_event'
     __repr_attrs__ = ['event_id', 'event_type', 'calling_party', 'receiving_party',
                       'is_conference', 'start_time', 'end_time', 'call_id']
+    __table_args__ = (
+        # Report builders: events of each call
+        db.Index('ix_c_event_call_id', 'call_id'),
+        # Loaders: events by start day
+        db.Index('ix_c_event_start_time', 'start_time'),
+    )
 
     event_id = db.Column(db.Integer, primary_key=True)
     event_type = db.Column(db.Integer, nullable=False)
@@ -0,0 +1,63 @@
+# report/models.py
+import datetime
+from sqlalchemy.sql import and_
+
+from app.extensions import db
+
+
+class SlaCubeModel(db.Model):
+    """
+    Additive SLA counters per DID per fixed-size bucket of call start
+    times. Any bucket-aligned interval can be answered by summing rows.
+    """
+    __tablename__ = 'sla_cube'
+    __repr_attrs__ = ['dialed_party_number', 'bucket_start', 'presented']
+    __table_args__ = (
+        db.Index('ix_sla_cube_bucket_did', 'bucket_start', 'dialed_party_number', unique=True),
+    )
+
+    BUCKET = datetime.timedelta(minutes=15)
+
+    id = db.Column(db.Integer, primary_key=True)
+    dialed_party_number = db.Column(db.String)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+
+    # Counters in aggregates.HEADERS order, durations in seconds
+    presented = db.Column(db.Integer, default=0)
+    live_answered = db.Column(db.Integer, default=0)
+    lost = db.Column(db.Integer, default=0)
+    voice_mails = db.Column(db.Integer, default=0)
+    answered_duration = db.Column(db.BigInteger, default=0)
+    answered_wait = db.Column(db.BigInteger, default=0)
+    lost_wait = db.Column(db.BigInteger, default=0)
+    ans_within_15 = db.Column(db.Integer, default=0)
+    ans_within_30 = db.Column(db.Integer, default=0)
+    ans_within_45 = db.Column(db.Integer, default=0)
+    ans_within_60 = db.Column(db.Integer, default=0)
+    ans_within_999 = db.Column(db.Integer, default=0)
+    ans_over_999 = db.Column(db.Integer, default=0)
+    longest_wait = db.Column(db.BigInteger, default=0)
+
+    @classmethod
+    def counter_columns(cls):
+        return [
+            cls.presented, cls.live_answered, cls.lost, cls.voice_mails,
+            cls.answered_duration, cls.answered_wait, cls.lost_wait,
+            cls.ans_within_15, cls.ans_within_30, cls.ans_within_45,
+            cls.ans_within_60, cls.ans_within_999, cls.ans_over_999,
+            cls.longest_wait
+        ]
+
+    @classmethod
+    def is_aligned(cls, time):
+        midnight = datetime.datetime.combine(time.date(), datetime.time())
+        return (time - midnight) % cls.BUCKET == datetime.timedelta(0)
+
+    @classmethod
+    def clear(cls, start_time, end_time):
+        return cls.query.filter(
+            and_(
+                cls.bucket_start >= start_time,
+                cls.bucket_start < end_time
+            )
+        ).delete(synchronize_session=False)
@@ -1,6 +1,7 @@
 # report/models.py
 import datetime
-from sqlalchemy.sql import and_
+from sqlalchemy.orm import defer, undefer
+from sqlalchemy.sql import and_, or_
 
 from app.encoders import json_type
 from app.extensions import db
@@ -8,16 +9,32 @@ from app.extensions import db
 
 class SlaReportModel(db.Model):
     __tablename__ = 'sla_report'
-    __repr_attrs__ = ['id', 'start_time', 'end_time', 'completed_on']
+    __repr_attrs__ = ['id', 'start_time', 'end_time', 'status', 'completed_on']
 
     id = db.Column(db.Integer, primary_key=True)
     start_time = db.Column(db.DateTime, nullable=False)
     end_time = db.Column(db.DateTime, nullable=False)
     data = db.Column(json_type)
+    # Per DID wait histograms: {did: {'answered': {bin: count}, 'lost': {...}}}
+    histograms = db.Column(json_type)
+    # Per DID quantile sketches: {did: {'answered_wait': ..., 'lost_wait': ..., 'talk': ...}}
+    sketches = db.Column(json_type)
+    # Set when some rows of the data have no stored distributions, as
+    # when the cube answered them; their wait metrics are unavailable
+    distributions_partial = db.Column(db.Boolean, default=False)
+    # Set when late data changes the rows of dirty_dids after completion
+    dirty = db.Column(db.Boolean, default=False)
+    dirty_dids = db.Column(json_type)
 
     date_requested = db.Column(db.DateTime, default=datetime.datetime.now())
     last_updated = db.Column(db.DateTime)
     completed_on = db.Column(db.DateTime)
+    # None while the build is pending, then 'complete', 'empty' when the
+    # interval has no calls, or 'failed'. Failed builds are requeued after
+    # a delay until they failed max_attempts times, or when a day loads.
+    status = db.Column(db.String)
+    # Builds that failed since the report was requested or last reset
+    attempts = db.Column(db.Integer, default=0)
 
     @classmethod
     def headers(cls):
@@ -51,6 +68,123 @@ class SlaReportModel(db.Model):
             )
         ).first()
 
+    @classmethod
+    def in_range(cls, start_time, end_time, distributions=False):
+        """
+        The reports inside the interval by start time. Their histograms
+        and sketches are only read with distributions, or when first used.
+        """
+        query = cls.query.filter(
+            and_(
+                cls.start_time >= start_time,
+                cls.end_time <= end_time
+            )
+        ).order_by(cls.start_time)
+        if not distributions:
+            query = query.options(defer(cls.histograms), defer(cls.sketches))
+        return query
+
+    @classmethod
+    def load_distributions(cls, reports):
+        """
+        Read the histograms and sketches deferred by in_range for the
+        reports with one query instead of one per report.
+        """
+        ids = [report.id for report in reports]
+        if ids:
+            cls.query.filter(cls.id.in_(ids)).options(
+                undefer(cls.histograms), undefer(cls.sketches)
+            ).all()
+        return reports
+
+    def build_due(self, now, claim_period, retry_after, max_attempts):
+        """
+        True if the report's build should be queued: it is not finished
+        and not claimed within claim_period, or its build failed more than
+        retry_after ago with attempts left.
+        """
+        if self.completed_on is not None:
+            return False
+        if self.status == 'failed':
+            return (self.attempts or 0) < max_attempts and (
+                self.last_updated is None or self.last_updated + retry_after < now
+            )
+        return self.last_updated is None or self.last_updated + claim_period < now
+
+    @classmethod
+    def due(cls, now, claim_period, retry_after, max_attempts):
+        """
+        Query of the reports whose build_due is True.
+        """
+        return cls.query.filter(
+            cls.completed_on.is_(None),
+            or_(
+                and_(
+                    or_(cls.status.is_(None), cls.status != 'failed'),
+                    or_(cls.last_updated.is_(None), cls.last_updated < now - claim_period)
+                ),
+                and_(
+                    cls.status == 'failed',
+                    or_(cls.attempts.is_(None), cls.attempts < max_attempts),
+                    or_(cls.last_updated.is_(None), cls.last_updated < now - retry_after)
+                )
+            )
+        )
+
+    @classmethod
+    def mark_dirty(cls, start_time, end_time, dids):
+        """
+        Flag the finished reports overlapping the interval as needing the
+        rows of the given DIDs rebuilt.
+        """
+        reports = cls.query.filter(
+            and_(
+                cls.start_time < end_time,
+                cls.end_time > start_time,
+                cls.completed_on.isnot(None)
+            )
+        ).all()
+        for report in reports:
+            report.update(
+                dirty=True,
+                dirty_dids=sorted(set(report.dirty_dids or []) | set(dids))
+            )
+        return len(reports)
+
+    @classmethod
+    def reset_empty(cls, start_time, end_time):
+        """
+        Requeue the reports overlapping the interval that finished empty,
+        e.g. because they were built before its data was first loaded.
+        """
+        reports = cls.query.filter(
+            and_(
+                cls.start_time < end_time,
+                cls.end_time > start_time,
+                cls.status == 'empty'
+            )
+        ).all()
+        for report in reports:
+            report.update(status=None, completed_on=None)
+        return len(reports)
+
+    @classmethod
+    def reset_failed(cls, start_time, end_time):
+        """
+        Requeue the reports overlapping the interval whose builds failed,
+        with their attempts restarted, as data for it has loaded.
+        """
+        reports = cls.query.filter(
+            and_(
+                cls.start_time < end_time,
+                cls.end_time > start_time,
+                cls.status == 'failed'
+            )
+        ).all()
+        for report in reports:
+            report.update(status=None, attempts=0, last_updated=None)
+        return len(reports)
+
     @classmethod
     def exists(cls, start_time, end_time):
         return cls.get(start_time, end_time) is not None
@@ -0,0 +1,92 @@
+# report/models/sla_report_model_test.py
+import datetime
+import unittest
+
+from sqlalchemy import inspect
+
+from ..builders import covering_reports
+from ..testing import ReportTestCase
+from .sla_report_model import SlaReportModel
+
+DAY_START = datetime.datetime(2018, 7, 2)
+NOW = datetime.datetime(2018, 7, 3, 12)
+CLAIM_PERIOD = datetime.timedelta(minutes=2)
+RETRY_AFTER = datetime.timedelta(minutes=10)
+
+
+class ReportRetryTest(ReportTestCase):
+
+    def add_report(self, hour, **columns):
+        return SlaReportModel.create(
+            start_time=DAY_START + datetime.timedelta(hours=hour),
+            end_time=DAY_START + datetime.timedelta(hours=hour + 1),
+            **columns
+        )
+
+    def due_hours(self, max_attempts=3):
+        due = SlaReportModel.due(NOW, CLAIM_PERIOD, RETRY_AFTER, max_attempts).all()
+        for report in SlaReportModel.query.all():
+            self.assertEqual(
+                report.build_due(NOW, CLAIM_PERIOD, RETRY_AFTER, max_attempts), report in due
+            )
+        return sorted(report.start_time.hour for report in due)
+
+    def test_failed_builds_are_retried_after_a_delay_until_attempts_run_out(self):
+        self.add_report(0)
+        self.add_report(1, last_updated=NOW - datetime.timedelta(minutes=1))
+        self.add_report(2, status='failed', attempts=1, last_updated=NOW - RETRY_AFTER * 2)
+        self.add_report(3, status='failed', attempts=1, last_updated=NOW - CLAIM_PERIOD * 2)
+        self.add_report(4, status='failed', attempts=3, last_updated=NOW - RETRY_AFTER * 2)
+        self.add_report(5, status='complete', completed_on=NOW)
+        SlaReportModel.session.commit()
+
+        self.assertEqual(self.due_hours(), [0, 2])
+        self.assertEqual(self.due_hours(max_attempts=4), [0, 2, 4])
+
+    def test_loading_a_day_resets_its_failed_reports(self):
+        self.add_report(2, status='failed', attempts=3, last_updated=NOW)
+        self.add_report(30, status='failed', attempts=3, last_updated=NOW)
+        SlaReportModel.session.commit()
+
+        self.assertEqual(
+            SlaReportModel.reset_failed(DAY_START, DAY_START + datetime.timedelta(days=1)), 1
+        )
+        SlaReportModel.session.commit()
+        self.assertEqual(self.due_hours(), [2])
+
+
+class ReportRangeTest(ReportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for hour in range(3):
+            SlaReportModel.create(
+                start_time=DAY_START + datetime.timedelta(hours=hour),
+                end_time=DAY_START + datetime.timedelta(hours=hour + 1),
+                data={}, histograms={'7559': {}}, sketches={'7559': {}}, completed_on=NOW
+            )
+        SlaReportModel.session.commit()
+        SlaReportModel.session.expunge_all()
+
+    def unloaded(self, report):
+        return {'histograms', 'sketches'} & inspect(report).unloaded
+
+    def test_range_lookup_defers_distributions(self):
+        end_time = DAY_START + datetime.timedelta(hours=3)
+        for report in SlaReportModel.in_range(DAY_START, end_time):
+            self.assertEqual(self.unloaded(report), {'histograms', 'sketches'})
+        SlaReportModel.session.expunge_all()
+        for report in SlaReportModel.in_range(DAY_START, end_time, distributions=True):
+            self.assertEqual(self.unloaded(report), set())
+
+    def test_covering_reports_read_distributions_of_taken_reports(self):
+        reports, covered = covering_reports(DAY_START, DAY_START + datetime.timedelta(hours=2))
+        self.assertTrue(covered)
+        self.assertEqual(len(reports), 2)
+        for report in reports:
+            self.assertEqual(self.unloaded(report), set())
+            self.assertEqual(report.histograms, {'7559': {}})
+
+
+if __name__ == '__main__':
+    unittest.main()
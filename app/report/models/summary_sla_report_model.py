@@ -16,6 +16,13 @@ class SummarySLAReportModel(db.Model):
     end_time = db.Column(db.DateTime, nullable=False)
     frequency = db.Column(db.Integer, default=86400)
     data = db.Column(json_type)
+    histograms = db.Column(json_type)
+    sketches = db.Column(json_type)
+    # Set when some sub-interval had no stored distributions to merge
+    distributions_partial = db.Column(db.Boolean, default=False)
+    # Set when late data changes the rows of dirty_dids after completion
+    dirty = db.Column(db.Boolean, default=False)
+    dirty_dids = db.Column(json_type)
 
     date_requested = db.Column(db.DateTime, default=datetime.datetime.now())
     last_updated = db.Column(db.DateTime)
@@ -43,6 +50,26 @@ class SummarySLAReportModel(db.Model):
             )
         ).first()
 
+    @classmethod
+    def mark_dirty(cls, start_time, end_time, dids):
+        """
+        Flag the finished summaries overlapping the interval as needing
+        the rows of the given DIDs rebuilt.
+        """
+        reports = cls.query.filter(
+            and_(
+                cls.start_time < end_time,
+                cls.end_time > start_time,
+                cls.completed_on.isnot(None)
+            )
+        ).all()
+        for report in reports:
+            report.update(
+                dirty=True,
+                dirty_dids=sorted(set(report.dirty_dids or []) | set(dids))
+            )
+        return len(reports)
+
     @classmethod
     def exists(cls, start_time, end_time, interval):
         return cls.get(start_time, end_time, interval) is not None
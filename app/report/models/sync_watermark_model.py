@@ -0,0 +1,77 @@
+# report/models.py
+import datetime
+from sqlalchemy.sql import func, or_
+
+from app.extensions import db
+from .tables_loaded import TablesLoadedModel
+
+
+class SyncWatermarkModel(db.Model):
+    """
+    Highest primary key of a local table pulled in by the incremental
+    sync; the next sync only asks the external database for newer rows.
+    """
+    __tablename__ = 'sync_watermark'
+    __repr_attrs__ = ['table_name', 'last_key', 'last_updated']
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String, nullable=False, unique=True)
+    last_key = db.Column(db.BigInteger, nullable=False, default=0)
+    # Held by the running sync so overlapping beat ticks skip the table;
+    # expires in case the worker died mid sync
+    claimed_until = db.Column(db.DateTime)
+
+    date_requested = db.Column(db.DateTime, default=datetime.datetime.now())
+    last_updated = db.Column(db.DateTime)
+
+    @classmethod
+    def find(cls, table_name):
+        return cls.query.filter(cls.table_name == table_name).first()
+
+    @classmethod
+    def find_or_start(cls, table, primary_key):
+        """
+        Watermark of the table, started at the highest key of the loaded
+        days so the first sync does not pull the whole history. None
+        while no day is loaded, as the day loads come first.
+        """
+        watermark = cls.find(table.__tablename__)
+        if watermark is None:
+            last_day = TablesLoadedModel.query.with_entities(
+                func.max(TablesLoadedModel.loaded_date)
+            ).filter(TablesLoadedModel.complete).scalar()
+            if last_day is None:
+                return None
+            day_end = datetime.datetime.combine(
+                last_day + datetime.timedelta(days=1), datetime.time()
+            )
+            last_key = cls.session.query(func.max(primary_key)).filter(
+                table.__table__.c.start_time < day_end
+            ).scalar()
+            watermark = cls.create(
+                table_name=table.__tablename__,
+                last_key=last_key or 0,
+                last_updated=datetime.datetime.utcnow()
+            )
+            cls.session.commit()
+        return watermark
+
+    def claim(self, period):
+        """
+        Claim the table for one sync unless another sync holds an
+        unexpired claim. The holder extends it as it commits chunks.
+        Commits.
+        """
+        now = datetime.datetime.utcnow()
+        cls = self.__class__
+        claimed = cls.query.filter(
+            cls.id == self.id,
+            or_(cls.claimed_until.is_(None), cls.claimed_until < now)
+        ).update({'claimed_until': now + period}, synchronize_session=False)
+        self.session.commit()
+        self.session.refresh(self)
+        return bool(claimed)
+
+    def release(self):
+        self.update(claimed_until=None)
+        self.session.commit()
@@ -1,60 +1,223 @@
 #
 import datetime
+import threading
+from collections import namedtuple
 
+from sqlalchemy import event
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.sql import func
+from sqlalchemy.sql import and_, func
 
 from app.extensions import db
 
 
+# Days of a range by load state, each list in date order
+Coverage = namedtuple('Coverage', ['loaded', 'partial', 'missing'])
+
+
 class TablesLoadedModel(db.Model):
 
     __tablename__ = 'loaded_tables'
     __repr_attrs__ = ['loaded_date', 'last_updated', 'complete']
 
+    # Range scans are cached in process. Writes made by this process
+    # invalidate them right away; writes made by other workers are picked
+    # up once the cache is older than COVERAGE_CHECK_AFTER and version()
+    # has moved on, so other workers' loads show up within that window.
+    COVERAGE_CHECK_AFTER = datetime.timedelta(seconds=30)
+    _coverage_lock = threading.Lock()
+    _coverage_cache = {}
+    _coverage_version = None
+    _coverage_checked = None
+
     id = db.Column(db.Integer, primary_key=True)
-    loaded_date = db.Column(db.Date, nullable=False)
+    loaded_date = db.Column(db.Date, nullable=False, index=True)
 
     date_requested = db.Column(db.DateTime, default=datetime.datetime.now())
     last_updated = db.Column(db.DateTime)
 
     calls_loaded = db.Column(db.Boolean, default=False)
     events_loaded = db.Column(db.Boolean, default=False)
+    # Last primary key committed by an unfinished streaming load
+    calls_checkpoint = db.Column(db.Integer)
+    events_checkpoint = db.Column(db.Integer)
+    # "count:max id:id sum:end time checksum" of the source at the last load
+    calls_fingerprint = db.Column(db.String)
+    events_fingerprint = db.Column(db.String)
+    summary_loaded = db.Column(db.Boolean, default=False)
+    cube_loaded = db.Column(db.Boolean, default=False)
+    # Set on every write; last_updated is the loaders' claim time
+    last_changed = db.Column(
+        db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow
+    )
 
     @hybrid_property
     def complete(self):
-        return self.is_loaded(self.loaded_date)
+        return bool(self.calls_loaded and self.events_loaded)
+
+    @complete.expression
+    def complete(cls):
+        return and_(cls.calls_loaded.is_(True), cls.events_loaded.is_(True))
 
     @classmethod
     def find(cls, date):
         return cls.query.filter(
-            cls.loaded_date == func.DATE(date)
+            cls.loaded_date == _as_date(date)
         ).first()
 
+    @classmethod
+    def version(cls):
+        """
+        Changes whenever a load record is added, changed or removed:
+        (number of records, latest last_changed).
+        """
+        count, latest = db.session.query(func.count(cls.id), func.max(cls.last_changed)).one()
+        return count, latest
+
     @classmethod
     def is_loaded(cls, date):
         record = cls.find(date)
         return record and record.calls_loaded and record.events_loaded
 
+    @classmethod
+    def day_flags(cls, start_time, end_time):
+        """
+        Load flags of every recorded day touched by [start_time, end_time)
+        from one range scan over loaded_date:
+        {date: {'calls_loaded': ..., 'events_loaded': ..., ...}}
+        """
+        first_day, last_day = _day_range(start_time, end_time)
+        key = (first_day, last_day)
+        cls._check_coverage_version()
+        with cls._coverage_lock:
+            cached = cls._coverage_cache.get(key)
+        if cached is not None:
+            return cached
+
+        flag_names = ('calls_loaded', 'events_loaded', 'summary_loaded', 'cube_loaded')
+        rows = db.session.query(
+            cls.loaded_date, *[getattr(cls, name) for name in flag_names]
+        ).filter(
+            and_(
+                cls.loaded_date >= first_day,
+                cls.loaded_date <= last_day
+            )
+        ).all()
+        flags = {}
+        for loaded_date, *values in rows:
+            day_flags = flags.setdefault(loaded_date, dict.fromkeys(flag_names, False))
+            # Duplicate records count as loaded if any of them is
+            for name, value in zip(flag_names, values):
+                day_flags[name] = day_flags[name] or bool(value)
+
+        with cls._coverage_lock:
+            if len(cls._coverage_cache) > 256:
+                cls._coverage_cache.clear()
+            cls._coverage_cache[key] = flags
+        return flags
+
+    @classmethod
+    def _check_coverage_version(cls):
+        """
+        Drop the cached range scans when version() moved on since the
+        last check, checking at most once per COVERAGE_CHECK_AFTER.
+        """
+        now = datetime.datetime.utcnow()
+        with cls._coverage_lock:
+            checked = cls._coverage_checked
+            if checked is not None and checked + cls.COVERAGE_CHECK_AFTER > now:
+                return
+        version = cls.version()
+        with cls._coverage_lock:
+            if version != cls._coverage_version:
+                cls._coverage_cache.clear()
+                cls._coverage_version = version
+            cls._coverage_checked = now
+
+    @classmethod
+    def coverage(cls, start_time, end_time):
+        """
+        Split the days touched by [start_time, end_time) into loaded,
+        partially loaded and missing days.
+        """
+        flags = cls.day_flags(start_time, end_time)
+        coverage = Coverage([], [], [])
+        for day in _days(start_time, end_time):
+            day_flags = flags.get(day)
+            if day_flags is None:
+                coverage.missing.append(day)
+            elif day_flags['calls_loaded'] and day_flags['events_loaded']:
+                coverage.loaded.append(day)
+            else:
+                coverage.partial.append(day)
+        return coverage
+
+    @classmethod
+    def days_have(cls, start_time, end_time, flag):
+        """
+        True if every day touched by [start_time, end_time) has the flag set.
+        """
+        flags = cls.day_flags(start_time, end_time)
+        return all(
+            flags.get(day, {}).get(flag) for day in _days(start_time, end_time)
+        )
+
+    @classmethod
+    def invalidate_coverage(cls):
+        with cls._coverage_lock:
+            cls._coverage_cache.clear()
+            cls._coverage_checked = None
+
     @classmethod
     def interval_is_loaded(cls, start_time, end_time):
         """
         Return True if the data is loaded for the interval, or False
         if any day is not loaded.
         """
-        while start_time < end_time:
-            if not cls.is_loaded(start_time):
-                return False
-            start_time += datetime.timedelta(days=1)
-        return True
+        coverage = cls.coverage(start_time, end_time)
+        return not (coverage.partial or coverage.missing)
 
     @classmethod
     def not_loaded_when2when(cls, start_time, end_time):
         """
-        Return True if the data is loaded for the interval, or False
-        if any day is not loaded.
+        Yield the days of the interval without a load record.
         """
-        while start_time < end_time:
-            if cls.find(start_time) is None:
-                yield start_time
-            start_time += datetime.timedelta(days=1)
+        for day in cls.coverage(start_time, end_time).missing:
+            yield day
+
+
+def _as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.combine(value, datetime.time())
+
+
+def _day_range(start_time, end_time):
+    """
+    First and last day touched by [start_time, end_time).
+    """
+    start_time, end_time = _as_datetime(start_time), _as_datetime(end_time)
+    last_day = end_time.date()
+    if end_time.time() == datetime.time():
+        last_day -= datetime.timedelta(days=1)
+    return start_time.date(), last_day
+
+
+def _days(start_time, end_time):
+    day, last_day = _day_range(start_time, end_time)
+    while day <= last_day:
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def _invalidate_coverage(mapper, connection, target):
+    TablesLoadedModel.invalidate_coverage()
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(TablesLoadedModel, _event_name, _invalidate_coverage)
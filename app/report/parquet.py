@@ -0,0 +1,25 @@
+# report/parquet.py
+import logging
+
+
+logger = logging.getLogger("app")
+
+
+def import_pyarrow():
+    """
+    pyarrow and pyarrow.parquet, or (None, None) when pyarrow is missing
+    or fails to import against the installed numpy. A failed import
+    leaves pyarrow half initialised in sys.modules, so it is only
+    attempted here, once per process.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except Exception as err:
+        logger.info("Parquet support disabled, pyarrow unavailable: {err}".format(err=err))
+        return None, None
+    return pyarrow, pyarrow.parquet
+
+
+# Optional: the archive tier and Parquet exports need it, nothing else does
+pa, pq = import_pyarrow()
@@ -1,3 +1,5 @@
+import os
+
 REPORT_MODULE_ROUTES = {
     "ReportAPI": {
         "url": "/api/report",
@@ -7,8 +9,75 @@ REPORT_MODULE_ROUTES = {
         "url": "/api/report/sla_report",
         "methods": {}
     },
+    "SLAReportJobAPI": {
+        "url": "/api/report/sla_report/jobs/<int:job_id>",
+        "methods": {}
+    },
     "SLAClientAPI":  {
         "url": "/api/report/clients",
         "methods": {}
     },
 }
+
+# Engine used to aggregate SLA reports from raw call data:
+# 'orm' walks each call and its events, 'sql' aggregates in the database,
+# 'numpy' classifies the per-call totals with the vectorized kernel,
+# 'stream' folds calls and events into the report in fixed-size chunks,
+# 'rollup' classifies the per-call summaries written at load time,
+# 'cube' sums the 15 minute SLA cube for bucket aligned intervals,
+# 'parallel' aggregates time slices of the interval in a thread or process pool
+SLA_REPORT_ENGINE = os.getenv("SLA_REPORT_ENGINE", "orm")
+
+# Rows fetched per round trip by the 'stream' engine
+SLA_STREAM_CHUNK_SIZE = int(os.getenv("SLA_STREAM_CHUNK_SIZE", 5000))
+
+# Workers used by the 'parallel' engine, defaults to one per core
+SLA_PARALLEL_WORKERS = int(os.getenv("SLA_PARALLEL_WORKERS", 0)) or None
+SLA_PARALLEL_SLICES_PER_WORKER = int(os.getenv("SLA_PARALLEL_SLICES_PER_WORKER", 4))
+# 'thread' or 'process' pool for the 'parallel' engine; processes need a
+# non-daemonic caller, e.g. not a Celery prefork worker
+SLA_PARALLEL_EXECUTOR = os.getenv("SLA_PARALLEL_EXECUTOR", "thread")
+
+# Failed SLA report builds are requeued after REPORT_RETRY_AFTER seconds
+# until REPORT_MAX_ATTEMPTS builds failed; loading their days resets them
+REPORT_RETRY_AFTER = int(os.getenv("REPORT_RETRY_AFTER", 600))
+REPORT_MAX_ATTEMPTS = int(os.getenv("REPORT_MAX_ATTEMPTS", 3))
+
+# data_loader writes each day's records with batched INSERT ... ON CONFLICT
+# DO NOTHING / INSERT OR IGNORE statements instead of one ORM create per
+# record; set to 0 to go through the ORM and its listeners
+LOADER_BULK_INSERT = bool(int(os.getenv("LOADER_BULK_INSERT", 1)))
+LOADER_BATCH_SIZE = int(os.getenv("LOADER_BATCH_SIZE", 5000))
+
+# Rows read from the external database and committed per chunk
+LOADER_CHUNK_SIZE = int(os.getenv("LOADER_CHUNK_SIZE", 5000))
+
+# Dates loaded concurrently by data_loader, and the most connections the
+# pooled engine opens to the external database
+LOADER_WORKERS = int(os.getenv("LOADER_WORKERS", 4))
+LOADER_SOURCE_CONNECTIONS = int(os.getenv("LOADER_SOURCE_CONNECTIONS", 4))
+
+# Pull calls and events newer than the last synced primary keys on every
+# beat tick, so intraday reports can be refreshed without full day reads
+LOADER_INCREMENTAL_SYNC = bool(int(os.getenv("LOADER_INCREMENTAL_SYNC", 0)))
+
+# Directory polled by file_loader for c_call / c_event CSV or Parquet
+# exports (Parquet needs pyarrow, an optional install); unset to disable
+# file loads
+LOADER_DROP_DIRECTORY = os.getenv("LOADER_DROP_DIRECTORY")
+
+# Closed months of raw calls and events older than ARCHIVE_AFTER_MONTHS
+# move to Parquet files here (needs pyarrow, an optional install) and are
+# read back for reports that reach them; unset to keep all raw data in the
+# database
+ARCHIVE_DIRECTORY = os.getenv("ARCHIVE_DIRECTORY")
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", 3))
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "snappy")
+
+# Formatted SLA report responses kept per process, and optionally shared
+# between workers through a directory; unset for the in-process tier only
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 128))
+RESPONSE_CACHE_DIRECTORY = os.getenv("RESPONSE_CACHE_DIRECTORY")
+# Seconds a shared entry stays valid, and the most entries kept on disk
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 3600))
+RESPONSE_CACHE_FILES = int(os.getenv("RESPONSE_CACHE_FILES", 1024))
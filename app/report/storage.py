@@ -0,0 +1,300 @@
+# report/storage.py
+import logging
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import inspect
+from sqlalchemy.sql import func, select, text
+
+from app.extensions import db
+from .builders import call_totals_query
+from .models import (
+    CallTableModel, EventTableModel, CallSummaryModel, TablesLoadedModel,
+    SlaReportModel, SummarySLAReportModel, ClientModel
+)
+
+
+logger = logging.getLogger("app")
+
+# Tables whose declared indexes are created on existing databases
+INDEXED_TABLES = (CallTableModel, EventTableModel, CallSummaryModel, TablesLoadedModel)
+
+# Tables that existed before columns were added to their models
+ALTERED_TABLES = (TablesLoadedModel, SlaReportModel, SummarySLAReportModel, ClientModel)
+
+# Raw data tables that may be range partitioned by month on PostgreSQL
+PARTITIONED_TABLES = (CallTableModel, EventTableModel)
+
+
+def ensure_columns(engine=None):
+    """
+    Add the declared columns that are missing from existing tables;
+    create_all only creates whole tables. Added columns are nullable,
+    so existing rows read them as NULL.
+    """
+    engine = engine or db.engine
+    inspector = inspect(engine)
+    table_names = set(inspector.get_table_names())
+    quote = engine.dialect.identifier_preparer.quote
+    added = []
+    for model in ALTERED_TABLES:
+        table = model.__table__
+        if table.name not in table_names:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            logger.info("Adding column {column} to {table}".format(
+                column=column.name, table=table.name
+            ))
+            with engine.begin() as connection:
+                connection.execute('ALTER TABLE {table} ADD COLUMN {column} {type}'.format(
+                    table=quote(table.name),
+                    column=quote(column.name),
+                    type=column.type.compile(dialect=engine.dialect)
+                ))
+            added.append((table.name, column.name))
+    return added
+
+
+def ensure_indexes(engine=None):
+    """
+    Create the declared indexes that are missing from existing tables;
+    create_all only adds indexes along with new tables.
+    """
+    engine = engine or db.engine
+    inspector = inspect(engine)
+    table_names = set(inspector.get_table_names())
+    created = []
+    for model in INDEXED_TABLES:
+        table = model.__table__
+        if table.name not in table_names:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                logger.info("Creating index {index} on {table}".format(
+                    index=index.name, table=table.name
+                ))
+                index.create(bind=engine)
+                created.append(index.name)
+    return created
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def next_month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def is_partitioned(connection, table_name):
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(
+        text(
+            "SELECT 1 FROM pg_partitioned_table pt "
+            "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = :name"
+        ),
+        name=table_name
+    ).first() is not None
+
+
+def _create_month(connection, table_name, month, parent=None):
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS "{table}_{month:%Y_%m}" PARTITION OF "{parent}" '
+        "FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')".format(
+            table=table_name, parent=parent or table_name, month=month, end=next_month(month)
+        )
+    )
+
+
+def ensure_monthly_partitions(start_date, end_date, engine=None):
+    """
+    Create the monthly partitions covering the dates for every raw data
+    table that is partitioned. Does nothing on other databases.
+    """
+    engine = engine or db.engine
+    with engine.begin() as connection:
+        for model in PARTITIONED_TABLES:
+            table_name = model.__tablename__
+            if not is_partitioned(connection, table_name):
+                continue
+            month = month_start(start_date)
+            while month <= end_date:
+                _create_month(connection, table_name, month)
+                month = next_month(month)
+
+
+def referencing_foreign_keys(connection, table_name):
+    """
+    (constraint, referencing table) of every foreign key on PostgreSQL
+    that references the table.
+    """
+    return connection.execute(text(
+        "SELECT conname, conrelid::regclass::text FROM pg_constraint "
+        "WHERE contype = 'f' AND confrelid = CAST(:table_name AS regclass)"
+    ), table_name=table_name).fetchall()
+
+
+def serial_sequences(connection, table_name):
+    """
+    (column, sequence) of every column of the table on PostgreSQL whose
+    default draws from a sequence the table owns, e.g. SERIAL keys.
+    """
+    return connection.execute(text(
+        "SELECT attname, pg_get_serial_sequence(:table_name, attname) FROM pg_attribute "
+        "WHERE attrelid = CAST(:table_name AS regclass) AND attnum > 0 "
+        "AND NOT attisdropped AND pg_get_serial_sequence(:table_name, attname) IS NOT NULL"
+    ), table_name=table_name).fetchall()
+
+
+def partition_monthly(model, engine=None, drop_foreign_keys=False):
+    """
+    One-off migration of a raw data table on PostgreSQL 11+ to monthly
+    range partitions on start_time, so date filtered queries skip old
+    months. The primary key becomes (id, start_time) as partitioning
+    requires, so foreign keys referencing the table cannot be kept: the
+    migration refuses while they exist unless drop_foreign_keys is set.
+    Anything else depending on the table makes the migration roll back.
+    Rows outside the created months land in a default partition. The
+    whole swap, including the sequences of SERIAL columns moving to the
+    new table and the declared indexes, runs in one transaction.
+    """
+    engine = engine or db.engine
+    table = model.__table__
+    table_name = table.name
+    primary_key = list(table.primary_key.columns)[0].name
+    if engine.dialect.name != 'postgresql':
+        raise ValueError("Partitioning is only supported on PostgreSQL.")
+
+    with engine.begin() as connection:
+        if is_partitioned(connection, table_name):
+            logger.info("{table} is already partitioned.".format(table=table_name))
+            return False
+
+        foreign_keys = referencing_foreign_keys(connection, table_name)
+        if foreign_keys and not drop_foreign_keys:
+            raise ValueError(
+                "{table} is referenced by the foreign keys {keys}, which a partitioned "
+                "table cannot keep. Drop them first or pass drop_foreign_keys.".format(
+                    table=table_name,
+                    keys=", ".join("{0} on {1}".format(*key) for key in foreign_keys)
+                )
+            )
+        for constraint, referencing in foreign_keys:
+            logger.warning("Dropping foreign key {constraint} on {referencing}.".format(
+                constraint=constraint, referencing=referencing
+            ))
+            connection.execute('ALTER TABLE {referencing} DROP CONSTRAINT "{constraint}"'.format(
+                referencing=referencing, constraint=constraint
+            ))
+
+        first, last = connection.execute(
+            select([func.min(table.c.start_time), func.max(table.c.start_time)])
+        ).first()
+        new_name = table_name + '_partitioned'
+        connection.execute(
+            'CREATE TABLE "{new}" (LIKE "{table}" INCLUDING DEFAULTS) '
+            'PARTITION BY RANGE (start_time)'.format(new=new_name, table=table_name)
+        )
+        connection.execute(
+            'ALTER TABLE "{new}" ADD CONSTRAINT "pk_{table}_start" '
+            'PRIMARY KEY ("{key}", start_time)'.format(
+                new=new_name, table=table_name, key=primary_key
+            )
+        )
+        connection.execute(
+            'CREATE TABLE "{table}_default" PARTITION OF "{new}" DEFAULT'.format(
+                table=table_name, new=new_name
+            )
+        )
+        month = month_start((first or datetime.utcnow()).date())
+        end = (last or datetime.utcnow()).date()
+        while month <= end:
+            _create_month(connection, table_name, month, parent=new_name)
+            month = next_month(month)
+
+        connection.execute('INSERT INTO "{new}" SELECT * FROM "{table}"'.format(
+            new=new_name, table=table_name
+        ))
+        # Sequences owned by the old table would block or go with its drop
+        for column, sequence in serial_sequences(connection, table_name):
+            connection.execute('ALTER SEQUENCE {sequence} OWNED BY "{new}"."{column}"'.format(
+                sequence=sequence, new=new_name, column=column
+            ))
+        connection.execute('DROP TABLE "{table}"'.format(table=table_name))
+        connection.execute('ALTER TABLE "{new}" RENAME TO "{table}"'.format(
+            new=new_name, table=table_name
+        ))
+
+        # The declared indexes went away with the old table
+        for index in table.indexes:
+            index.create(bind=connection)
+
+    logger.info("Partitioned {table} by month.".format(table=table_name))
+    return True
+
+
+def _plan_scans(connection, query):
+    """
+    Names of the raw data tables the database plans to read with a full
+    scan for the query.
+    """
+    compiled = query.compile(dialect=connection.dialect)
+    if compiled.positional:
+        params = [compiled.params[name] for name in compiled.positiontup]
+    else:
+        params = compiled.params
+    raw_tables = {model.__tablename__ for model in PARTITIONED_TABLES}
+
+    if connection.dialect.name == 'postgresql':
+        # Small tables are always cheaper to scan, so ask whether an index
+        # path exists at all
+        connection.execute('SET LOCAL enable_seqscan = off')
+        plan = connection.execute('EXPLAIN (FORMAT JSON) ' + str(compiled), params).scalar()
+        scans, nodes = set(), [plan[0]['Plan']]
+        while nodes:
+            node = nodes.pop()
+            if node.get('Node Type') == 'Seq Scan':
+                relation = node.get('Relation Name', '')
+                scans.update(name for name in raw_tables if relation.startswith(name))
+            nodes.extend(node.get('Plans', []))
+        return scans
+
+    if connection.dialect.name == 'sqlite':
+        scans = set()
+        for row in connection.execute('EXPLAIN QUERY PLAN ' + str(compiled), params):
+            detail = row[-1]
+            words = detail.split()
+            # Automatic indexes are built from a full scan on every query
+            if (words[:1] == ['SCAN'] and 'INDEX' not in words) or 'AUTOMATIC' in words:
+                scans.update(name for name in raw_tables if name in words[1:3])
+        return scans
+
+    return None
+
+
+def check_report_query_plans():
+    """
+    Health check: the report builders' call totals query must reach
+    c_call and c_event through their indexes.
+    """
+    day = datetime.combine(datetime.utcnow().date(), time())
+    query = call_totals_query(day, day + timedelta(days=1), db.engine.dialect.name)
+    with db.engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            scans = _plan_scans(connection, query)
+        finally:
+            transaction.rollback()
+
+    if scans is None:
+        return True, "Report query plans: not checked on {dialect}.".format(
+            dialect=db.engine.dialect.name
+        )
+    if scans:
+        return False, "Report query plans: full scans of {tables}.".format(
+            tables=", ".join(sorted(scans))
+        )
+    return True, "Report query plans: indexed."
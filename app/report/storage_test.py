@@ -0,0 +1,122 @@
+# report/storage_test.py
+import datetime
+import os
+import unittest
+
+from sqlalchemy import create_engine
+
+from app.extensions import db
+from .builders import call_totals_query
+from .models import CallTableModel, EventTableModel
+from .storage import (
+    _plan_scans, check_report_query_plans, ensure_indexes, is_partitioned, partition_monthly
+)
+from .testing import ReportTestCase, seed_calls
+
+DAY = datetime.date(2018, 7, 2)
+DAY_START = datetime.datetime(2018, 7, 2)
+
+
+class ReportQueryPlanTest(ReportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        seed_calls(DAY, 200)
+
+    def plan_scans(self, query):
+        with db.engine.connect() as connection:
+            transaction = connection.begin()
+            try:
+                return _plan_scans(connection, query)
+            finally:
+                transaction.rollback()
+
+    def test_call_totals_use_indexes(self):
+        for dids in (None, ['7559', 'None']):
+            query = call_totals_query(
+                DAY_START, DAY_START + datetime.timedelta(days=1), db.engine.dialect.name,
+                dids=dids
+            )
+            self.assertEqual(self.plan_scans(query), set())
+
+    def test_loader_day_query_uses_indexes(self):
+        query = call_totals_query(
+            DAY_START, None, db.engine.dialect.name,
+            started_before=DAY_START + datetime.timedelta(days=1)
+        )
+        self.assertEqual(self.plan_scans(query), set())
+
+    def test_missing_indexes_are_reported_and_created(self):
+        for model in (CallTableModel, EventTableModel):
+            for index in model.__table__.indexes:
+                index.drop(db.engine)
+        healthy, message = check_report_query_plans()
+        self.assertFalse(healthy, message)
+
+        self.assertTrue(ensure_indexes())
+        healthy, message = check_report_query_plans()
+        self.assertTrue(healthy, message)
+
+    def test_partitioning_needs_postgresql(self):
+        with self.assertRaises(ValueError):
+            partition_monthly(CallTableModel)
+
+
+# Scratch PostgreSQL 11+ database the partitioning tests may drop and
+# create c_call and c_event in; they are skipped when it is unset
+POSTGRES_TEST_URI = os.getenv("REPORT_TEST_POSTGRES_URI")
+
+
+@unittest.skipUnless(POSTGRES_TEST_URI, "REPORT_TEST_POSTGRES_URI is not set")
+class PartitionMonthlyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(POSTGRES_TEST_URI)
+        try:
+            self.engine.connect().close()
+        except Exception as e:
+            self.skipTest("PostgreSQL is unavailable: {error}".format(error=e))
+        self.tables = [CallTableModel.__table__, EventTableModel.__table__]
+        self.drop_tables()
+        db.Model.metadata.create_all(self.engine, tables=self.tables)
+
+        calls = CallTableModel.__table__
+        with self.engine.begin() as connection:
+            connection.execute(calls.insert(), [
+                {'call_direction': 1, 'dialed_party_number': '7559', 'start_time': start_time,
+                 'end_time': start_time + datetime.timedelta(minutes=5)}
+                for start_time in (DAY_START, DAY_START + datetime.timedelta(days=40))
+            ])
+
+    def tearDown(self):
+        self.drop_tables()
+        self.engine.dispose()
+
+    def drop_tables(self):
+        with self.engine.begin() as connection:
+            for table in self.tables:
+                connection.execute('DROP TABLE IF EXISTS "{table}" CASCADE'.format(
+                    table=table.name
+                ))
+
+    def test_serial_keys_keep_counting_after_the_swap(self):
+        calls = CallTableModel.__table__
+        self.assertTrue(partition_monthly(CallTableModel, self.engine, drop_foreign_keys=True))
+        with self.engine.begin() as connection:
+            self.assertTrue(is_partitioned(connection, calls.name))
+            self.assertEqual(connection.execute(calls.count()).scalar(), 2)
+            call_id = connection.execute(calls.insert().values(
+                call_direction=1, start_time=DAY_START, end_time=DAY_START
+            )).inserted_primary_key[0]
+        self.assertEqual(call_id, 3)
+        self.assertFalse(partition_monthly(CallTableModel, self.engine))
+
+    def test_referenced_table_is_left_alone(self):
+        with self.assertRaises(ValueError):
+            partition_monthly(CallTableModel, self.engine)
+        with self.engine.connect() as connection:
+            self.assertFalse(is_partitioned(connection, CallTableModel.__tablename__))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,19 +1,27 @@
 # report/tasks.py
 import logging
+from datetime import datetime, timedelta
 import pandas as pd
 from celery.schedules import crontab
+from flask import current_app
 
 from app.core import save_xls
-from .models import SlaReportModel, SummarySLAReportModel
+from .cache import sla_report_cache
+from .models import SlaReportModel, SummarySLAReportModel, ClientDirectory
 from .utilities import (
     report_loader, make_summary_sla_report,
     # run_reports, email_reports,
-    make_sla_report, add_client_names, compute_avgs,
-    format_df, make_summary,
+    make_sla_report, add_client_names, compute_avgs, format_df, make_summary,
+    sla_report_frame, compute_wait_metrics, compute_duration_quantiles,
 )
+from .builders import covering_reports, merge_distributions
 
 logger = logging.getLogger("app")
 
+# A queued report build is requeued if it has not finished in this time,
+# the same claim period report_loader uses
+REPORT_CLAIM_PERIOD = timedelta(minutes=2)
+
 
 def register_tasks(server_instance):
     server_instance.config['CELERYBEAT_SCHEDULE']['loading_task'] = {
@@ -22,6 +30,36 @@ def register_tasks(server_instance):
             **{server_instance.config['BEAT_PERIOD']: server_instance.config['BEAT_RATE']}
         )
     }
+    server_instance.config['CELERYBEAT_SCHEDULE']['file_loading_task'] = {
+        'task': 'report.utilities.file_loader',
+        'schedule': crontab(
+            **{server_instance.config['BEAT_PERIOD']: server_instance.config['BEAT_RATE']}
+        )
+    }
+    server_instance.config['CELERYBEAT_SCHEDULE']['sync_task'] = {
+        'task': 'report.utilities.incremental_sync',
+        'schedule': crontab(
+            **{server_instance.config['BEAT_PERIOD']: server_instance.config['BEAT_RATE']}
+        )
+    }
+    server_instance.config['CELERYBEAT_SCHEDULE']['rollup_task'] = {
+        'task': 'report.utilities.rollup_loader',
+        'schedule': crontab(
+            **{server_instance.config['BEAT_PERIOD']: server_instance.config['BEAT_RATE']}
+        )
+    }
+    server_instance.config['CELERYBEAT_SCHEDULE']['archive_task'] = {
+        'task': 'report.utilities.archive_loader',
+        'schedule': crontab(
+            **{server_instance.config['BEAT_PERIOD']: server_instance.config['BEAT_RATE']}
+        )
+    }
+    server_instance.config['CELERYBEAT_SCHEDULE']['dirty_report_task'] = {
+        'task': 'report.utilities.dirty_report_loader',
+        'schedule': crontab(
+            **{server_instance.config['BEAT_PERIOD']: server_instance.config['BEAT_RATE']}
+        )
+    }
     server_instance.config['CELERYBEAT_SCHEDULE']['report_task'] = {
         'task': 'report.utilities.report_loader',
         'schedule': crontab(
@@ -69,55 +107,105 @@ def report_task(report_name, start_time=None, end_time=None, clients=None):
         )
 
 
-def get_sla_report(start_time, end_time, clients=()):
-    # Check if report model exists
+def request_sla_report(start_time, end_time):
+    """
+    The report for the interval, queueing its build on the workers when
+    it is not finished and no build was queued recently, or its last
+    build failed long enough ago and has attempts left.
+    """
     report = SlaReportModel.get(start_time, end_time)
-
-    # If the report does not exist make a report.
     if not report:
+        report = SlaReportModel.create(start_time=start_time, end_time=end_time)
+
+    if report.build_due(
+        datetime.utcnow(),
+        claim_period=REPORT_CLAIM_PERIOD,
+        retry_after=timedelta(seconds=current_app.config.get('REPORT_RETRY_AFTER', 600)),
+        max_attempts=current_app.config.get('REPORT_MAX_ATTEMPTS', 3)
+    ):
         logger.info(
-            "Report does not exist for {start} to {end}.\n"
-            "Attempting to make the report.".format(
+            "Queueing report for {start} to {end}.\n".format(
                 start=start_time, end=end_time
             )
         )
-        report_made = make_sla_report(start_time=start_time, end_time=end_time)
-        if not report_made:
-            logger.error(
-                "Report could not be made for {start}"
-                "to {end}.\n".format(
-                    start=start_time, end=end_time
-                )
-            )
-            report = SlaReportModel.set_empty(SlaReportModel())
-        else:
-            report = SlaReportModel.get(start_time, end_time)
+        report.update(status=None, last_updated=datetime.utcnow())
+        SlaReportModel.session.commit()
+        make_sla_report.delay(start_time=start_time, end_time=end_time)
     else:
+        SlaReportModel.session.commit()
+    return report
+
+
+def get_sla_report(start_time, end_time, clients=()):
+    """
+    The formatted report for the interval, or None when it is not
+    finished; its build is then queued on the workers, never run in the
+    request.
+    """
+    report = request_sla_report(start_time, end_time)
+    if report.completed_on is None:
         logger.info(
-            "Report exists for {start} to {end}.\n".format(
+            "Report for {start} to {end} is not finished.\n".format(
                 start=start_time, end=end_time
             )
         )
+        return None
 
-    df = pd.DataFrame.from_dict(report.data, orient='index')
+    # Reuse the formatted frame while neither the report nor the client
+    # names have changed since it was built. Rows follow the order the
+    # clients were requested in, so the key keeps that order.
+    cache_key = (start_time, end_time, tuple(clients or ()))
+    validator = (report.id, report.completed_on, report.last_updated, ClientDirectory.version())
+    cached = sla_report_cache.get(cache_key, validator)
+    if cached is not None:
+        return cached
 
-    # Filter the report to only include desired clients
-    if clients and len(clients) > 0:
-        df = df.filter(items=clients, axis=0)
+    # Rows of the desired clients named after them, the Summary row and
+    # the computed columns, formatted for display
+    df = sla_report_frame(report.data, clients)
+    sla_report_cache.set(cache_key, validator, df)
+    return df
 
-    # Make the visible index the DID extension + client name,
-    # or just DID extension if no name exists
-    df = add_client_names(df)
 
-    if not df.empty:
-        # Create programmatic columns and rows
-        df = make_summary(df)
-        df = compute_avgs(df)
-        # Filter out columns containing raw data
-        df = df[['Client'] + SlaReportModel.headers()]
+def get_sla_wait_metrics(start_time, end_time, clients=(), thresholds=(), percentiles=()):
+    """
+    Wait metrics by DID and whether they are partial, i.e. some rows of
+    the report have no stored histograms and show as unavailable.
+    """
+    report = SlaReportModel.get(start_time, end_time)
+    if not (report and report.completed_on is not None):
+        return {}, True
 
-    # Prettify percentages
-    return df.applymap(format_df)
+    metrics = compute_wait_metrics(
+        report.histograms, thresholds=thresholds, percentiles=percentiles, clients=clients,
+        row_names=report.data or {}
+    )
+    return {
+        row_name: {name: format_df(value) for name, value in row_metrics.items()}
+        for row_name, row_metrics in metrics.items()
+    }, bool(report.distributions_partial)
+
+
+def get_sla_quantiles(start_time, end_time, clients=(), percentiles=(50, 90, 99)):
+    """
+    Duration quantiles by DID and whether they are partial: from the
+    report for the interval, or merged from stored reports that follow
+    each other inside it, partial when those do not cover all of it or
+    some of their rows have no stored sketches.
+    """
+    report = SlaReportModel.get(start_time, end_time)
+    if report and report.completed_on is not None:
+        reports, covered = [report], True
+    else:
+        reports, covered = covering_reports(start_time, end_time)
+
+    quantiles = compute_duration_quantiles(
+        merge_distributions(reports), percentiles=percentiles, clients=clients
+    )
+    return {
+        row_name: {name: format_df(value) for name, value in row_quantiles.items()}
+        for row_name, row_quantiles in quantiles.items()
+    }, not covered or any(report.distributions_partial for report in reports)
 
 
 def get_summary_sla_report(start_time, end_time, clients=()):
@@ -176,12 +264,15 @@ def get_summary_sla_report(start_time, end_time, clients=()):
             ), columns=list(df[col][0].keys()), orient='index'
         )
 
+        # Name the rows after their clients
+        t_df = add_client_names(t_df)
+
         # Create programmatic columns and rows
         t_df = make_summary(t_df)
         t_df = compute_avgs(t_df)
 
         # Filter out columns containing raw data
-        t_df = t_df[SlaReportModel.headers()]
+        t_df = t_df[['Client'] + SlaReportModel.headers()]
 
         # Prettify percentages
         t_df = t_df.applymap(format_df)
@@ -0,0 +1,104 @@
+# report/testing.py
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from app import app_instance, db
+from .builders import build_call_summaries, build_sla_cube
+from .cache import sla_report_cache
+from .models import CallTableModel, EventTableModel, TablesLoadedModel, ClientDirectory
+
+# Event types the report builders add up per call
+TALKING, HOLD_TYPES, VOICEMAIL = 4, (5, 6, 7), 10
+
+
+class ReportTestCase(unittest.TestCase):
+    """
+    Runs each test in an app context bound to its own scratch SQLite
+    database holding every table.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.context = app_instance.app_context()
+        self.context.push()
+
+        db.session.remove()
+        self.database_uri = app_instance.config['SQLALCHEMY_DATABASE_URI']
+        app_instance.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(
+            self.directory, 'report_test.db'
+        )
+        db.create_all()
+
+        # Process wide caches must not carry state between databases
+        TablesLoadedModel.invalidate_coverage()
+        ClientDirectory.invalidate()
+        sla_report_cache.clear()
+
+    def tearDown(self):
+        db.session.remove()
+        app_instance.config['SQLALCHEMY_DATABASE_URI'] = self.database_uri
+        self.context.pop()
+        shutil.rmtree(self.directory)
+
+
+def seed_calls(day, count, seed=1, first_id=1, latest_start=80000):
+    """
+    Add random calls starting on the day with their events: mostly
+    inbound, some without a dialed party number, none crossing midnight
+    unless latest_start allows it. Returns the call ids.
+    """
+    rnd = random.Random(seed)
+    day_start = datetime.datetime.combine(day, datetime.time())
+    call_ids = list(range(first_id, first_id + count))
+    for call_id in call_ids:
+        start_time = day_start + datetime.timedelta(
+            seconds=rnd.randint(0, latest_start), microseconds=rnd.randint(0, 999999)
+        )
+        length = datetime.timedelta(
+            seconds=rnd.randint(0, 1500), microseconds=rnd.randint(0, 999999)
+        )
+        db.session.add(CallTableModel(
+            call_id=call_id,
+            call_direction=rnd.choice([1, 1, 1, 2]),
+            dialed_party_number=rnd.choice(['7559', '7560', '7561', None]),
+            start_time=start_time,
+            end_time=start_time + length
+        ))
+
+        event_start = start_time
+        for position in range(rnd.randint(0, 4)):
+            event_length = datetime.timedelta(
+                seconds=rnd.randint(0, 400), microseconds=rnd.randint(0, 999999)
+            )
+            db.session.add(EventTableModel(
+                event_id=call_id * 10 + position,
+                event_type=rnd.choice([1, TALKING, TALKING, HOLD_TYPES[0], HOLD_TYPES[1],
+                                       HOLD_TYPES[2], VOICEMAIL, VOICEMAIL]),
+                start_time=event_start,
+                end_time=event_start + event_length,
+                call_id=call_id
+            ))
+            event_start += event_length
+    db.session.commit()
+    return call_ids
+
+
+def load_day(day, cube=True):
+    """
+    Flag the day as loaded and build its call summaries, and its cube.
+    """
+    build_call_summaries(day)
+    if cube:
+        build_sla_cube(day)
+    TablesLoadedModel.create(
+        loaded_date=day,
+        calls_loaded=True,
+        events_loaded=True,
+        summary_loaded=True,
+        cube_loaded=cube
+    )
+    db.session.commit()
@@ -2,3 +2,4 @@ from .report_helpers import *
 from .report_tasks import *
 from .data_helpers import *
 from .data_tasks import *
+from .file_tasks import *
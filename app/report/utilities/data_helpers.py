@@ -1,8 +1,13 @@
 # data/services/data.py
-from sqlalchemy.sql import and_
+from threading import Lock
+from flask import current_app
+from sqlalchemy.sql import and_, select
 from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import sessionmaker
 from app.core import get_model_by_tablename
+from app.extensions import db
 
 
 def get_data_for_table(table_name, start_time, end_time):
@@ -23,9 +28,81 @@ def abort_ro(*args,**kwargs):
     return
 
 
+# Long lived engines per external database URI, so loads reuse pooled
+# connections instead of opening new ones on every run
+_external_engines = {}
+_external_engines_lock = Lock()
+
+
+def get_external_engine(uri, echo=False):
+    """
+    Pooled engine for the external database, created on first use. The
+    pool holds at most LOADER_SOURCE_CONNECTIONS connections.
+    """
+    with _external_engines_lock:
+        engine = _external_engines.get((uri, echo))
+        if engine is None:
+            options = {'echo': echo}
+            if make_url(uri).get_backend_name() != 'sqlite':
+                options.update(
+                    pool_size=current_app.config.get('LOADER_SOURCE_CONNECTIONS', 4),
+                    max_overflow=0,
+                    pool_pre_ping=True
+                )
+            engine = _external_engines[(uri, echo)] = create_engine(uri, **options)
+        return engine
+
+
 def get_external_session(engine, echo=False, readonly=True):
-    engine = create_engine(engine, echo=echo)
+    engine = get_external_engine(engine, echo=echo)
     session = sessionmaker(bind=engine, autoflush=False, autocommit=False)
     if readonly:
         session.flush = abort_ro  # Disable flushing to db
     return session()
+
+
+def insert_ignore(table, dialect_name):
+    """
+    INSERT statement for the table that skips rows whose primary key
+    already exists, using the fast path of the dialect.
+    """
+    if dialect_name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect_name == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    if dialect_name == 'mysql':
+        return table.insert().prefix_with('IGNORE')
+    return table.insert()
+
+
+def bulk_insert_ignore(model, records, batch_size=5000):
+    """
+    Insert the records into the model's table in batches of executemany
+    calls, skipping records that already exist. Bypasses the ORM and its
+    per-record listeners. Returns the records that were new.
+    """
+    table = model.__table__
+    primary_key = list(table.primary_key.columns)[0]
+    statement = insert_ignore(table, db.engine.dialect.name)
+
+    inserted = []
+    for position in range(0, len(records), batch_size):
+        batch = records[position:position + batch_size]
+        # Looking the keys up keeps track of which records are new, the
+        # conflict clause covers rows inserted concurrently. Lookups stay
+        # well below the bound parameter limits of the databases.
+        keys = [record[primary_key.name] for record in batch]
+        existing = set()
+        for lookup in range(0, len(keys), 500):
+            existing.update(
+                key for key, in db.session.execute(
+                    select([primary_key]).where(primary_key.in_(keys[lookup:lookup + 500]))
+                )
+            )
+        new_records = [
+            record for record in batch if record[primary_key.name] not in existing
+        ]
+        if new_records:
+            db.session.execute(statement, new_records)
+            inserted.extend(new_records)
+    return inserted
@@ -1,13 +1,25 @@
 # data/services/loaders.py
+from concurrent.futures import ThreadPoolExecutor
 from json import dumps
 from datetime import datetime, timedelta
+from time import perf_counter
 from flask import current_app
-from sqlalchemy.sql import func, or_
+from sqlalchemy import DateTime
+from sqlalchemy.sql import and_, bindparam, func, literal, or_, select
 
-from .data_helpers import get_external_session
+from .data_helpers import get_external_session, bulk_insert_ignore
 from app.core import get_pk
+from app.extensions import db
 from app.celery_tasks import celery, task_logger as logger
-from ..models import TablesLoadedModel, CallTableModel, EventTableModel
+from ..builders import (
+    build_call_summaries, build_sla_cube, calls_by_day, elapsed_seconds,
+    mark_days_dirty, mark_reports_dirty
+)
+from ..models import (
+    TablesLoadedModel, CallTableModel, EventTableModel, SlaReportModel, SyncWatermarkModel
+)
+from ..archive import archive_month, month_bounds
+from ..storage import ensure_monthly_partitions
 
 
 @celery.task(name='report.utilities.data_loader')
@@ -48,16 +60,6 @@ def data_loader(*args):
         "Load Interval": ", ".join([str(tl_model.loaded_date) for tl_model in dates_to_load])
     }, indent=2, default=str))
 
-    # Check if events and calls are needed for that date
-    calls_interval = [
-        tl_model.loaded_date
-        for tl_model in dates_to_load if tl_model.calls_loaded == False
-    ]
-    call_events_interval = [
-        tl_model.loaded_date
-        for tl_model in dates_to_load if tl_model.events_loaded == False
-    ]
-
     ext_uri = current_app.config.get('EXTERNAL_DATABASE_URI')
     if not ext_uri:
         logger.error("Error: External database connection not set.\n"
@@ -65,68 +67,471 @@ def data_loader(*args):
                      "the address to your database.")
         return "Error: No external connection available."
 
-    ext_session = get_external_session(ext_uri)
+    # Each date loads its calls, then its events, on its own source
+    # connection; SQLite only takes one writer at a time
+    workers = min(
+        len(dates_to_load),
+        current_app.config.get('LOADER_WORKERS', 4),
+        current_app.config.get('LOADER_SOURCE_CONNECTIONS', 4)
+    )
+    if db.engine.dialect.name == 'sqlite':
+        workers = 1
+
+    app = current_app._get_current_object()
+    load_ids = [tl_model.id for tl_model in dates_to_load]
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            errors = list(executor.map(
+                lambda load_id: _load_date(app, ext_uri, load_id), load_ids
+            ))
+    else:
+        errors = [_load_date(app, ext_uri, load_id) for load_id in load_ids]
+
+    errors = [error for error in errors if error]
+    if errors:
+        logger.error("Error: Major failure loading data.")
+        return dumps(errors, indent=4, default=str)
+
+    logger.info("Success: Loaded all data for task request.")
+    return "Success: Tables loaded."
+
+
+def _load_date(app, ext_uri, load_id):
+    """
+    Load the missing calls and events of one date and roll the finished
+    day up. Runs in a loader thread with its own app context, session and
+    external connection. Returns the error if the load failed.
+    """
+    with app.app_context():
+        ext_session = get_external_session(ext_uri)
+        try:
+            tl_model = TablesLoadedModel.query.get(load_id)
+            # Reports can only be stale for days that were loaded before
+            was_loaded = bool(tl_model.summary_loaded)
+            changed = False
+            changed_calls = set()
+            # Events reference their calls, so calls always load first
+            for table in (CallTableModel, EventTableModel):
+                loaded_column, checkpoint_column, fingerprint_column = LOAD_COLUMNS[
+                    table.__tablename__
+                ]
+                if getattr(tl_model, loaded_column):
+                    continue
+
+                # Compare the source against the last load before
+                # extracting anything
+                fingerprint = day_fingerprint(ext_session, table, tl_model.loaded_date)
+                stored = getattr(tl_model, fingerprint_column)
+                if fingerprint == stored:
+                    logger.info("Source unchanged for {table} on {date}, skipping.".format(
+                        table=table.__tablename__, date=tl_model.loaded_date
+                    ))
+                elif getattr(tl_model, checkpoint_column) is None and (
+                        stored is not None or _has_rows(table, tl_model.loaded_date)
+                ):
+                    # Reloaded, or holding rows from the incremental sync
+                    changed_calls.update(_diff_day(ext_session, table, tl_model))
+                    changed = True
+                else:
+                    changed_calls.update(_load_day(ext_session, table, tl_model))
+                    changed = True
+
+                tl_model.update(**{loaded_column: True, fingerprint_column: fingerprint})
+                TablesLoadedModel.session.commit()
+
+            # Roll the finished day up into per-call summaries and then
+            # into the SLA cube
+            if changed or not (tl_model.summary_loaded and tl_model.cube_loaded):
+                build_call_summaries(tl_model.loaded_date)
+                build_sla_cube(tl_model.loaded_date)
+                tl_model.update(summary_loaded=True, cube_loaded=True)
+                TablesLoadedModel.session.commit()
+
+            # Finished reports covering calls that changed are refreshed by
+            # the dirty report loader, once the rollups they read are current.
+            # Reports that finished empty before the first load, or failed,
+            # are rebuilt.
+            changed_calls.discard(None)
+            day_start = datetime.combine(tl_model.loaded_date, datetime.min.time())
+            day_end = day_start + timedelta(days=1)
+            if was_loaded and changed_calls:
+                mark_reports_dirty(changed_calls)
+            elif not was_loaded and changed:
+                SlaReportModel.reset_empty(day_start, day_end)
+            if changed:
+                SlaReportModel.reset_failed(day_start, day_end)
+            TablesLoadedModel.session.commit()
+
+        except Exception as err:
+            TablesLoadedModel.session.rollback()
+            logger.error("Error: Failure loading data for load {id}.".format(id=load_id))
+            return err
+        finally:
+            # Return the external connection to the pool
+            ext_session.close()
+            db.session.remove()
+
+
+# How long a sync holds a table without committing a chunk before an
+# overlapping sync may take it over
+SYNC_CLAIM_PERIOD = timedelta(minutes=10)
+
+
+# Load flag, checkpoint and fingerprint columns of the load record per table
+LOAD_COLUMNS = {
+    'c_call': ('calls_loaded', 'calls_checkpoint', 'calls_fingerprint'),
+    'c_event': ('events_loaded', 'events_checkpoint', 'events_fingerprint'),
+}
+
+
+def _day_conditions(table, date):
+    columns = table.__table__.c
+    day_start = datetime.combine(date, datetime.min.time())
+    return and_(
+        columns.start_time >= day_start,
+        columns.start_time < day_start + timedelta(days=1)
+    )
+
+
+def _has_rows(table, date):
+    primary_key = table.__table__.c[get_pk(table)]
+    query = select([primary_key]).where(_day_conditions(table, date)).limit(1)
+    return db.session.execute(query).first() is not None
+
 
-    load_info = {
-        CallTableModel: calls_interval, EventTableModel: call_events_interval
-    }
+def day_fingerprint(session, table, date):
+    """
+    Row count, max id, id sum and end time checksum of one day of the
+    table, as one short string from a single aggregate query. On
+    databases without an elapsed seconds expression the checksum is left
+    out, so only added or removed records change the fingerprint.
+    """
+    columns = table.__table__.c
+    primary_key = columns[get_pk(table)]
+    day_start = datetime.combine(date, datetime.min.time())
+    aggregates = [func.count(), func.max(primary_key), func.sum(primary_key)]
     try:
-        for table, loading_interval in load_info.items():
-            # Get the data from the source database
-            results = ext_session.query(table).filter(
-                func.DATE(table.start_time).in_(loading_interval)
+        aggregates.append(func.sum(elapsed_seconds(
+            literal(day_start, DateTime), columns.end_time, session.get_bind().dialect.name
+        )))
+    except ValueError:
+        logger.warning(
+            "No end time checksum for {table} on {dialect}, fingerprinting ids only.".format(
+                table=table.__tablename__, dialect=session.get_bind().dialect.name
+            )
+        )
+    row = session.execute(
+        select(aggregates).where(_day_conditions(table, date))
+    ).first()
+    return ":".join(str(int(value or 0)) for value in row)
+
+
+def _diff_day(ext_session, table, tl_model):
+    """
+    Reload only the records of a day that are new or whose end time
+    changed at the source, comparing narrow (id, end time) key lists.
+    Returns the ids of the calls that changed.
+    """
+    columns = table.__table__.c
+    primary_key = columns[get_pk(table)]
+    key_query = select([primary_key, columns.end_time]).where(
+        _day_conditions(table, tl_model.loaded_date)
+    )
+    source = dict(ext_session.execute(key_query).fetchall())
+    local = dict(db.session.execute(key_query).fetchall())
+    changed_keys = sorted(key for key, end_time in source.items() if local.get(key) != end_time)
+
+    update = table.__table__.update().where(primary_key == bindparam('record_key'))
+    updated = inserted = 0
+    changed_calls = set()
+    # Stay well below the bound parameter limits of the databases
+    for position in range(0, len(changed_keys), 500):
+        records = [
+            dict(row) for row in ext_session.execute(
+                select(list(columns)).where(
+                    primary_key.in_(changed_keys[position:position + 500])
+                )
             )
-            # Slice the data up by date to keep track of dates loaded
-            grouped_data = {}
-            for r in results.all():
-                record = r.__dict__
-                record_date = record['start_time'].date()
-                dates_records = grouped_data.get(record_date, [])
-                dates_records.append(record)
-                grouped_data[record_date] = dates_records
-
-            matching_key = get_pk(table)
-
-            # Add the records from the external database to the local
-            # database. Add record by record grouped by date. Check if
-            # the record exists before adding.
-            for date, gr in grouped_data.items():
-                for rec in gr:
-                    primary_key = rec.get(matching_key)
-                    if not primary_key:
-                        logger.error("Could not identify primary key for foreign record.\n"
-                                          "{dump}".format(dump=dumps(gr, indent=2, default=str)))
-                        continue
-
-                    record = table.find(primary_key)
-                    if not record:
-                        table.create(
-                            **{
-                                entry: rec[entry]
-                                for entry in rec.keys() if entry != '_sa_instance_state'
-                            }
-                        )
-                    else:
-                        logger.warning("Record Exists: {rec}".format(rec=record))
-
-                tl_model = TablesLoadedModel.find(date)
-                if table.__tablename__ == "c_call":
-                    tl_model.update(calls_loaded=True)
-                if table.__tablename__ == "c_event":
-                    tl_model.update(events_loaded=True)
+        ]
+        new_records = write_records(
+            table, [record for record in records if record[primary_key.name] not in local]
+        )
+        existing = [record for record in records if record[primary_key.name] in local]
+        if existing:
+            db.session.execute(update, [
+                dict(record, record_key=record[primary_key.name]) for record in existing
+            ])
+        changed_calls.update(record.get('call_id') for record in new_records + existing)
+        inserted += len(new_records)
+        updated += len(existing)
+        TablesLoadedModel.session.commit()
+
+    logger.info(
+        "Diff loaded {table} for {date}: {inserted} new and {updated} changed records, "
+        "{missing} records no longer at the source".format(
+            table=table.__tablename__, date=tl_model.loaded_date,
+            inserted=inserted, updated=updated, missing=len(set(local) - set(source))
+        )
+    )
+    return changed_calls
+
+
+def _stream_records(ext_session, query, column_names):
+    """
+    Yield the rows of an external query as lists of plain dicts, a fixed
+    number of rows at a time.
+    """
+    chunk_size = current_app.config.get('LOADER_CHUNK_SIZE', 5000)
+    # Server side cursor where the driver supports one
+    results = ext_session.connection().execution_options(
+        stream_results=True
+    ).execute(query)
+    try:
+        chunk = results.fetchmany(chunk_size)
+        while chunk:
+            yield [dict(zip(column_names, tuple(row))) for row in chunk]
+            chunk = results.fetchmany(chunk_size)
+    finally:
+        results.close()
+
+
+def write_records(table, records):
+    """
+    Insert the records that do not exist yet and return the inserted
+    records. Callers commit the session, and flag the finished reports
+    covering the inserted calls dirty once the day is rolled up.
+    """
+    if current_app.config.get('LOADER_BULK_INSERT', True):
+        inserted = bulk_insert_ignore(
+            table, records, current_app.config.get('LOADER_BATCH_SIZE', 5000)
+        )
+    else:
+        # Record by record, through the ORM and its listeners
+        matching_key = get_pk(table)
+        inserted = []
+        for record in records:
+            existing = table.find(record[matching_key])
+            if not existing:
+                table.create(**record)
+                inserted.append(record)
+            else:
+                logger.warning("Record Exists: {rec}".format(rec=existing))
+    return inserted
+
+
+def _load_day(ext_session, table, tl_model):
+    """
+    Stream one day of the table from the external database in chunks.
+    Every chunk is written and committed along with the last primary key
+    it held, so a failed load resumes after the last committed chunk.
+    Returns the ids of the calls that gained records.
+    """
+    loaded_column, checkpoint_column, _ = LOAD_COLUMNS[table.__tablename__]
+    columns = list(table.__table__.columns)
+    column_names = [column.name for column in columns]
+    primary_key = table.__table__.c[get_pk(table)]
+
+    conditions = [_day_conditions(table, tl_model.loaded_date)]
+    checkpoint = getattr(tl_model, checkpoint_column)
+    if checkpoint is not None:
+        logger.info(
+            "Resuming {table} load for {date} after {key}".format(
+                table=table.__tablename__, date=tl_model.loaded_date, key=checkpoint
+            )
+        )
+        conditions.append(primary_key > checkpoint)
+    query = select(columns).where(and_(*conditions)).order_by(primary_key)
+
+    load_started = perf_counter()
+    loaded = 0
+    changed_calls = set()
+    for records in _stream_records(ext_session, query, column_names):
+        changed_calls.update(record.get('call_id') for record in write_records(table, records))
+        tl_model.update(**{checkpoint_column: records[-1][primary_key.name]})
+        TablesLoadedModel.session.commit()
+        loaded += len(records)
+
+    tl_model.update(**{loaded_column: True, checkpoint_column: None})
+    TablesLoadedModel.session.commit()
+
+    load_seconds = perf_counter() - load_started
+    logger.info(
+        "Loaded {count} {table} records for {date} in {seconds:.2f}s "
+        "({rate:.0f} rows/s)".format(
+            count=loaded, table=table.__tablename__, date=tl_model.loaded_date,
+            seconds=load_seconds, rate=loaded / load_seconds if load_seconds else 0
+        )
+    )
+    return changed_calls
+
+
+@celery.task(name='report.utilities.incremental_sync')
+def incremental_sync(*args):
+    """
+    Pull the calls and events added to the external database since the
+    last tick, using a per-table high-water mark on the primary key.
+    Only new keys are pulled: rows updated at the source after they were
+    synced, e.g. the end time of a call still in progress, are corrected
+    when their day loads, which diffs end times against the synced rows.
+    """
+    if not current_app.config.get('LOADER_INCREMENTAL_SYNC', False):
+        return "Success: Incremental sync disabled."
+
+    ext_uri = current_app.config.get('EXTERNAL_DATABASE_URI')
+    if not ext_uri:
+        logger.error("Error: External database connection not set.\n"
+                     "Add 'EXTERNAL_DATABASE_URI' to your config with\n"
+                     "the address to your database.")
+        return "Error: No external connection available."
+
+    ext_session = get_external_session(ext_uri)
+    claimed = []
+    try:
+        synced_calls = set()
+        for table in (CallTableModel, EventTableModel):
+            primary_key = table.__table__.c[get_pk(table)]
+            watermark = SyncWatermarkModel.find_or_start(table, primary_key)
+            if watermark is None:
+                logger.info("No loaded days to sync {table} after.".format(
+                    table=table.__tablename__
+                ))
+                continue
+            if not watermark.claim(SYNC_CLAIM_PERIOD):
+                logger.info("{table} is already being synced.".format(
+                    table=table.__tablename__
+                ))
+                continue
+            claimed.append(watermark)
+
+            columns = list(table.__table__.columns)
+            query = select(columns).where(
+                primary_key > watermark.last_key
+            ).order_by(primary_key)
+
+            synced = 0
+            for records in _stream_records(
+                    ext_session, query, [column.name for column in columns]
+            ):
+                inserted = write_records(table, records)
+                synced_calls.update(record.get('call_id') for record in inserted)
+                watermark.update(
+                    last_key=records[-1][primary_key.name],
+                    last_updated=datetime.utcnow(),
+                    claimed_until=datetime.utcnow() + SYNC_CLAIM_PERIOD
+                )
+                SyncWatermarkModel.session.commit()
+                synced += len(records)
+
+            if synced:
+                logger.info("Synced {count} {table} records up to {key}".format(
+                    count=synced, table=table.__tablename__, key=watermark.last_key
+                ))
+
+        # Keep the rollups of days that were already summarized current,
+        # then flag the finished reports over those days
+        synced_calls.discard(None)
+        changed = calls_by_day(synced_calls)
+        summarized = {}
+        for date in sorted(changed):
+            tl_model = TablesLoadedModel.find(date)
+            if tl_model and tl_model.summary_loaded:
+                build_call_summaries(date)
+                build_sla_cube(date)
                 TablesLoadedModel.session.commit()
-            table.session.commit()
+                summarized[date] = changed[date]
+        if summarized:
+            mark_days_dirty(summarized)
+            TablesLoadedModel.session.commit()
 
     except Exception as err:
-        logger.error("Error: Major failure loading data.")
+        SyncWatermarkModel.session.rollback()
+        logger.error("Error: Failure syncing data.")
         return dumps(err, indent=4, default=str)
     else:
-        logger.info("Success: Loaded all data for task request.")
-        return "Success: Tables loaded."
+        return "Success: Synced new data."
     finally:
-        # Always close the connection to the external database
+        for watermark in claimed:
+            watermark.release()
         ext_session.close()
-        logger.info("Closed external data connection.")
+
+
+@celery.task(name='report.utilities.rollup_loader')
+def rollup_loader(*args):
+    """
+    Build the call summaries and the SLA cube for loaded days that do not
+    have them yet.
+    """
+    dates_to_build = TablesLoadedModel.query.filter(
+        TablesLoadedModel.calls_loaded.is_(True),
+        TablesLoadedModel.events_loaded.is_(True),
+        or_(
+            TablesLoadedModel.summary_loaded.is_(False),
+            TablesLoadedModel.summary_loaded.is_(None),
+            TablesLoadedModel.cube_loaded.is_(False),
+            TablesLoadedModel.cube_loaded.is_(None)
+        )
+    ).limit(
+        current_app.config.get('MAX_INTERVAL', 3)
+    ).all()
+
+    if not len(dates_to_build) > 0:
+        logger.info("No SLA rollups to build.")
+        return "Success: No tasks."
+
+    for tl_model in dates_to_build:
+        # The cube is built from the call summaries
+        if not tl_model.summary_loaded:
+            build_call_summaries(tl_model.loaded_date)
+        build_sla_cube(tl_model.loaded_date)
+        tl_model.update(summary_loaded=True, cube_loaded=True)
+        TablesLoadedModel.session.commit()
+    return "Success: SLA rollups built."
+
+
+@celery.task(name='report.utilities.archive_loader')
+def archive_loader(*args):
+    """
+    Move the oldest closed month of raw calls and events past the
+    retention window to the Parquet archive. Months are only archived
+    once all of their loaded days, and every inbound call in them, have
+    call summaries.
+    """
+    directory = current_app.config.get('ARCHIVE_DIRECTORY')
+    if not directory:
+        logger.info("No archive directory configured.")
+        return "Success: No tasks."
+
+    today = datetime.today().date()
+    months_back = today.year * 12 + today.month - 1 - current_app.config.get('ARCHIVE_AFTER_MONTHS', 3)
+    cutoff = datetime(months_back // 12, months_back % 12 + 1, 1)
+    oldest = db.session.query(func.min(CallTableModel.start_time)).filter(
+        CallTableModel.start_time < cutoff
+    ).scalar()
+    if oldest is None:
+        logger.info("No call data to archive.")
+        return "Success: No tasks."
+
+    month_start, month_end = month_bounds(oldest)
+    unsummarized = TablesLoadedModel.query.filter(
+        TablesLoadedModel.loaded_date >= month_start.date(),
+        TablesLoadedModel.loaded_date < month_end.date(),
+        or_(
+            TablesLoadedModel.summary_loaded.is_(False),
+            TablesLoadedModel.summary_loaded.is_(None)
+        )
+    ).count()
+    if unsummarized:
+        logger.info("Call summaries missing for {month:%Y-%m}, not archiving.".format(month=oldest))
+        return "Success: No tasks."
+
+    try:
+        archive_month(oldest, directory)
+        db.session.commit()
+    except Exception as err:
+        db.session.rollback()
+        logger.error("Error: Failure archiving {month:%Y-%m}.".format(month=oldest))
+        return dumps(err, indent=4, default=str)
+    return "Success: Archived {month:%Y-%m}.".format(month=oldest)
 
 
 @celery.task(name='report.utilities.data_scheduler')
@@ -136,3 +541,5 @@ def data_scheduler(*args):
     for date in TablesLoadedModel.not_loaded_when2when(RANGE_START, RANGE_END):
         TablesLoadedModel.create(loaded_date=date)
     TablesLoadedModel.session.commit()
+    # Partitioned raw data tables need their months before loading
+    ensure_monthly_partitions(RANGE_START, RANGE_END)
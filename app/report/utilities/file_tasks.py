@@ -0,0 +1,232 @@
+# data/services/file_loaders.py
+import os
+import re
+import shutil
+from datetime import datetime, timedelta
+from json import dumps
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from flask import current_app
+from sqlalchemy import DateTime, Integer, String
+
+from app.celery_tasks import celery, task_logger as logger
+from .data_tasks import write_records
+from ..builders import build_call_summaries, build_sla_cube, calls_by_day, mark_days_dirty
+from ..models import TablesLoadedModel, CallTableModel, EventTableModel, SlaReportModel
+# Parquet exports need pyarrow, CSV exports only pandas
+from ..parquet import pa, pq
+
+
+# Export files are matched to tables by name prefix, e.g.
+# c_call_2018-07-02.csv or c_event_2018-07-02.parquet. Calls load first
+# since events reference them. Only the day named in the file is flagged
+# loaded; records of other days are inserted but their days still load
+# from the source.
+FILE_TABLES = (
+    ('c_call', CallTableModel, 'calls_loaded'),
+    ('c_event', EventTableModel, 'events_loaded'),
+)
+FILE_EXTENSIONS = ('.csv', '.parquet')
+EXPORT_DAY = re.compile(r'_(\d{4}-\d{2}-\d{2})$')
+
+
+def read_export(path, columns, chunk_size, string_columns=()):
+    """
+    Yield DataFrames of at most chunk_size rows from a CSV or Parquet
+    export, reading only the given columns through a memory map. CSV
+    string columns are kept as text, e.g. DIDs that look like numbers.
+    """
+    if path.endswith('.parquet'):
+        if pq is None:
+            raise RuntimeError("pyarrow is required to load Parquet exports.")
+        parquet_file = pq.ParquetFile(pa.memory_map(path, 'r'))
+        available = [name for name in columns if name in parquet_file.schema.names]
+        for row_group in range(parquet_file.num_row_groups):
+            frame = parquet_file.read_row_group(row_group, columns=available).to_pandas()
+            for position in range(0, len(frame), chunk_size):
+                yield frame.iloc[position:position + chunk_size]
+    else:
+        for frame in pd.read_csv(
+                path, chunksize=chunk_size, memory_map=True,
+                usecols=lambda name: name in columns,
+                dtype={name: str for name in string_columns}
+        ):
+            yield frame
+
+
+def frame_to_records(frame, table):
+    """
+    Convert a chunk of an export to insertable records, column by column:
+    datetimes to Python datetimes, integers to Python ints and missing
+    values to None.
+    """
+    columns = {}
+    for column in table.__table__.columns:
+        if column.name not in frame:
+            continue
+        values = frame[column.name]
+        missing = pd.isnull(values).values
+        if isinstance(column.type, DateTime):
+            converted = pd.to_datetime(values).dt.to_pydatetime().astype(object)
+        elif isinstance(column.type, Integer):
+            converted = values.values.astype(object)
+            converted[~missing] = values.values[~missing].astype(np.int64).tolist()
+        else:
+            converted = values.values.astype(object)
+        converted[missing] = None
+        columns[column.name] = converted
+
+    names = list(columns)
+    return [dict(zip(names, row)) for row in zip(*[columns[name] for name in names])]
+
+
+def _export_files(directory):
+    """
+    Export files in the drop directory with their table, calls first.
+    """
+    names = sorted(
+        name for name in os.listdir(directory)
+        if name.endswith(FILE_EXTENSIONS)
+    )
+    for prefix, table, loaded_column in FILE_TABLES:
+        for name in names:
+            if name.startswith(prefix + '_') or os.path.splitext(name)[0] == prefix:
+                yield os.path.join(directory, name), table, loaded_column
+
+
+def _export_day(path):
+    """
+    The day an export file covers, from its name, or None.
+    """
+    match = EXPORT_DAY.search(os.path.splitext(os.path.basename(path))[0])
+    if match:
+        return datetime.strptime(match.group(1), '%Y-%m-%d').date()
+
+
+def _move(path, folder):
+    target = os.path.join(os.path.dirname(path), folder)
+    os.makedirs(target, exist_ok=True)
+    shutil.move(path, os.path.join(target, os.path.basename(path)))
+
+
+def load_export(path, table):
+    """
+    Bulk insert one export file chunk by chunk and return the dates of
+    the records it held, with the ids of the calls that gained records.
+    """
+    chunk_size = current_app.config.get('LOADER_CHUNK_SIZE', 5000)
+    column_names = [column.name for column in table.__table__.columns]
+    string_columns = [
+        column.name for column in table.__table__.columns
+        if isinstance(column.type, String)
+    ]
+
+    load_started = perf_counter()
+    loaded = 0
+    dates = set()
+    changed_calls = set()
+    for frame in read_export(path, column_names, chunk_size, string_columns):
+        records = frame_to_records(frame, table)
+        records = [record for record in records if record.get('start_time')]
+        changed_calls.update(record.get('call_id') for record in write_records(table, records))
+        table.session.commit()
+        dates.update(record['start_time'].date() for record in records)
+        loaded += len(records)
+
+    load_seconds = perf_counter() - load_started
+    logger.info(
+        "Loaded {count} {table} records from {path} in {seconds:.2f}s "
+        "({rate:.0f} rows/s)".format(
+            count=loaded, table=table.__tablename__, path=path,
+            seconds=load_seconds, rate=loaded / load_seconds if load_seconds else 0
+        )
+    )
+    changed_calls.discard(None)
+    return dates, changed_calls
+
+
+@celery.task(name='report.utilities.file_loader')
+def file_loader(*args):
+    """
+    Load c_call / c_event shaped CSV or Parquet exports from the drop
+    directory, then flag and roll up the days they cover like data_loader
+    does. Loaded files move to processed/, files that failed to failed/.
+    """
+    directory = current_app.config.get('LOADER_DROP_DIRECTORY')
+    if not directory or not os.path.isdir(directory):
+        logger.info("No drop directory to load files from.")
+        return "Success: No tasks."
+
+    files = list(_export_files(directory))
+    if not files:
+        logger.info("No export files to load.")
+        return "Success: No tasks."
+
+    errors = {}
+    touched = set()
+    # Days rolled up before this run, whose finished reports go stale
+    summarized = set()
+    changed_calls = set()
+    for path, table, loaded_column in files:
+        try:
+            dates, file_calls = load_export(path, table)
+            export_day = _export_day(path)
+            if export_day is not None:
+                dates.add(export_day)
+            for date in dates:
+                tl_model = TablesLoadedModel.find(date)
+                if tl_model is not None and tl_model.summary_loaded:
+                    summarized.add(date)
+
+            # A partial export must not mark its days as loaded
+            if export_day is not None:
+                tl_model = TablesLoadedModel.find(export_day)
+                if tl_model is None:
+                    tl_model = TablesLoadedModel.create(loaded_date=export_day)
+                tl_model.update(**{loaded_column: True, 'last_updated': datetime.utcnow()})
+                TablesLoadedModel.session.commit()
+            uncovered = dates - {export_day}
+            if uncovered:
+                logger.info("{path} holds records of days it does not cover: {dates}".format(
+                    path=path, dates=", ".join(str(date) for date in sorted(uncovered))
+                ))
+            touched.update(dates)
+            changed_calls.update(file_calls)
+        except Exception as err:
+            TablesLoadedModel.session.rollback()
+            logger.error("Error: Failure loading export {path}.".format(path=path))
+            errors[path] = err
+            _move(path, 'failed')
+        else:
+            _move(path, 'processed')
+
+    # Roll the finished days up into per-call summaries and the SLA cube
+    rolled_up = set()
+    for date in sorted(touched):
+        tl_model = TablesLoadedModel.find(date)
+        if tl_model is not None and tl_model.calls_loaded and tl_model.events_loaded:
+            build_call_summaries(date)
+            build_sla_cube(date)
+            tl_model.update(summary_loaded=True, cube_loaded=True)
+            TablesLoadedModel.session.commit()
+            rolled_up.add(date)
+
+    # Flag the finished reports over days that were already rolled up,
+    # requeue the ones that finished empty before their day first loaded
+    # and retry the failed ones over any day that changed
+    changed = calls_by_day(changed_calls)
+    stale = {date: dids for date, dids in changed.items() if date in summarized & rolled_up}
+    if stale:
+        mark_days_dirty(stale)
+    for date in sorted(rolled_up - summarized):
+        day_start = datetime.combine(date, datetime.min.time())
+        SlaReportModel.reset_empty(day_start, day_start + timedelta(days=1))
+    for date in sorted(rolled_up | set(changed)):
+        day_start = datetime.combine(date, datetime.min.time())
+        SlaReportModel.reset_failed(day_start, day_start + timedelta(days=1))
+    TablesLoadedModel.session.commit()
+
+    if errors:
+        return dumps(errors, indent=4, default=str)
+    return "Success: Export files loaded."
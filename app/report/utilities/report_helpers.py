@@ -1,9 +1,13 @@
 # report/services/sla_report.py
+from collections import OrderedDict
 from datetime import timedelta
 
+import numpy as np
 import pandas as pd
 
-from ..models import ClientModel
+from app.core import to_number
+from ..aggregates import SlaRow, to_microseconds
+from ..models import ClientDirectory, SlaReportModel
 
 SUM_COLS = [
     'I/C Presented',
@@ -22,6 +26,18 @@ SUM_COLS = [
 ]
 
 
+# Columns of the stored report holding timedeltas, the rest are counts
+DURATION_COLS = [
+    'Answered Incoming Duration',
+    'Answered Wait Duration',
+    'Lost Wait Duration',
+    'Longest Waiting Answered'
+]
+
+# Columns of the stored report holding counts
+COUNT_COLS = [column for column in SUM_COLS if column not in DURATION_COLS]
+
+
 def get_td(interval, period):
     time_delta = {}
     if interval == 'D':
@@ -100,6 +116,83 @@ def compute_avgs(df):
     return df
 
 
+def compute_wait_metrics(histograms, thresholds=(), percentiles=(), clients=None,
+                         row_names=()):
+    """
+    Service levels for arbitrary thresholds and wait percentiles per DID,
+    read from the stored wait histograms, plus a Summary row merged over
+    the selected DIDs. Rows of row_names without a stored histogram, and
+    the Summary over them, get None for every metric.
+    """
+    # Histogram bins are whole seconds, compared against numbers only
+    thresholds = [to_number(seconds) for seconds in thresholds]
+    percentiles = [to_number(percent) for percent in percentiles]
+
+    histograms = histograms or {}
+    rows = OrderedDict()
+    summary = SlaRow()
+    for row_name in sorted(set(histograms) | set(row_names)):
+        if clients and row_name not in clients:
+            continue
+        row = SlaRow()
+        if row_name in histograms:
+            row.histograms_from_dict(histograms[row_name])
+        else:
+            row.has_distributions = False
+        rows[row_name] = row
+        summary.merge(row)
+    rows['Summary'] = summary
+
+    metrics = OrderedDict()
+    for row_name, row in rows.items():
+        available = row.has_distributions
+        row_metrics = OrderedDict()
+        for seconds in thresholds:
+            row_metrics['Calls Ans Within {seconds} (%)'.format(seconds=seconds)] = (
+                row.answered_waits.fraction_within(seconds) if available else None
+            )
+        for percent in percentiles:
+            row_metrics['P{percent} Wait Answered'.format(percent=percent)] = (
+                row.answered_waits.percentile(percent) if available else None
+            )
+            row_metrics['P{percent} Wait Lost'.format(percent=percent)] = (
+                row.lost_waits.percentile(percent) if available else None
+            )
+        metrics[row_name] = row_metrics
+    return metrics
+
+
+def compute_duration_quantiles(sla_rows, percentiles=(50, 90, 99), clients=None):
+    """
+    Percentiles of the answered wait, lost wait and talk durations per
+    DID from the quantile sketches, plus a Summary row merged over the
+    selected DIDs.
+    """
+    rows = OrderedDict()
+    summary = SlaRow()
+    for row_name in sorted(sla_rows):
+        if clients and row_name not in clients:
+            continue
+        rows[row_name] = sla_rows[row_name]
+        summary.merge(sla_rows[row_name])
+    rows['Summary'] = summary
+
+    quantiles = OrderedDict()
+    for row_name, row in rows.items():
+        row_quantiles = OrderedDict()
+        for label, sketch in (
+            ('Wait Answered', row.answered_wait_sketch),
+            ('Wait Lost', row.lost_wait_sketch),
+            ('Incoming Duration', row.talk_sketch),
+        ):
+            for percent in percentiles:
+                row_quantiles['P{percent} {label}'.format(percent=percent, label=label)] = (
+                    sketch.quantile(percent)
+                )
+        quantiles[row_name] = row_quantiles
+    return quantiles
+
+
 def format_df(cell):
     if isinstance(cell, float):
         return "{:.0%}".format(cell)
@@ -111,18 +204,101 @@ def format_df(cell):
         return cell
 
 
+def client_names(row_names):
+    # Client name of each row name, or the row name if it has none
+    names = ClientDirectory.names()
+    return [names.get(str(index), index) for index in row_names]
+
+
 def add_client_names(frame):
     # Show the client names as row names
     if not frame.empty:
-        aliases = []
-        for index in list(frame.index):
-            client = ClientModel.query.filter(ClientModel.ext == index).first()
-            if client:
-                # aliases.append("{name} ({ext})".format(name=client.name, ext=client.ext))
-                aliases.append("{name}".format(name=client.name))
-            else:
-                aliases.append(index)
-        frame.insert(0, "Client", aliases)
+        frame.insert(0, "Client", client_names(list(frame.index)))
     else:
         frame.insert(0, "Client", list(frame.index))
     return frame
+
+
+def format_percents(values):
+    # Same as "{:.0%}".format per value
+    return np.char.mod('%d%%', np.rint(values * 100).astype(np.int64)).astype(object)
+
+
+def format_durations(nanoseconds):
+    # Same as format_df per timedelta: HH:MM:SS of the whole seconds
+    hours, remainder = np.divmod(nanoseconds / 1e9, 3600)
+    minutes, seconds = np.divmod(remainder, 60)
+    parts = [np.char.mod('%02d', part.astype(np.int64)) for part in (hours, minutes, seconds)]
+    return np.char.add(np.char.add(np.char.add(np.char.add(
+        parts[0], ':'), parts[1]), ':'), parts[2]
+    ).astype(object)
+
+
+def sla_report_frame(report_data, clients=None):
+    """
+    The formatted SLA report of the stored report data: a row per
+    selected DID and a Summary row, the same frame as make_summary,
+    compute_avgs and applymap(format_df) give. Durations stay int64
+    nanoseconds and every column is computed and formatted in one pass.
+    """
+    row_names = sorted(report_data or {})
+    if clients:
+        stored = set(row_names)
+        row_names = [row_name for row_name in clients if row_name in stored]
+    if not row_names:
+        return pd.DataFrame(columns=['Client'] + SlaReportModel.headers())
+
+    rows = [report_data[row_name] for row_name in row_names]
+    columns = {}
+    for column in COUNT_COLS:
+        values = np.array([row[column] for row in rows], dtype=np.int64)
+        columns[column] = np.append(values, values.sum())
+    for column in DURATION_COLS:
+        values = np.array([to_microseconds(row[column]) for row in rows], dtype=np.int64) * 1000
+        summary = values.max() if column == 'Longest Waiting Answered' else values.sum()
+        columns[column] = np.append(values, summary)
+
+    presented = columns['I/C Presented']
+    answered = columns['I/C Live Answered']
+    total_lost = columns['I/C Lost'] + columns['Voice Mails']
+    none_presented = presented == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percents = {
+            'Incoming Live Answered (%)': np.where(none_presented, 1.0, answered / presented),
+            'Incoming Received (%)': np.where(
+                none_presented, 1.0, (answered + columns['Voice Mails']) / presented
+            ),
+            'Incoming Abandoned (%)': np.where(none_presented, 0.0, columns['I/C Lost'] / presented),
+            'PCA': np.where(
+                none_presented, 1.0,
+                (columns['Calls Ans Within 15'] + columns['Calls Ans Within 30']) / presented
+            ),
+        }
+        # Averages truncate to whole nanoseconds like the timedelta casts
+        averages = {
+            'Average Incoming Duration': np.where(
+                answered < 1, columns['Answered Incoming Duration'],
+                (columns['Answered Incoming Duration'] / answered).astype(np.int64)
+            ),
+            'Average Wait Answered': np.where(
+                answered < 1, columns['Answered Wait Duration'],
+                (columns['Answered Wait Duration'] / answered).astype(np.int64)
+            ),
+            'Average Wait Lost': np.where(
+                total_lost == 0, columns['Lost Wait Duration'],
+                (columns['Lost Wait Duration'] / total_lost).astype(np.int64)
+            ),
+        }
+
+    frame = OrderedDict()
+    frame['Client'] = client_names(row_names) + ['Summary']
+    for header in SlaReportModel.headers():
+        if header in percents:
+            frame[header] = format_percents(percents[header])
+        elif header in averages:
+            frame[header] = format_durations(averages[header])
+        elif header in DURATION_COLS:
+            frame[header] = format_durations(columns[header])
+        else:
+            frame[header] = columns[header]
+    return pd.DataFrame(frame, index=row_names + ['Summary'])
@@ -0,0 +1,127 @@
+# report/utilities/report_helpers_test.py
+import random
+import unittest
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from app.extensions import db
+from ..aggregates import HEADERS, MICROSECONDS, SlaRow
+from ..models import ClientModel, SlaReportModel
+from ..testing import ReportTestCase
+from .report_helpers import (
+    add_client_names, make_summary, compute_avgs, compute_wait_metrics, format_df,
+    format_percents, sla_report_frame
+)
+
+ROW_NAMES = ['7559', '7560', '7561', 'None'] + [str(8000 + number) for number in range(30)]
+
+
+def pandas_frame(report_data, clients=None):
+    """
+    The report frame as get_sla_report built it with pandas, kept as the
+    reference sla_report_frame must reproduce exactly.
+    """
+    frame = pd.DataFrame.from_dict(report_data, orient='index')
+    if clients:
+        frame = frame.filter(items=clients, axis=0)
+    frame = add_client_names(frame)
+    if not frame.empty:
+        frame = make_summary(frame)
+        frame = compute_avgs(frame)
+        frame = frame[['Client'] + SlaReportModel.headers()]
+    return frame.applymap(format_df)
+
+
+def random_report(rnd, size, long_durations=False):
+    scale = 1000000 if long_durations else 3000
+
+    def duration(answered):
+        seconds = rnd.randint(0, scale * (answered + 1))
+        return timedelta(seconds=seconds, microseconds=rnd.choice([0, rnd.randint(0, 999999)]))
+
+    report_data = {}
+    # Sorted like the index pandas 0.23 gives a frame built from a dict
+    for row_name in sorted(rnd.sample(ROW_NAMES, size)):
+        presented = rnd.choice([0, 0, rnd.randint(1, 50), rnd.randint(1, 5000)])
+        answered = rnd.randint(0, presented)
+        lost = rnd.randint(0, presented - answered)
+        voice_mails = rnd.randint(0, presented - answered - lost)
+        values = (
+            [presented, answered, lost, voice_mails]
+            + [duration(answered) for _ in range(3)]
+            + [rnd.randint(0, answered + 1) for _ in range(6)]
+            + [duration(answered)]
+        )
+        report_data[row_name] = dict(zip(HEADERS, values))
+    return report_data
+
+
+def cells(frame):
+    # Values with their types, so '1' and 1 do not compare equal
+    return [
+        [(type(value).__name__, value) for value in row]
+        for row in frame.to_dict(orient='split')['data']
+    ]
+
+
+class SlaReportFrameTest(ReportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        db.session.add(ClientModel(name='Alpha', ext=7559))
+        db.session.add(ClientModel(name='Gamma', ext=7561))
+        db.session.commit()
+
+    def test_matches_pandas_frame(self):
+        for trial in range(200):
+            rnd = random.Random(trial)
+            report_data = random_report(
+                rnd, rnd.choice([1, 2, 5, 30]), long_durations=trial % 3 == 0
+            )
+            clients = rnd.choice([None, [], rnd.sample(ROW_NAMES, 3), ['7561', '7559', '7561']])
+            self.assertEqual(
+                cells(sla_report_frame(report_data, clients)),
+                cells(pandas_frame(report_data, clients)),
+                trial
+            )
+
+    def test_empty_report(self):
+        self.assertEqual(cells(sla_report_frame({})), cells(pandas_frame({})))
+        self.assertEqual(
+            list(sla_report_frame({}).columns), ['Client'] + SlaReportModel.headers()
+        )
+
+
+class WaitMetricsTest(unittest.TestCase):
+
+    def test_thresholds_compare_as_numbers(self):
+        row = SlaRow()
+        for seconds in (5, 12, 40, 90, 600):
+            row.answered_waits.add(seconds * MICROSECONDS)
+            row.lost_waits.add(seconds * 2 * MICROSECONDS)
+        histograms = {'7559': row.histograms_to_dict()}
+
+        self.assertEqual(
+            compute_wait_metrics(histograms, thresholds=['15', '90.0'], percentiles=['50']),
+            compute_wait_metrics(histograms, thresholds=[15, 90], percentiles=[50])
+        )
+        with self.assertRaises(ValueError):
+            compute_wait_metrics(histograms, thresholds=['soon'])
+
+
+class FormatTest(unittest.TestCase):
+
+    def test_format_percents(self):
+        counts = np.random.RandomState(0).randint(0, 1000000, size=(100000, 2))
+        counts = counts[counts[:, 1] > 0]
+        fractions = np.minimum(counts[:, 0], counts[:, 1]) / counts[:, 1]
+        self.assertEqual(
+            list(format_percents(fractions)),
+            ["{:.0%}".format(fraction) for fraction in fractions]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,12 +4,23 @@ from flask import current_app
 from sqlalchemy.sql import or_, func
 
 from app.celery_tasks import celery, task_logger as logger
-from ..builders import build_sla_data, build_summary_sla_data
+from app.core import to_datetime
+from ..builders import (
+    build_sla_rows, build_summary_sla_data, build_summary_distributions,
+    rows_to_data, rows_to_histograms, rows_to_sketches, replace_rows,
+    distributions_missing
+)
 from ..models import SlaReportModel, SummarySLAReportModel
 
 
 @celery.task(name='report.utilities.make_sla_report')
 def make_sla_report(*args, start_time=None, end_time=None):
+    # Queued tasks receive their datetimes as ISO strings
+    if isinstance(start_time, str):
+        start_time = to_datetime(start_time, 'start_time')
+    if isinstance(end_time, str):
+        end_time = to_datetime(end_time, 'end_time')
+
     if not (start_time and end_time):
         logger.error(
             "Error: Report times: {start} and {end} are"
@@ -23,7 +34,10 @@ def make_sla_report(*args, start_time=None, end_time=None):
     if not report:
         report = SlaReportModel.create(start_time=start_time, end_time=end_time)
 
-    if report.data:
+    if report.completed_on and report.dirty:
+        return refresh_sla_report(report)
+
+    if report.completed_on:
         logger.info(
             "Report exists for {start} to {end}.\n".format(
                 start=start_time, end=end_time
@@ -31,32 +45,177 @@ def make_sla_report(*args, start_time=None, end_time=None):
         )
         return True
 
-    report_data = build_sla_data(start_time, end_time)
-
-    if not report_data:
-        logger.error(
+    try:
+        sla_rows = build_sla_rows(
+            start_time, end_time,
+            engine=current_app.config.get('SLA_REPORT_ENGINE', 'orm')
+        )
+    except Exception:
+        logger.exception(
             "Error: Could not build report for: {start} and {end}.\n".format(
                 start=start_time, end=end_time
             )
         )
+        SlaReportModel.session.rollback()
+        report.update(
+            status='failed',
+            attempts=(report.attempts or 0) + 1,
+            last_updated=datetime.datetime.utcnow()
+        )
+        SlaReportModel.session.commit()
         return False
 
-    report.update(data=report_data, completed_on=datetime.datetime.utcnow())
+    report_data = rows_to_data(sla_rows)
+    if not report_data:
+        logger.info(
+            "No calls for report {start} to {end}.\n".format(
+                start=start_time, end=end_time
+            )
+        )
+
+    histograms = rows_to_histograms(sla_rows)
+    report.update(
+        data=report_data,
+        histograms=histograms,
+        sketches=rows_to_sketches(sla_rows),
+        distributions_partial=distributions_missing(report_data, histograms),
+        status='complete' if report_data else 'empty',
+        completed_on=datetime.datetime.utcnow()
+    )
     SlaReportModel.session.commit()
     return True
 
 
-@celery.task(name='report.utilities.report_loader')
-def report_loader(*args):
-    reports_query = SlaReportModel.query.filter(
-        SlaReportModel.completed_on.is_(None)
+def refresh_sla_report(report):
+    """
+    Rebuild the rows of the dirty DIDs of a finished report and merge them
+    into its stored data, histograms and sketches. A failed refresh is
+    rolled back and leaves the report dirty for the next run.
+    """
+    start_time, end_time = report.start_time, report.end_time
+    dids = report.dirty_dids or []
+    try:
+        sla_rows = build_sla_rows(
+            start_time, end_time,
+            engine=current_app.config.get('SLA_REPORT_ENGINE', 'orm'),
+            dids=dids
+        )
+
+        report.update(
+            data=replace_rows(report.data, rows_to_data(sla_rows), dids),
+            histograms=replace_rows(report.histograms, rows_to_histograms(sla_rows), dids),
+            sketches=replace_rows(report.sketches, rows_to_sketches(sla_rows), dids),
+            dirty=False,
+            dirty_dids=None,
+            completed_on=datetime.datetime.utcnow()
+        )
+        report.update(
+            distributions_partial=distributions_missing(report.data, report.histograms),
+            status='complete' if report.data else 'empty'
+        )
+        SlaReportModel.session.commit()
+    except Exception:
+        logger.exception(
+            "Error: Could not refresh report for: {start} and {end}.\n".format(
+                start=start_time, end=end_time
+            )
+        )
+        SlaReportModel.session.rollback()
+        return False
+    logger.info(
+        "Refreshed {count} rows of report {start} to {end}".format(
+            count=len(dids), start=report.start_time, end=report.end_time
+        )
     )
+    return True
 
-    reports_query = reports_query.filter(
-        or_(
-            SlaReportModel.last_updated.is_(None),
-            SlaReportModel.last_updated + datetime.timedelta(minutes=2) < func.DATETIME(datetime.datetime.utcnow())
+
+def refresh_summary_report(report):
+    """
+    Rebuild the rows of the dirty DIDs of a finished summary from its
+    stored reports and merge them into the summary. A failed refresh is
+    rolled back and leaves the summary dirty for the next run.
+    """
+    start_time, end_time = report.start_time, report.end_time
+    dids = report.dirty_dids or []
+    try:
+        report_data = build_summary_sla_data(
+            start_time, end_time, report.interval, dids=dids
+        )
+        if isinstance(report_data, str):
+            logger.error(report_data)
+            return False
+
+        histograms, sketches, partial = build_summary_distributions(
+            start_time, end_time, report.interval, dids=dids
+        )
+        report.update(
+            data=replace_rows(report.data, report_data, dids),
+            histograms=replace_rows(report.histograms, histograms, dids),
+            sketches=replace_rows(report.sketches, sketches, dids),
+            distributions_partial=partial,
+            dirty=False,
+            dirty_dids=None,
+            completed_on=datetime.datetime.utcnow()
+        )
+        SummarySLAReportModel.session.commit()
+    except Exception:
+        logger.exception(
+            "Error: Could not refresh summary for: {start} and {end}.\n".format(
+                start=start_time, end=end_time
+            )
         )
+        SummarySLAReportModel.session.rollback()
+        return False
+    return True
+
+
+@celery.task(name='report.utilities.dirty_report_loader')
+def dirty_report_loader(*args):
+    """
+    Refresh the reports, and then the summaries, that late data has
+    marked dirty. One that fails stays dirty without stopping the rest.
+    """
+    max_reports = current_app.config.get('MAX_INTERVAL', 3)
+    reports = SlaReportModel.query.filter(
+        SlaReportModel.dirty.is_(True)
+    ).limit(max_reports).all()
+    failed = 0
+    for report in reports:
+        if not refresh_sla_report(report):
+            failed += 1
+
+    summaries = SummarySLAReportModel.query.filter(
+        SummarySLAReportModel.dirty.is_(True)
+    ).limit(max_reports).all()
+    for summary in summaries:
+        # Summaries are built from the stored reports, which must be
+        # refreshed first
+        if SlaReportModel.query.filter(
+            SlaReportModel.dirty.is_(True),
+            SlaReportModel.start_time < summary.end_time,
+            SlaReportModel.end_time > summary.start_time
+        ).first():
+            continue
+        if not refresh_summary_report(summary):
+            failed += 1
+
+    if not (reports or summaries):
+        logger.info("No dirty reports to refresh.")
+        return "Success: No dirty reports."
+    if failed:
+        return "Finished refreshing dirty reports, {count} failed.".format(count=failed)
+    return "Finished refreshing dirty reports."
+
+
+@celery.task(name='report.utilities.report_loader')
+def report_loader(*args):
+    # Unclaimed pending reports, and failed ones due for another attempt
+    reports_query = SlaReportModel.due(
+        datetime.datetime.utcnow(),
+        claim_period=datetime.timedelta(minutes=2),
+        retry_after=datetime.timedelta(seconds=current_app.config.get('REPORT_RETRY_AFTER', 600)),
+        max_attempts=current_app.config.get('REPORT_MAX_ATTEMPTS', 3)
     )
 
     # Minimize stressing the system by preventing massive queries
@@ -66,7 +225,7 @@ def report_loader(*args):
 
     reports_to_make = []
     for report_model in reports_query:
-        report_model.update(last_updated=datetime.datetime.utcnow())
+        report_model.update(status=None, last_updated=datetime.datetime.utcnow())
         reports_to_make.append((report_model.start_time, report_model.end_time))
     SlaReportModel.session.commit()
 
@@ -146,7 +305,16 @@ def make_summary_sla_report(*args, start_time=None, end_time=None, frequency=Non
         logger.error(report_data)
         return
 
-    report.update(data=report_data, completed_on=datetime.datetime.utcnow())
+    histograms, sketches, partial = build_summary_distributions(
+        start_time, end_time, report.interval
+    )
+    report.update(
+        data=report_data,
+        histograms=histograms,
+        sketches=sketches,
+        distributions_partial=partial,
+        completed_on=datetime.datetime.utcnow()
+    )
     SummarySLAReportModel.session.commit()
 
 
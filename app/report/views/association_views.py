@@ -3,7 +3,11 @@ from flask_security import current_user
 
 
 class TablesLoadedView(BaseView):
-    form_excluded_columns = ('last_updated', 'date_requested', 'calls_loaded', "events_loaded")
+    form_excluded_columns = (
+        'last_updated', 'date_requested', 'calls_loaded', "events_loaded",
+        'summary_loaded', 'cube_loaded', 'calls_checkpoint', 'events_checkpoint',
+        'calls_fingerprint', 'events_fingerprint', 'last_changed'
+    )
     column_list = ('loaded_date', 'last_updated', 'complete')
 
 
@@ -2,4 +2,4 @@ from app.base_view import BaseView
 
 
 class ClientView(BaseView):
-    pass
+    form_excluded_columns = ('last_updated',)
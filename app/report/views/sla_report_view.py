@@ -6,9 +6,12 @@ from flask_security import current_user
 
 class SLAReportView(BaseView):
     column_searchable_list = ("start_time", "end_time",)
-    column_exclude_list = ('date_requested', 'data',)
+    column_exclude_list = ('date_requested', 'data', 'histograms', 'sketches')
     column_details_list = ['data']
-    form_excluded_columns = ('last_updated', 'completed_on')
+    form_excluded_columns = (
+        'last_updated', 'completed_on', 'histograms', 'sketches', 'distributions_partial',
+        'dirty', 'dirty_dids', 'status', 'attempts'
+    )
 
     def _data_formatter(view, context, model, name):
         if model.data:
@@ -7,7 +7,10 @@ from flask_security import current_user
 class SLASummaryReportView(BaseView):
     column_searchable_list = ("start_time", "end_time",)
     column_details_list = ['data']
-    form_excluded_columns = ('last_updated', 'completed_on')
+    form_excluded_columns = (
+        'last_updated', 'completed_on', 'histograms', 'sketches', 'distributions_partial',
+        'dirty', 'dirty_dids'
+    )
     column_list = ('start_time', 'end_time', 'interval', 'last_updated', 'completed_on')
 
     def _data_formatter(view, context, model, name):
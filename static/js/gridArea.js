@@ -1,11 +1,48 @@
+// Reports that are not built yet answer 202 with the status url of the
+// build job; poll it, backing off, until the report is ready. Empty and
+// failed builds answer 200 with their status and no rows, which ends the
+// polling straight away
+function pollReportJob(statusUrl, params, callback, delay, attempts) {
+    if (attempts <= 0) {
+        callback({data: []});
+        return;
+    }
+    setTimeout(function () {
+        $.ajax({
+            url: statusUrl,
+            data: params,
+            method: "GET"
+        }).done(function (results, textStatus, xhr) {
+            if (xhr.status === 202) {
+                pollReportJob(results.status_url, params, callback, Math.min(delay * 2, 10000), attempts - 1);
+            } else {
+                callback(results);
+            }
+        }).fail(function () {
+            callback({data: []});
+        });
+    }, delay);
+}
+
 function getGridArea(ajaxFn, config, method) {
     return $(config['table_name']).DataTable({
         processing: true,
         pageLength: config['num_rows'],
-        ajax: {
-            url: config['api'],
-            data: ajaxFn,
-            method: method
+        ajax: function (data, callback) {
+            let params = ajaxFn(data);
+            $.ajax({
+                url: config['api'],
+                data: params,
+                method: method
+            }).done(function (results, textStatus, xhr) {
+                if (xhr.status === 202) {
+                    pollReportJob(results.status_url, params, callback, 1000, 30);
+                } else {
+                    callback(results);
+                }
+            }).fail(function () {
+                callback({data: []});
+            });
         },
         columns: [
             { title: "Client" },
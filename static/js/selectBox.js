@@ -30,6 +30,7 @@ function initSelectBox(url, select_tag) {
             .attr("id", "all-" + select_tag)
             .attr("label", "All clients")
     );
+    // Manager's clients first, so the full list can leave them out
     $.ajax({
         url: url,
         method: "POST",
@@ -46,31 +47,29 @@ function initSelectBox(url, select_tag) {
                 sortOptions(selectedOpts);
             }
             $selector.selectpicker("refresh");
-        }
-    });
-
-    $.get(url).done(function() {
-        // Ajax success
-        $.ajax({
-            url: url,
-            data: {active: true},
-            success: function (results, textStatus) {
-                if (textStatus === 'success') {
-                    $.each(results.data, function () {
-                        let selectedOpt = $("#report-select option[value='" + this['ext'] + "']");
-                        if(selectedOpt.length === 0)
-                        {
-                           $(otherOpts).append(
-                                $("<option></option>")
-                                    .val(this['ext'])
-                                    .html(this['name'])
-                            );
-                        }
-                    });
-                    sortOptions(otherOpts);
+        },
+        complete: function () {
+            $.ajax({
+                url: url,
+                data: {active: true},
+                success: function (results, textStatus) {
+                    if (textStatus === 'success') {
+                        $.each(results.data, function () {
+                            let selectedOpt = $("#report-select option[value='" + this['ext'] + "']");
+                            if(selectedOpt.length === 0)
+                            {
+                               $(otherOpts).append(
+                                    $("<option></option>")
+                                        .val(this['ext'])
+                                        .html(this['name'])
+                                );
+                            }
+                        });
+                        sortOptions(otherOpts);
+                    }
+                    $selector.selectpicker("refresh");
                 }
-                $selector.selectpicker("refresh");
-            }
-        });
+            });
+        }
     });
 }
\ No newline at end of file